@@ -0,0 +1,172 @@
+"""
+Recovery projections, absence streaks and at-risk ranking.
+
+``lectures.matrix`` gives a class's attendance for a range as one byte per
+(lecture, student). Each student's lectures are a strided slice of that
+grid, and their counts and absence streaks come from ``bytes`` operations
+(``replace``, ``count``, ``split``) that run in C. A class costs a few calls
+per student, not a Python step per mark.
+
+Thresholds follow the reports: a student is below one when their rounded
+percentage is, and students never marked count as 0%. Streaks are counted
+over the lectures a student was marked in, in date order (subject id order
+within a day).
+"""
+
+import math
+
+import lectures
+import reports
+
+THRESHOLD = 75.0
+# thresholds the routes accept, in steps of 0.01
+MIN_THRESHOLD = 1.0
+MAX_THRESHOLD = 99.99
+METRICS = ('needed', 'can_miss', 'longest_absence', 'current_absence')
+
+
+def _below(attended, total, threshold):
+	# same rounding as the reports' ``below`` filter
+	return (round(attended * 100.0 / total, 2) if total else 0.0) < threshold
+
+
+def parse_threshold(value):
+	"""``value`` (a query string) as a threshold; raises ValueError outside the accepted range."""
+	error = ValueError(f'threshold must be between {MIN_THRESHOLD:g} and {MAX_THRESHOLD:g} in steps of 0.01')
+	try:
+		threshold = float(value)
+	except ValueError:
+		raise error from None
+	if not MIN_THRESHOLD <= threshold <= MAX_THRESHOLD or abs(threshold * 100 - round(threshold * 100)) > 1e-6:
+		raise error
+	return round(threshold, 2)
+
+
+def _first(ok, hi):
+	# smallest n >= 1 with ok(n), ok being monotonic; hi is a guess to start from
+	lo = 0
+	while not ok(hi):
+		lo, hi = hi, hi * 2
+	while hi - lo > 1:
+		mid = (lo + hi) // 2
+		if ok(mid):
+			hi = mid
+		else:
+			lo = mid
+	return hi
+
+
+def needed(attended, total, threshold=THRESHOLD):
+	"""Lectures in a row a student must attend to reach ``threshold``; None if they never can."""
+	if not _below(attended, total, threshold):
+		return 0
+	if threshold >= 100:
+		return 1 if threshold == 100 and attended == total else None
+	# percentages from threshold - 0.005 up round to at least the threshold
+	cutoff = threshold - 0.005
+	guess = max(1, math.ceil((cutoff * total - 100 * attended) / (100 - cutoff)))
+	return _first(lambda n: not _below(attended + n, total + n, threshold), guess)
+
+
+def can_miss(attended, total, threshold=THRESHOLD):
+	"""Lectures a student can miss and still be at ``threshold``; None if there is no limit."""
+	if threshold <= 0:
+		return None
+	if _below(attended, total, threshold):
+		return 0
+	cutoff = max(threshold - 0.005, 0.005)
+	guess = max(1, math.floor(100 * attended / cutoff - total) + 1)
+	return _first(lambda m: _below(attended, total + m, threshold), guess) - 1
+
+
+def _student(marks, threshold):
+	# ``marks``: one byte per lecture the student was marked in, 1 Absent / 2 Present
+	total = len(marks)
+	attended = marks.count(2)
+	absences = marks.split(b'\x02')
+	return {
+		'attended': attended,
+		'total': total,
+		'percent': reports.percent(attended, total),
+		'needed': needed(attended, total, threshold),
+		'can_miss': can_miss(attended, total, threshold),
+		'longest_absence': max(map(len, absences)),
+		'current_absence': len(absences[-1]),
+	}
+
+
+def _grid_metrics(students, cells, threshold):
+	width = len(students)
+	metrics = {}
+	for column, sid in enumerate(students):
+		if sid is None:
+			continue
+		marks = cells[column::width].replace(b'\x00', b'')
+		if marks:
+			metrics[sid] = _student(marks, threshold)
+	return metrics
+
+
+def student_metrics(db, class_name, subject=None, start=None, end=None, threshold=THRESHOLD, by_subject=False):
+	"""{student_id: metrics} over the lectures of one class, or {(student_id, subject): ...}.
+
+	Each metrics dict has attended, total, percent and the ``METRICS``.
+	Students with no marks in range are left out.
+	"""
+	students, lecture_keys, cells = lectures.matrix(db, class_name, subject, start, end)
+	if not by_subject:
+		return _grid_metrics(students, cells, threshold)
+	width = len(students)
+	rows = {}
+	for n, (subject_id, _) in enumerate(lecture_keys):
+		rows.setdefault(subject_id, []).append(cells[n * width:(n + 1) * width])
+	names = {r[0]: r[1] for r in db.execute('SELECT subject_id, name FROM subjects')} if rows else {}
+	metrics = {}
+	for subject_id, grid in rows.items():
+		for sid, m in _grid_metrics(students, b''.join(grid), threshold).items():
+			metrics[(sid, names[subject_id])] = m
+	return metrics
+
+
+def annotate(db, rows, subject=None, start=None, end=None, threshold=THRESHOLD):
+	"""Add the ``METRICS`` to report rows in place; returns the rows.
+
+	``needed`` and ``can_miss`` use the row's own counts. The streaks come
+	from the lectures of the row's class, 0 for a student never marked.
+	"""
+	streaks = {cls: student_metrics(db, cls, subject, start, end, threshold) for cls in {r['class'] for r in rows}}
+	for r in rows:
+		m = streaks[r['class']].get(r['student_id'], {})
+		r['needed'] = needed(r['attended'], r['total'], threshold)
+		r['can_miss'] = can_miss(r['attended'], r['total'], threshold)
+		r['longest_absence'] = m.get('longest_absence', 0)
+		r['current_absence'] = m.get('current_absence', 0)
+	return rows
+
+
+def _risk(row):
+	# most lectures to recover first (never recoverable before all), then the ongoing absence
+	return (row['needed'] is not None, -(row['needed'] or 0), -row['current_absence'], row['percent'], row['roll_no'])
+
+
+def class_report(db, class_name, subject=None, start=None, end=None, threshold=THRESHOLD, limit=None):
+	"""Per-student metrics of one class's roster and, per subject, its students below ``threshold``.
+
+	Returns {'students': [...], 'at_risk': [{'subject': name, 'students': [...]}]},
+	students in roll order and each at-risk list ranked most urgent first
+	(at most ``limit`` per subject).
+	"""
+	roster = db.execute('SELECT student_id, roll_no, name, class FROM students WHERE class = ? ORDER BY roll_no',
+						(class_name,)).fetchall()
+	overall = student_metrics(db, class_name, subject, start, end, threshold)
+	per_subject = student_metrics(db, class_name, subject, start, end, threshold, by_subject=True)
+	people = {r['student_id']: dict(r) for r in roster}
+	students = [{**r, **overall.get(r['student_id'], _student(b'', threshold))} for r in people.values()]
+	at_risk = {}
+	for (sid, name), m in per_subject.items():
+		if sid in people and _below(m['attended'], m['total'], threshold):
+			at_risk.setdefault(name, []).append({**people[sid], **m})
+	ranked = []
+	for name in sorted(at_risk):
+		ranked.append({'subject': name, 'students': sorted(at_risk[name], key=_risk)[:limit]})
+	return {'students': students, 'at_risk': ranked}
@@ -1,18 +1,39 @@
+import hashlib
+import json
 import os
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
-from flask import Flask, g, render_template, request, redirect, url_for, session, flash, send_file
-from passlib.hash import pbkdf2_sha256
-from io import BytesIO, StringIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-
-DATABASE = os.path.join(os.path.dirname(__file__), 'attendance.db')
+import click
+from flask import Flask, g, render_template, request, redirect, url_for, session, flash, send_file, jsonify, abort, make_response
+
+import analytics
+import archive
+import cache
+import compact
+import database
+import exports
+import imports
+import jobs
+import lectures
+import marking
+import metrics
+import migrations
+import passwords
+import removal
+import reports
+import rollups
+import search as student_search
+import timing
+import versions
+import writer
+
+DATABASE = os.environ.get('ATTENDANCE_DB') or os.path.join(os.path.dirname(__file__), 'attendance.db')
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key')
+timing.init_app(app)
 
 # Utility: short roll display (last two digits)
 import re
@@ -28,91 +49,169 @@ app.jinja_env.filters['short_roll'] = short_roll
 
 # Database helpers
 
-def get_db():
-	if 'db' not in g:
-		g.db = sqlite3.connect(DATABASE)
-		g.db.row_factory = sqlite3.Row
-		g.db.execute('PRAGMA foreign_keys = ON')
-	return g.db
+pool = database.ConnectionPool(DATABASE)
+# marking and import writes are group-committed on one thread per process
+writes = writer.Writer(pool.connection, pool.release)
+report_cache = cache.VersionedCache()
+# registered after timing so its teardown still sees the request's timings
+metrics.init_app(app, report_cache)
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'export_cache')
 
 
-def get_table_columns(db, table_name):
-	try:
-		rows = db.execute(f"PRAGMA table_info({table_name})").fetchall()
-		return [r['name'] for r in rows]
-	except sqlite3.Error:
-		return []
+def get_db(readonly=False):
+	key = 'db_ro' if readonly else 'db'
+	if key not in g:
+		setattr(g, key, pool.connection(readonly=readonly))
+	return g.get(key)
 
 
 @app.teardown_appcontext
 def close_db(exception):
-	db = g.pop('db', None)
-	if db is not None:
-		db.close()
+	for key in ('db', 'db_ro'):
+		db = g.pop(key, None)
+		if db is not None:
+			pool.release(db)
 
 
-def init_db():
+def init_db(seed_data=False):
+	db = get_db()
+	applied = migrations.migrate_startup(db)
+	if migrations.current_version(db) < migrations.latest_version():
+		app.logger.warning('attendance conversion pending at schema version %d: run flask --app app compact-attendance',
+						   migrations.current_version(db))
+		app.config['SCHEMA_PENDING'] = True
+	# a fresh database gets the demo accounts on first start
+	if seed_data or (applied and applied[0] == 1):
+		migrations.seed(db)
+	return applied
+
+
+@app.before_request
+def require_schema():
+	# the code reads attendance_marks only, which is partial until compact-attendance has run
+	if not app.config.get('SCHEMA_PENDING') or request.endpoint == 'static':
+		return None
+	if migrations.current_version(get_db(readonly=True)) < migrations.latest_version():
+		return 'Attendance storage is being converted. Try again shortly.', 503, {'Retry-After': '30'}
+	app.config['SCHEMA_PENDING'] = False
+	return None
+
+
+@app.cli.command('migrate')
+@click.option('--target', type=int, default=None, help='Stop at this schema version (default: latest).')
+def migrate_command(target):
+	"""Apply pending schema migrations."""
+	applied = migrations.migrate(get_db(), target)
+	print(f'Applied migrations: {applied}' if applied else 'Database is up to date.')
+
+
+@app.cli.command('compact-attendance')
+@click.option('--batch', type=int, default=compact.BACKFILL_BATCH, show_default=True, help='Rows copied per transaction.')
+@click.option('--vacuum', is_flag=True, help='VACUUM once the conversion is done, to return the freed pages.')
+def compact_attendance_command(batch, vacuum):
+	"""Move attendance to the compact attendance_marks table while the app keeps serving."""
+	db = get_db()
+	if migrations.current_version(db) < 10:
+		migrations.migrate(db, 10)
+	while True:
+		with database.transaction(db):
+			copied = compact.backfill(db, batch)
+			progress = compact.backfill_progress(db)
+		if not copied:
+			break
+		print(f'{progress[0]} of {progress[1]} rows copied')
+	applied = migrations.migrate(db)
+	print(f'Applied migrations: {applied}' if applied else 'Attendance is already compact.')
+	if vacuum:
+		db.execute('VACUUM')
+
+
+@app.cli.command('seed')
+def seed_command():
+	"""Seed teacher phones and the default HOD account (idempotent)."""
+	changed = migrations.seed(get_db())
+	print(f'Seed complete, {changed} row(s) changed.')
+
+
+@app.cli.command('rebuild-rollups')
+@click.option('--verify-only', is_flag=True, help='Only compare the counters with raw attendance.')
+def rebuild_rollups_command(verify_only):
+	"""Regenerate attendance rollup counters from raw attendance and verify them."""
 	db = get_db()
-	with open(os.path.join(os.path.dirname(__file__), 'schema.sql'), 'r', encoding='utf-8') as f:
-		db.executescript(f.read())
-	db.commit()
-	cols = get_table_columns(db, 'teachers')
-	if 'subject' in cols or 'class_assigned' in cols:
-		db.executescript('''
-			DROP TABLE IF EXISTS teacher_assignments;
-			DROP TABLE IF EXISTS teachers;
-		''')
-		with open(os.path.join(os.path.dirname(__file__), 'schema.sql'), 'r', encoding='utf-8') as f:
-			db.executescript(f.read())
+	if not verify_only:
+		db.execute('BEGIN IMMEDIATE')
+		rollups.rebuild(db)
 		db.commit()
-	# ensure new columns exist (phone) and index
-	ensure_teacher_phone_column()
+	mismatches = rollups.verify(db)
+	print(f'Rollups verified, {mismatches} mismatch(es).')
+	if mismatches:
+		raise SystemExit(1)
 
 
-def ensure_teacher_phone_column():
+@app.cli.command('rebuild-bitmaps')
+@click.option('--verify-only', is_flag=True, help='Only compare the stored bitmaps with attendance_marks.')
+def rebuild_bitmaps_command(verify_only):
+	"""Regenerate the per-lecture attendance bitmaps and verify them."""
 	db = get_db()
-	cols = get_table_columns(db, 'teachers')
-	if 'phone' not in cols:
-		try:
-			db.execute('ALTER TABLE teachers ADD COLUMN phone TEXT')
-			db.commit()
-		except sqlite3.Error:
-			pass
-	try:
-		db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_teachers_phone ON teachers(phone)')
+	if not verify_only:
+		db.execute('BEGIN IMMEDIATE')
+		lectures.rebuild(db)
 		db.commit()
-	except sqlite3.Error:
-		pass
-
-
-# Seed minimal data if empty
-
-def seed_if_empty():
+	mismatches = lectures.verify(db)
+	print(f'Bitmaps verified, {mismatches} mismatch(es).')
+	if mismatches:
+		raise SystemExit(1)
+
+
+@app.cli.command('archive-semester')
+@click.option('--name', required=True, help='Archive name, also its file name (e.g. 2024-odd).')
+@click.option('--start', required=True, help='First date of the range (YYYY-MM-DD).')
+@click.option('--end', required=True, help='Last date of the range (YYYY-MM-DD).')
+@click.option('--batch', type=int, default=archive.BATCH, show_default=True, help='Rows copied or removed per transaction.')
+@click.option('--dir', 'directory', default=None, help='Directory for the archive file (default: ARCHIVE_DIR or archive/ next to the database).')
+def archive_semester_command(name, start, end, batch, directory):
+	"""Move a closed semester's attendance into its own read-only database file (resumable)."""
 	db = get_db()
-	c = db.cursor()
-	ensure_teacher_phone_column()
-	# existing student and teacher upserts ... (kept)
-	# Update teacher phones per provided list
-	phone_map = {
-		'Dr. Rachana Chavan Mam': '9637717113',
-		'Dr. Khan A.A. Mam': '9223684446',
-		'Dr. Quazi Khabeer Sir': '9604903027',
-		'Dr. Aarif Sir': '7006867886',
-		'Dr. Amit Kumar Sir': '9438363640',
-		'Dr. Rushikesh': '7276313014',
-		'Dr. Nikita Mam': '9764172599',
-	}
-	for name, phone in phone_map.items():
-		c.execute('UPDATE teachers SET phone = ? WHERE name = ?', (phone, name))
-	db.commit()
-	# ensure students default password is Test@123 already handled
-	# ensure admin exists handled elsewhere
-	# Ensure HOD exists
 	try:
-		db.execute('INSERT OR IGNORE INTO hods (name, phone, password_hash) VALUES (?,?,?)', ('Dr. Satish Gujar Sir', '9764996844', pbkdf2_sha256.hash('Satish123')))
-		db.commit()
-	except sqlite3.Error:
-		pass
+		row = archive.move(db, name, start, end, directory and os.path.abspath(directory), batch, progress=print)
+	except (ValueError, RuntimeError) as exc:
+		raise click.ClickException(str(exc))
+	print(f'Archive {row["name"]}: {row["rows"]} rows in {row["path"]} ({row["state"]}).')
+
+
+@app.cli.command('remove')
+@click.option('--class', 'classes', multiple=True, help='Remove a class: its students, attendance and teacher assignments (repeatable).')
+@click.option('--student', 'students', multiple=True, help='Remove a student by roll number or PRN (repeatable).')
+@click.option('--teacher', 'teachers', multiple=True, help='Remove a teacher by phone or name, with the attendance they recorded (repeatable).')
+@click.option('--batch', type=int, default=removal.BATCH, show_default=True, help='Rows removed per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only count what would be removed.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+@click.option('--vacuum', is_flag=True, help='Return the freed pages to the file system afterwards (incremental_vacuum).')
+def remove_command(classes, students, teachers, batch, dry_run, yes, vacuum):
+	"""Remove classes, students or teachers in short transactions while the app keeps serving."""
+	if not (classes or students or teachers):
+		raise click.UsageError('Give at least one --class, --student or --teacher.')
+	db = get_db()
+	unmatched = removal.select(db, classes, students, teachers)
+	for kind, values in unmatched.items():
+		print(f'No {kind} matches: {", ".join(values)}')
+	counts = removal.counts(db)
+	print('Would remove: ' if dry_run else 'Removing: ', end='')
+	print(', '.join(f'{n} {kind}' for kind, n in counts.items()))
+	if dry_run or not any(counts.values()):
+		return
+	if not yes:
+		click.confirm('Remove them?', abort=True)
+	removed = removal.remove(db, batch, progress=print)
+	print('Removed: ' + ', '.join(f'{n} {kind}' for kind, n in removed.items()))
+	if vacuum:
+		freed = removal.vacuum(db, progress=print)
+		print(f'Returned {freed} free pages to the file system.')
+
+
+if os.environ.get('AUTO_MIGRATE', '1') == '1':
+	with app.app_context():
+		init_db()
 
 
 # Auth utilities
@@ -133,6 +232,48 @@ def login_required(role=None):
 	return decorator
 
 
+def check_password(db, table, id_column, row, password, role):
+	"""One verify against ``row``; an out-of-date hash is replaced on success."""
+	ok, new_hash = passwords.verify(password, row['password_hash'], role)
+	if ok and new_hash:
+		db.execute(f'UPDATE {table} SET password_hash = ? WHERE {id_column} = ?', (new_hash, row[id_column]))
+		db.commit()
+	return ok
+
+
+def conditional_get(view):
+	"""Answer a GET with 304, before ``view`` runs any query, if the client's copy is current.
+
+	The strong ETag covers the endpoint, query string, logged-in user, today's
+	date (default ranges end today) and the data version; Last-Modified is the
+	last write. Pages with pending flash messages are always rendered.
+	"""
+	@wraps(view)
+	def wrapped_view(**kwargs):
+		if request.method != 'GET' or session.get('_flashes'):
+			return view(**kwargs)
+		version, modified = versions.state(get_db(readonly=True))
+		today = datetime.now().date()
+		key = json.dumps([request.endpoint, kwargs, sorted(request.args.items(multi=True)),
+						  session.get('user'), today.isoformat(), version], sort_keys=True, default=str)
+		etag = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+		midnight = datetime.combine(today, datetime.min.time()).timestamp()
+		last_modified = datetime.fromtimestamp(max(modified, midnight), timezone.utc).replace(microsecond=0)
+		if request.if_none_match:
+			fresh = request.if_none_match.contains(etag)
+		else:
+			fresh = request.if_modified_since is not None and request.if_modified_since >= last_modified
+		response = app.response_class(status=304) if fresh else make_response(view(**kwargs))
+		if response.status_code in (200, 304):
+			response.set_etag(etag)
+			response.last_modified = last_modified
+			# per-user pages: browsers must revalidate and keep one copy per session
+			response.headers['Cache-Control'] = 'private, no-cache'
+			response.vary.add('Cookie')
+		return response
+	return wrapped_view
+
+
 # Routes
 
 @app.route('/')
@@ -144,9 +285,6 @@ def index():
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
-	with app.app_context():
-		init_db()
-		seed_if_empty()
 	db = get_db()
 	if request.method == 'POST':
 		role = request.form.get('role')
@@ -158,23 +296,27 @@ def login():
 			if not row:
 				row = db.execute('SELECT * FROM students WHERE roll_no = ?', (username,)).fetchone()
 			if row:
-				if pbkdf2_sha256.verify(password, row['password_hash']) or password == 'Test@123':
-					if password == 'Test@123' and not pbkdf2_sha256.verify(password, row['password_hash']):
-						db.execute('UPDATE students SET password_hash = ? WHERE student_id = ?', (pbkdf2_sha256.hash('Test@123'), row['student_id']))
-						db.commit()
+				ok = check_password(db, 'students', 'student_id', row, password, role)
+				if not ok and password == imports.DEFAULT_STUDENT_PASSWORD:
+					# the default password always works and resets the stored hash to it
+					new_hash = passwords.hash_pooled(password)
+					db.execute('UPDATE students SET password_hash = ? WHERE student_id = ?', (new_hash, row['student_id']))
+					db.commit()
+					ok = True
+				if ok:
 					user = {'id': row['student_id'], 'name': row['name'], 'role': 'student', 'class': row['class'], 'semester': row['semester'], 'roll_no': row['roll_no'], 'prn': row['prn']}
 		elif role == 'teacher':
 			# login by phone number
 			row = db.execute('SELECT * FROM teachers WHERE phone = ?', (username,)).fetchone()
-			if row and pbkdf2_sha256.verify(password, row['password_hash']):
+			if row and check_password(db, 'teachers', 'teacher_id', row, password, role):
 				user = {'id': row['teacher_id'], 'name': row['name'], 'role': 'teacher'}
 		elif role == 'hod':
 			row = db.execute('SELECT * FROM hods WHERE phone = ?', (username.replace(' ', ''),)).fetchone()
-			if row and pbkdf2_sha256.verify(password, row['password_hash']):
+			if row and check_password(db, 'hods', 'hod_id', row, password, role):
 				user = {'id': row['hod_id'], 'name': row['name'], 'role': 'hod', 'phone': row['phone']}
 		elif role == 'admin':
 			row = db.execute('SELECT * FROM admins WHERE email = ?', (username,)).fetchone()
-			if row and pbkdf2_sha256.verify(password, row['password_hash']):
+			if row and check_password(db, 'admins', 'admin_id', row, password, role):
 				user = {'id': row['admin_id'], 'name': row['name'], 'role': 'admin', 'email': row['email']}
 		if user:
 			session['user'] = user
@@ -247,28 +389,51 @@ def teacher_mark():
 	if request.method == 'POST':
 		date_str = request.form.get('date') or selected_date
 		mark_all = request.form.get('mark_all') == 'on'
-		students = db.execute('SELECT * FROM students WHERE class = ? ORDER BY roll_no', (class_name,)).fetchall()
-		for student in students:
-			status = 'Present' if mark_all else request.form.get(f'status_{student["student_id"]}', 'Absent')
-			try:
-				db.execute('INSERT OR REPLACE INTO attendance (student_id, teacher_id, subject, class, date, status) VALUES (?,?,?,?,?,?)',
-						  (student['student_id'], teacher['id'], subject, class_name, date_str, status))
-			except sqlite3.IntegrityError:
-				pass
-		db.commit()
-		flash('Attendance saved', 'success')
+		try:
+			if mark_all:
+				changed = writes.run(marking.mark_all_present, teacher['id'], class_name, subject, date_str)
+			else:
+				statuses = {}
+				for key, value in request.form.items():
+					if key.startswith('status_') and key[7:].isdigit():
+						statuses[int(key[7:])] = value
+				changed = writes.run(marking.save_lecture, teacher['id'], class_name, subject, date_str, statuses)
+		except ValueError as exc:
+			flash(str(exc), 'error')
+			return redirect(url_for('teacher_mark', cls=class_name, subject=subject))
+		flash(f'Attendance saved ({changed} changed)', 'success')
 		return redirect(url_for('teacher_mark', cls=class_name, subject=subject, date=date_str))
 	students = db.execute('SELECT * FROM students WHERE class = ? ORDER BY roll_no', (class_name,)).fetchall()
-	existing = db.execute('SELECT student_id, status FROM attendance WHERE class = ? AND subject = ? AND date = ?',
-						  (class_name, subject, selected_date)).fetchall()
-	status_map = {row['student_id']: row['status'] for row in existing}
-	return render_template('teacher_mark.html', students=students, date=selected_date, status_map=status_map, teacher=teacher, class_name=class_name, subject=subject)
+	status_map = marking.lecture_statuses(db, class_name, subject, selected_date)
+	return render_template('teacher_mark.html', students=students, date=selected_date, status_map=status_map, teacher=teacher, class_name=class_name, subject=subject,
+						   max_batch_lectures=marking.MAX_BATCH_LECTURES)
+
+
+@app.route('/teacher/attendance/batch', methods=['POST'])
+@login_required(role='teacher')
+def teacher_attendance_batch():
+	"""Apply a batch of lectures from the offline marking queue in one transaction.
+
+	Body: {"batch_id": str, "lectures": [{"class", "subject", "date", "statuses":
+	{student_id: status}, "fill_absent": bool, "mark_all": bool}, ...]}. Re-sending
+	a batch id returns the stored result with "replayed": true.
+	"""
+	payload = request.get_json(silent=True) or {}
+	batch_id = payload.get('batch_id')
+	lectures = payload.get('lectures')
+	if not isinstance(batch_id, str) or not 0 < len(batch_id) <= 64 or not isinstance(lectures, list):
+		return jsonify({'error': 'batch_id (string) and lectures (list) are required'}), 400
+	if len(lectures) > marking.MAX_BATCH_LECTURES:
+		return jsonify({'error': f'at most {marking.MAX_BATCH_LECTURES} lectures per batch'}), 400
+	response, replayed = writes.run(marking.apply_batch, session['user']['id'], batch_id, lectures)
+	return jsonify({**response, 'replayed': replayed})
 
 
 @app.route('/teacher/report')
 @login_required(role='teacher')
+@conditional_get
 def teacher_report():
-	db = get_db()
+	db = get_db(readonly=True)
 	teacher = session['user']
 	class_name = request.args.get('cls')
 	subject = request.args.get('subject')
@@ -288,23 +453,15 @@ def teacher_report():
 		start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	students = db.execute('SELECT * FROM students WHERE class = ? ORDER BY roll_no', (class_name,)).fetchall()
-	report = []
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND subject = ? AND class = ? AND date BETWEEN ? AND ?',
-						 (s['student_id'], subject, class_name, start, end)).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
-		report.append({'roll_no': s['roll_no'], 'name': s['name'], 'total': total, 'attended': attended, 'percent': round(percent, 2)})
+	report = reports.attendance_summary(db, class_name=class_name, subject=subject, attendance_class=class_name, start=start, end=end)
 	return render_template('teacher_report.html', report=report, start=start, end=end, subject=subject, class_name=class_name)
 
 
 @app.route('/teacher/export/csv')
 @login_required(role='teacher')
+@conditional_get
 def teacher_export_csv():
-	import csv
-	db = get_db()
+	db = get_db(readonly=True)
 	teacher = session['user']
 	class_name = request.args.get('cls')
 	subject = request.args.get('subject')
@@ -319,29 +476,22 @@ def teacher_export_csv():
 		start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	students = db.execute('SELECT roll_no, name, student_id FROM students WHERE class = ? ORDER BY roll_no', (class_name,)).fetchall()
-	buf = StringIO(newline='')
-	writer = csv.writer(buf)
-	writer.writerow(['Roll No', 'Name', 'Total Lectures', 'Attended', '% Attendance', 'Class', 'Subject', 'From', 'To'])
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND subject = ? AND class = ? AND date BETWEEN ? AND ?', (s['student_id'], subject, class_name, start, end)).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
-		writer.writerow([s['roll_no'], s['name'], total, attended, f'{round(percent,2)}%', class_name, subject, start, end])
-	data = buf.getvalue().encode('utf-8')
-	return send_file(BytesIO(data), mimetype='text/csv; charset=utf-8', as_attachment=True, download_name=f'attendance_{class_name}_{subject}_{start}_to_{end}.csv')
-
-
-@app.route('/teacher/export/pdf')
+	report = reports.iter_summary(db, class_name=class_name, subject=subject, attendance_class=class_name, start=start, end=end)
+	rows = ([r['roll_no'], r['name'], r['total'], r['attended'], f"{r['percent']}%", class_name, subject, start, end] for r in report)
+	return exports.csv_response(['Roll No', 'Name', 'Total Lectures', 'Attended', '% Attendance', 'Class', 'Subject', 'From', 'To'],
+								rows, f'attendance_{class_name}_{subject}_{start}_to_{end}.csv')
+
+
+@app.route('/teacher/export/pdf', methods=['GET', 'POST'])
 @login_required(role='teacher')
+@conditional_get
 def teacher_export_pdf():
-	db = get_db()
+	db = get_db(readonly=True)
 	teacher = session['user']
-	class_name = request.args.get('cls')
-	subject = request.args.get('subject')
-	start = request.args.get('start')
-	end = request.args.get('end')
+	class_name = request.values.get('cls')
+	subject = request.values.get('subject')
+	start = request.values.get('start')
+	end = request.values.get('end')
 	if not class_name or not subject:
 		row = db.execute('SELECT class, subject FROM teacher_assignments WHERE teacher_id = ? ORDER BY class, subject LIMIT 1', (teacher['id'],)).fetchone()
 		if row:
@@ -351,58 +501,54 @@ def teacher_export_pdf():
 		start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	students = db.execute('SELECT roll_no, name, student_id FROM students WHERE class = ? ORDER BY roll_no', (class_name,)).fetchall()
-	rows_out = []
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND subject = ? AND class = ? AND date BETWEEN ? AND ?', (s['student_id'], subject, class_name, start, end)).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		pct = round((attended / total * 100), 2) if total > 0 else 0.0
-		rows_out.append((s['roll_no'], s['name'], total, attended, pct))
-	buf = BytesIO()
-	width, height = letter
-	p = canvas.Canvas(buf, pagesize=letter)
-	p.setFont('Helvetica-Bold', 12)
-	p.drawString(72, height - 72, f'Attendance Report: {class_name} - {subject}')
-	p.setFont('Helvetica', 10)
-	p.drawString(72, height - 88, f'From {start} to {end}')
-	# table headers
-	y = height - 110
-	headers = ['Roll No','Name','Total','Attended','%']
-	col_x = [72, 150, 400, 450, 500]
-	p.setFont('Helvetica-Bold', 10)
-	for i, htxt in enumerate(headers):
-		p.drawString(col_x[i], y, htxt)
-	p.line(72, y-2, 540, y-2)
-	p.setFont('Helvetica', 10)
-	y -= 14
-	for rno, name, total, att, pct in rows_out:
-		if pct < 40:
-			p.setFillColorRGB(0.5, 0.0, 0.0)
-		else:
-			p.setFillColorRGB(0, 0, 0)
-		p.drawString(col_x[0], y, str(rno))
-		p.drawString(col_x[1], y, str(name)[:36])
-		p.drawRightString(col_x[2]+20, y, str(total))
-		p.drawRightString(col_x[3]+20, y, str(att))
-		p.drawRightString(col_x[4]+20, y, str(pct))
-		y -= 14
-		if y < 72:
-			p.showPage()
-			p.setFont('Helvetica', 10)
-			y = height - 72
-	p.showPage()
-	p.save()
-	buf.seek(0)
-	return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name=f'attendance_{class_name}_{subject}_{start}_to_{end}.pdf')
+	params = {'class': class_name, 'subject': subject, 'start': start, 'end': end}
+	return start_export('teacher', params, f'attendance_{class_name}_{subject}_{start}_to_{end}.pdf')
+
+
+def register_params(db, values):
+	"""(class, subject, start, end) of a register export, defaulting like the teacher report."""
+	class_name = values.get('cls')
+	subject = values.get('subject')
+	start = values.get('start')
+	end = values.get('end')
+	if not class_name or not subject:
+		row = db.execute('SELECT class, subject FROM teacher_assignments WHERE teacher_id = ? ORDER BY class, subject LIMIT 1', (session['user']['id'],)).fetchone()
+		if row:
+			class_name, subject = row['class'], row['subject']
+	if not start or not end:
+		end_date = datetime.now().date()
+		start_date = end_date - timedelta(days=6)
+		start = start_date.strftime('%Y-%m-%d')
+		end = end_date.strftime('%Y-%m-%d')
+	return class_name, subject, start, end
+
+
+@app.route('/teacher/register/csv')
+@login_required(role='teacher')
+@conditional_get
+def teacher_register_csv():
+	db = get_db(readonly=True)
+	class_name, subject, start, end = register_params(db, request.args)
+	header, rows = exports.register_csv(*reports.register(db, class_name, subject, start, end))
+	return exports.csv_response(header, rows, f'register_{class_name}_{subject}_{start}_to_{end}.csv')
+
+
+@app.route('/teacher/register/docx', methods=['GET', 'POST'])
+@login_required(role='teacher')
+@conditional_get
+def teacher_register_docx():
+	class_name, subject, start, end = register_params(get_db(readonly=True), request.values)
+	params = {'class': class_name, 'subject': subject, 'start': start, 'end': end}
+	return start_export('register', params, f'register_{class_name}_{subject}_{start}_to_{end}.docx')
 
 
 # Student views
 
 @app.route('/student/dashboard')
 @login_required(role='student')
+@conditional_get
 def student_dashboard():
-	db = get_db()
+	db = get_db(readonly=True)
 	student = session['user']
 	period = request.args.get('period', 'weekly')
 	start = request.args.get('start')
@@ -422,14 +568,16 @@ def student_dashboard():
 			start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	rows = db.execute('SELECT date, subject, status FROM attendance WHERE student_id = ? AND date BETWEEN ? AND ? ORDER BY date DESC',
-					 (student['id'], start, end)).fetchall()
+	rows = reports.student_marks(db, student['id'], start, end)
 	# subject-wise percentages in period - derive dynamically from teacher_assignments for student's class
 	subject_rows = db.execute('SELECT DISTINCT subject FROM teacher_assignments WHERE class = ? ORDER BY subject', (student['class'],)).fetchall()
 	all_subjects = [r['subject'] for r in subject_rows] if subject_rows else []
 	# Fall back to subjects observed in attendance if no assignments found
 	if not all_subjects:
-		att_subj_rows = db.execute('SELECT DISTINCT subject FROM attendance WHERE class = ? ORDER BY subject', (student['class'],)).fetchall()
+		att_subj_rows = db.execute(
+			'SELECT sub.name AS subject FROM subjects sub WHERE EXISTS (SELECT 1 FROM attendance_marks m'
+			f" WHERE m.class_id = {compact.class_id_sql('?')} AND m.subject_id = sub.subject_id) ORDER BY sub.name",
+			(student['class'],)).fetchall()
 		all_subjects = [r['subject'] for r in att_subj_rows]
 	# Course code mapping (case-insensitive, simple normalization)
 	subject_code_map = {
@@ -444,20 +592,18 @@ def student_dashboard():
 	}
 	def normalize(name: str) -> str:
 		return (name or '').strip().lower().replace('\u00a0',' ').replace('  ',' ')
+	totals = reports.subject_totals(db, student['id'], start, end)
 	percents = []
 	for sub in all_subjects:
-		rows_sub = db.execute('SELECT status FROM attendance WHERE student_id = ? AND subject = ? AND date BETWEEN ? AND ?',
-							 (student['id'], sub, start, end)).fetchall()
-		total = len(rows_sub)
-		attended = sum(1 for r in rows_sub if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
+		attended, total = totals.get(sub, (0, 0))
 		code = subject_code_map.get(normalize(sub), '')
 		percents.append({
 			'subject': sub,
 			'code': code,
 			'total': total,
 			'attended': attended,
-			'percent': round(percent, 2)
+			'percent': reports.percent(attended, total),
+			'needed': analytics.needed(attended, total),
 		})
 	# alert threshold
 	below = [p for p in percents if p['percent'] < 75.0]
@@ -466,10 +612,65 @@ def student_dashboard():
 
 # Admin views
 
+REPORT_PAGE_SIZE = int(os.environ.get('REPORT_PAGE_SIZE', '100'))
+PAGE_SIZES = (25, 50, 100, 250, 500)
+
+
+def report_page(db, route, class_name, subject, search, start, end):
+	"""Template context for one page of a report, reused until the data changes.
+
+	Both the report and its defaulters (<75%) are keyset-paginated in the
+	requested sort order: ``after``/``d_after`` are the cursors of their pages.
+	"""
+	sort = request.args.get('sort', 'roll')
+	if sort not in reports.SORTS:
+		sort = 'roll'
+	per_page = request.args.get('per_page', type=int) or REPORT_PAGE_SIZE
+	per_page = min(max(per_page, 10), max(PAGE_SIZES))
+	after = request.args.get('after') or None
+	d_after = request.args.get('d_after') or None
+	filters = {'class_name': class_name, 'subject': subject, 'start': start, 'end': end, 'search': search}
+
+	def compute():
+		# derive classes/subjects options
+		classes = [r['class'] for r in db.execute('SELECT DISTINCT class FROM students').fetchall()]
+		subjects = [r['subject'] for r in db.execute('SELECT DISTINCT subject FROM teacher_assignments').fetchall()]
+		report, next_after = reports.summary_page(db, sort, after, per_page, **filters)
+		defaulters, next_d_after = reports.summary_page(db, sort, d_after, per_page, below=75.0, **filters)
+		analytics.annotate(db, report + defaulters, subject, start, end)
+		return classes, subjects, report, next_after, defaulters, next_d_after
+
+	key = (route, class_name, subject, search, start, end, sort, per_page, after, d_after)
+	(classes, subjects, report, next_after, defaulters, next_d_after), _ = report_cache.get_or_compute(key, versions.current(db), compute)
+	args = {'class': class_name, 'subject': subject, 'search': search, 'start': start, 'end': end, 'sort': sort, 'per_page': per_page}
+	return {
+		'classes': classes, 'subjects': subjects, 'report': report, 'defaulters': defaulters,
+		'sort': sort, 'per_page': per_page, 'page_sizes': PAGE_SIZES,
+		'first_url': url_for(route, **args, d_after=d_after) if after else None,
+		'next_url': url_for(route, **args, after=next_after, d_after=d_after) if next_after else None,
+		'd_first_url': url_for(route, **args, after=after) if d_after else None,
+		'd_next_url': url_for(route, **args, after=after, d_after=next_d_after) if next_d_after else None,
+	}
+
+
+@app.route('/admin/cache-stats')
+@login_required(role='admin')
+def admin_cache_stats():
+	return jsonify(report_cache.stats())
+
+
+@app.route('/students/search')
+@login_required(role=('admin', 'hod', 'teacher'))
+def student_typeahead():
+	limit = min(max(request.args.get('limit', type=int) or student_search.TYPEAHEAD_LIMIT, 1), 50)
+	return jsonify(student_search.typeahead(get_db(readonly=True), request.args.get('q', ''), limit))
+
+
 @app.route('/admin/reports')
 @login_required(role='admin')
+@conditional_get
 def admin_reports():
-	db = get_db()
+	db = get_db(readonly=True)
 	class_name = request.args.get('class')
 	subject = request.args.get('subject')
 	search = request.args.get('search', '').strip()
@@ -480,38 +681,40 @@ def admin_reports():
 		start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	# derive classes/subjects options
-	classes = [r['class'] for r in get_db().execute('SELECT DISTINCT class FROM students').fetchall()]
-	subjects = [r['subject'] for r in get_db().execute('SELECT DISTINCT subject FROM teacher_assignments').fetchall()]
-	# base students list
-	query = 'SELECT * FROM students WHERE 1=1'
-	params = []
-	if class_name:
-		query += ' AND class = ?'
-		params.append(class_name)
-	if search:
-		query += ' AND (roll_no LIKE ? OR name LIKE ?)'
-		params.extend([f'%{search}%', f'%{search}%'])
-	query += ' ORDER BY roll_no'
-	students = db.execute(query, params).fetchall()
-	report = []
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND date BETWEEN ? AND ?' + (' AND subject = ?' if subject else ''),
-						 ([s['student_id'], start, end] + ([subject] if subject else []))).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
-		report.append({'roll_no': s['roll_no'], 'name': s['name'], 'class': s['class'], 'total': total, 'attended': attended, 'percent': round(percent, 2)})
-	# defaulters
-	defaulters = [r for r in report if r['percent'] < 75.0]
-	return render_template('admin_reports.html', report=report, defaulters=defaulters, classes=classes, subjects=subjects, class_name=class_name, subject=subject, search=search, start=start, end=end)
+	page = report_page(db, 'admin_reports', class_name, subject, search, start, end)
+	return render_template('admin_reports.html', class_name=class_name, subject=subject, search=search, start=start, end=end, **page)
+
+
+@app.route('/admin/analytics')
+@login_required(role=('admin', 'hod'))
+@conditional_get
+def admin_analytics():
+	"""Recovery projections, absence streaks and ranked at-risk students per class, as JSON."""
+	db = get_db(readonly=True)
+	class_name = request.args.get('class') or None
+	subject = request.args.get('subject') or None
+	start = request.args.get('start') or None
+	end = request.args.get('end') or None
+	limit = request.args.get('limit', type=int)
+	try:
+		threshold = analytics.parse_threshold(request.args.get('threshold', analytics.THRESHOLD))
+	except ValueError as exc:
+		return jsonify({'error': str(exc)}), 400
+
+	def compute():
+		classes = [class_name] if class_name else [r['class'] for r in db.execute('SELECT DISTINCT class FROM students ORDER BY class')]
+		return [{'class': cls, **analytics.class_report(db, cls, subject, start, end, threshold, limit)} for cls in classes]
+
+	key = ('admin_analytics', class_name, subject, start, end, threshold, limit)
+	classes, _ = report_cache.get_or_compute(key, versions.current(db), compute)
+	return jsonify({'subject': subject, 'start': start, 'end': end, 'threshold': threshold, 'classes': classes})
 
 
 @app.route('/admin/export/csv')
 @login_required(role='admin')
+@conditional_get
 def admin_export_csv():
-	import csv
-	db = get_db()
+	db = get_db(readonly=True)
 	class_name = request.args.get('class')
 	subject = request.args.get('subject')
 	end = request.args.get('end')
@@ -522,65 +725,23 @@ def admin_export_csv():
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
 	# gather report same as admin_reports
-	query_students = 'SELECT * FROM students'
-	params_students = []
-	if class_name:
-		query_students += ' WHERE class = ?'
-		params_students.append(class_name)
-	students = db.execute(query_students, params_students).fetchall()
-	output = BytesIO()
-	writer = csv.writer(output)
-	writer.writerow(['Roll No', 'Name', 'Class', 'Total Lectures', 'Attended', '% Attendance'])
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND date BETWEEN ? AND ?' + (' AND subject = ?' if subject else ''),
-						 ([s['student_id'], start, end] + ([subject] if subject else []))).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
-		writer.writerow([s['roll_no'], s['name'], s['class'], total, attended, f'{round(percent,2)}%'])
-	output.seek(0)
-	return send_file(output, mimetype='text/csv', as_attachment=True, download_name='attendance_report.csv')
-
-
-@app.route('/admin/export/pdf')
+	report = reports.iter_summary(db, class_name=class_name, subject=subject, start=start, end=end)
+	rows = ([r['roll_no'], r['name'], r['class'], r['total'], r['attended'], f"{r['percent']}%"] for r in report)
+	return exports.csv_response(['Roll No', 'Name', 'Class', 'Total Lectures', 'Attended', '% Attendance'],
+								rows, 'attendance_report.csv', mimetype='text/csv')
+
+
+@app.route('/admin/export/pdf', methods=['GET', 'POST'])
 @login_required(role='admin')
+@conditional_get
 def admin_export_pdf():
 	# Minimal PDF export of defaulters
-	db = get_db()
 	end_date = datetime.now().date()
 	start_date = end_date - timedelta(days=6)
-	start = request.args.get('start', start_date.strftime('%Y-%m-%d'))
-	end = request.args.get('end', end_date.strftime('%Y-%m-%d'))
-	rows = db.execute('SELECT s.roll_no, s.name, s.class, a.status FROM attendance a JOIN students s ON a.student_id = s.student_id WHERE a.date BETWEEN ? AND ? ORDER BY s.roll_no',
-					 (start, end)).fetchall()
-	buffer = BytesIO()
-	p = canvas.Canvas(buffer, pagesize=letter)
-	width, height = letter
-	p.setFont('Helvetica-Bold', 14)
-	p.drawString(72, height - 72, 'Attendance Report (Defaulters <75%)')
-	p.setFont('Helvetica', 10)
-	y = height - 100
-	counts = {}
-	for r in rows:
-		key = (r['roll_no'], r['name'], r['class'])
-		counts.setdefault(key, {'total': 0, 'attended': 0})
-		counts[key]['total'] += 1
-		if r['status'] == 'Present':
-			counts[key]['attended'] += 1
-	for (roll_no, name, cls), stat in sorted(counts.items()):
-		percent = (stat['attended'] / stat['total'] * 100) if stat['total'] > 0 else 0
-		if percent < 75:
-			line = f"{roll_no}  {name}  {cls}  {stat['attended']}/{stat['total']}  {round(percent,2)}%"
-			p.drawString(72, y, line)
-			y -= 16
-			if y < 72:
-				p.showPage()
-				p.setFont('Helvetica', 10)
-				y = height - 72
-	p.showPage()
-	p.save()
-	buffer.seek(0)
-	return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name='defaulters.pdf')
+	start = request.values.get('start', start_date.strftime('%Y-%m-%d'))
+	end = request.values.get('end', end_date.strftime('%Y-%m-%d'))
+	params = {'title': 'Attendance Report (Defaulters <75%)', 'start': start, 'end': end}
+	return start_export('admin', params, 'defaulters.pdf')
 
 
 @app.route('/admin/students/import', methods=['GET','POST'])
@@ -595,41 +756,18 @@ def admin_students_import():
 		if not cls or not text:
 			flash('Please choose class and paste the data.', 'error')
 			return render_template('admin_students_import.html', classes=classes)
-		added = 0
-		updated = 0
-		for raw in text.splitlines():
-			line = raw.strip()
-			if not line:
-				continue
-			roll = prn = name = None
-			if ',' in line:
-				parts = [p.strip() for p in line.split(',') if p.strip()]
-				if len(parts) >= 3:
-					roll, prn = parts[0], parts[1]
-					name = ','.join(parts[2:]).strip()
-			else:
-				parts = line.split()
-				if len(parts) >= 3:
-					roll, prn = parts[0], parts[1]
-					name = ' '.join(parts[2:])
-			if not roll or not prn or not name:
-				continue
-			row = db.execute('SELECT student_id FROM students WHERE roll_no = ?', (roll,)).fetchone()
-			if row:
-				db.execute('UPDATE students SET prn = ?, name = ?, class = ?, semester = ? WHERE student_id = ?', (prn, name, cls, 2, row['student_id']))
-				updated += 1
-			else:
-				db.execute('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,?,?)', (roll, prn, name, cls, 2, pbkdf2_sha256.hash('Test@123')))
-				added += 1
-		db.commit()
+		rows = imports.parse_students(text.splitlines())
+		default_hash = passwords.hash_pooled(imports.DEFAULT_STUDENT_PASSWORD)
+		added, updated = writes.run(imports.import_students, rows, cls, 2, None, default_hash)
 		flash(f'Import complete. Added {added}, Updated {updated}.', 'success')
 		return redirect(url_for('admin_reports', **{'class': cls}))
 	return render_template('admin_students_import.html', classes=classes)
 
 
 @app.route('/sheet')
+@conditional_get
 def sheet_reports():
-	db = get_db()
+	db = get_db(readonly=True)
 	class_name = request.args.get('class')
 	subject = request.args.get('subject')
 	search = request.args.get('search', '').strip()
@@ -640,34 +778,14 @@ def sheet_reports():
 		start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	classes = [r['class'] for r in get_db().execute('SELECT DISTINCT class FROM students').fetchall()]
-	subjects = [r['subject'] for r in get_db().execute('SELECT DISTINCT subject FROM teacher_assignments').fetchall()]
-	query = 'SELECT * FROM students WHERE 1=1'
-	params = []
-	if class_name:
-		query += ' AND class = ?'
-		params.append(class_name)
-	if search:
-		query += ' AND (roll_no LIKE ? OR name LIKE ?)'
-		params.extend([f'%{search}%', f'%{search}%'])
-	query += ' ORDER BY roll_no'
-	students = db.execute(query, params).fetchall()
-	report = []
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND date BETWEEN ? AND ?' + (' AND subject = ?' if subject else ''),
-						 ([s['student_id'], start, end] + ([subject] if subject else []))).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
-		report.append({'roll_no': s['roll_no'], 'name': s['name'], 'class': s['class'], 'total': total, 'attended': attended, 'percent': round(percent, 2)})
-	defaulters = [r for r in report if r['percent'] < 75.0]
-	return render_template('admin_reports.html', report=report, defaulters=defaulters, classes=classes, subjects=subjects, class_name=class_name, subject=subject, search=search, start=start, end=end, page_title='Attendance Sheet', is_sheet=True)
+	page = report_page(db, 'sheet_reports', class_name, subject, search, start, end)
+	return render_template('admin_reports.html', class_name=class_name, subject=subject, search=search, start=start, end=end, page_title='Attendance Sheet', is_sheet=True, **page)
 
 
 @app.route('/sheet/export/csv')
+@conditional_get
 def sheet_export_csv():
-	import csv
-	db = get_db()
+	db = get_db(readonly=True)
 	class_name = request.args.get('class')
 	subject = request.args.get('subject')
 	end = request.args.get('end')
@@ -677,67 +795,112 @@ def sheet_export_csv():
 		start_date = end_date - timedelta(days=6)
 		start = start_date.strftime('%Y-%m-%d')
 		end = end_date.strftime('%Y-%m-%d')
-	query_students = 'SELECT * FROM students'
-	params_students = []
-	if class_name:
-		query_students += ' WHERE class = ?'
-		params_students.append(class_name)
-	students = db.execute(query_students, params_students).fetchall()
-	output = BytesIO()
-	writer = csv.writer(StringIO())
-	# We need a BytesIO-compatible buffer; write text then encode
-	text_buf = StringIO()
-	w = csv.writer(text_buf)
-	w.writerow(['Roll No', 'Name', 'Class', 'Total Lectures', 'Attended', '% Attendance', 'From', 'To', 'Subject'])
-	for s in students:
-		rows = db.execute('SELECT status FROM attendance WHERE student_id = ? AND date BETWEEN ? AND ?' + (' AND subject = ?' if subject else ''),
-						 ([s['student_id'], start, end] + ([subject] if subject else []))).fetchall()
-		total = len(rows)
-		attended = sum(1 for r in rows if r['status'] == 'Present')
-		percent = (attended / total * 100) if total > 0 else 0.0
-		w.writerow([s['roll_no'], s['name'], s['class'], total, attended, f'{round(percent,2)}%', start, end, subject or 'All'])
-	data = text_buf.getvalue().encode('utf-8')
-	return send_file(BytesIO(data), mimetype='text/csv; charset=utf-8', as_attachment=True, download_name='attendance_sheet.csv')
-
-
-@app.route('/sheet/export/pdf')
+	report = reports.iter_summary(db, class_name=class_name, subject=subject, start=start, end=end)
+	rows = ([r['roll_no'], r['name'], r['class'], r['total'], r['attended'], f"{r['percent']}%", start, end, subject or 'All'] for r in report)
+	return exports.csv_response(['Roll No', 'Name', 'Class', 'Total Lectures', 'Attended', '% Attendance', 'From', 'To', 'Subject'],
+								rows, 'attendance_sheet.csv')
+
+
+@app.route('/sheet/export/pdf', methods=['GET', 'POST'])
+@conditional_get
 def sheet_export_pdf():
 	# reuse admin defaulters export for selected range
-	db = get_db()
 	end_date = datetime.now().date()
 	start_date = end_date - timedelta(days=6)
-	start = request.args.get('start', start_date.strftime('%Y-%m-%d'))
-	end = request.args.get('end', end_date.strftime('%Y-%m-%d'))
-	rows = db.execute('SELECT s.roll_no, s.name, s.class, a.status FROM attendance a JOIN students s ON a.student_id = s.student_id WHERE a.date BETWEEN ? AND ? ORDER BY s.roll_no',
-					 (start, end)).fetchall()
-	buffer = BytesIO()
-	p = canvas.Canvas(buffer, pagesize=letter)
-	width, height = letter
-	p.setFont('Helvetica-Bold', 14)
-	p.drawString(72, height - 72, 'Attendance Sheet (Defaulters <75%)')
-	p.setFont('Helvetica', 10)
-	y = height - 100
-	counts = {}
-	for r in rows:
-		key = (r['roll_no'], r['name'], r['class'])
-		counts.setdefault(key, {'total': 0, 'attended': 0})
-		counts[key]['total'] += 1
-		if r['status'] == 'Present':
-			counts[key]['attended'] += 1
-	for (roll_no, name, cls), stat in sorted(counts.items()):
-		percent = (stat['attended'] / stat['total'] * 100) if stat['total'] > 0 else 0
-		if percent < 75:
-			line = f"{roll_no}  {name}  {cls}  {stat['attended']}/{stat['total']}  {round(percent,2)}%"
-			p.drawString(72, y, line)
-			y -= 16
-			if y < 72:
-				p.showPage()
-				p.setFont('Helvetica', 10)
-				y = height - 72
-	p.showPage()
-	p.save()
-	buffer.seek(0)
-	return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name='attendance_sheet_defaulters.pdf')
+	start = request.values.get('start', start_date.strftime('%Y-%m-%d'))
+	end = request.values.get('end', end_date.strftime('%Y-%m-%d'))
+	params = {'title': 'Attendance Sheet (Defaulters <75%)', 'start': start, 'end': end}
+	return start_export('sheet', params, 'attendance_sheet_defaulters.pdf')
+
+
+# Background exports
+
+def render_class_report(db, params, out, progress):
+	report = reports.attendance_summary(db, class_name=params['class'], subject=params['subject'], attendance_class=params['class'], start=params['start'], end=params['end'])
+	exports.class_report_pdf(out, report, params['class'], params['subject'], params['start'], params['end'], progress)
+
+
+def render_defaulters(db, params, out, progress):
+	report = reports.attendance_summary(db, start=params['start'], end=params['end'], marked_only=True, below=75.0)
+	exports.defaulters_pdf(out, report, params['title'], progress=progress)
+
+
+def render_register(db, params, out, progress):
+	dates, rows = reports.register(db, params['class'], params['subject'], params['start'], params['end'])
+	exports.register_docx(out, dates, rows, params['class'], params['subject'], params['start'], params['end'], progress)
+
+
+PDF = 'application/pdf'
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# kind -> (renderer, roles allowed to fetch it (None for public), mimetype)
+EXPORTS = {
+	'teacher': (render_class_report, ('teacher',), PDF),
+	'admin': (render_defaulters, ('admin',), PDF),
+	'sheet': (render_defaulters, None, PDF),
+	'register': (render_register, ('teacher',), DOCX),
+}
+
+export_jobs = jobs.ExportJobs(EXPORT_CACHE_DIR, lambda: pool.connection(readonly=True), pool.release)
+
+
+def job_status(job):
+	status = job.as_dict()
+	status['status_url'] = url_for('export_status', job_id=job.id)
+	if job.done:
+		status['download_url'] = url_for('export_download', job_id=job.id)
+		status['timings_ms'] = {name: round(seconds * 1e3, 1) for name, seconds in job.timings.items()}
+	return status
+
+
+def start_export(kind, params, download_name):
+	"""Serve a cached export, or queue it and send the client to its status page.
+
+	POST always answers with the job status as JSON (202 while pending).
+	"""
+	version = versions.current(get_db(readonly=True))
+	job = export_jobs.submit(kind, params, version, download_name, EXPORTS[kind][0])
+	metrics.EXPORT_REQUESTS.inc(kind, 'ready' if job.done else job.state)
+	if request.method == 'POST':
+		return jsonify(job_status(job)), 200 if job.done else 202
+	if job.done:
+		return send_file(job.path, mimetype=EXPORTS[kind][2], as_attachment=True, download_name=job.download_name)
+	return redirect(url_for('export_status', job_id=job.id))
+
+
+def export_job_or_404(job_id):
+	job = export_jobs.get(job_id)
+	if job is None:
+		abort(404)
+	roles = EXPORTS[job.kind][1]
+	if roles and session.get('user', {}).get('role') not in roles:
+		abort(403)
+	return job
+
+
+@app.route('/exports/<job_id>')
+def export_status(job_id):
+	job = export_job_or_404(job_id)
+	if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+		return jsonify(job_status(job))
+	return render_template('export_status.html', job=job)
+
+
+@app.route('/exports/<job_id>/download')
+def export_download(job_id):
+	job = export_job_or_404(job_id)
+	if not job.done:
+		return redirect(url_for('export_status', job_id=job.id))
+	# the render happened in the export job, not in this request
+	timing.note('export', job.timings.get('render', 0.0))
+	timing.note('export-db', job.timings.get('db', 0.0))
+	return send_file(job.path, mimetype=EXPORTS[job.kind][2], as_attachment=True, download_name=job.download_name)
+
+
+@app.cli.command('prune-exports')
+def prune_exports_command():
+	"""Remove export cache files that are too old or over the size budget."""
+	print(f'Removed {export_jobs.prune()} cached export(s).')
 
 
 # Teacher change password
@@ -751,13 +914,14 @@ def teacher_change_password():
 		newpass = request.form.get('newpass', '')
 		confirm = request.form.get('confirm', '')
 		row = db.execute('SELECT password_hash FROM teachers WHERE teacher_id = ?', (teacher['id'],)).fetchone()
-		if not row or not pbkdf2_sha256.verify(current, row['password_hash']):
+		if not row or not passwords.verify(current, row['password_hash'], 'teacher')[0]:
 			flash('Current password is incorrect', 'error')
 			return render_template('teacher_change_password.html')
 		if not newpass or newpass != confirm:
 			flash('Passwords do not match', 'error')
 			return render_template('teacher_change_password.html')
-		db.execute('UPDATE teachers SET password_hash = ? WHERE teacher_id = ?', (pbkdf2_sha256.hash(newpass), teacher['id']))
+		new_hash = passwords.hash_pooled(newpass)
+		db.execute('UPDATE teachers SET password_hash = ? WHERE teacher_id = ?', (new_hash, teacher['id']))
 		db.commit()
 		flash('Password updated', 'success')
 		return redirect(url_for('teacher_select'))
@@ -776,28 +940,8 @@ def admin_teachers_import():
 		if not text:
 			flash('Paste teacher data to import', 'error')
 			return render_template('admin_teachers_import.html', classes=classes)
-		added = 0
-		updated = 0
-		for raw in text.splitlines():
-			line = raw.strip()
-			if not line:
-				continue
-			# CSV: name,phone,password,subject,class  (subject,class can repeat multiple lines per teacher)
-			parts = [p.strip() for p in line.split(',')]
-			if len(parts) < 5:
-				continue
-			name, phone, password, subject, cls = parts[0], parts[1], parts[2], parts[3], ','.join(parts[4:]) if len(parts)>5 else parts[4]
-			row = db.execute('SELECT teacher_id FROM teachers WHERE phone = ? OR name = ?', (phone, name)).fetchone()
-			if row:
-				db.execute('UPDATE teachers SET name = ?, phone = ?, password_hash = ? WHERE teacher_id = ?', (name, phone, pbkdf2_sha256.hash(password), row['teacher_id']))
-				teacher_id = row['teacher_id']
-				updated += 1
-			else:
-				db.execute('INSERT INTO teachers (name, phone, password_hash) VALUES (?,?,?)', (name, phone, pbkdf2_sha256.hash(password)))
-				teacher_id = db.execute('SELECT last_insert_rowid() AS id').fetchone()['id']
-				added += 1
-			db.execute('INSERT OR IGNORE INTO teacher_assignments (teacher_id, subject, class) VALUES (?,?,?)', (teacher_id, subject, cls))
-		db.commit()
+		rows = imports.parse_teachers(text.splitlines())
+		added, updated = writes.run(imports.import_teachers, rows, imports.hash_teacher_passwords(rows))
 		flash(f'Teachers import complete. Added {added}, Updated {updated}.', 'success')
 		return redirect(url_for('admin_reports'))
 	return render_template('admin_teachers_import.html', classes=classes)
@@ -850,43 +994,16 @@ def hod_class_import():
             flash('Provide students via paste or CSV file.', 'error')
             return render_template('hod_class_import.html', suggestions=suggestions, class_name=class_name, semester=semester, errors=errors)
 
-        added = 0
-        updated = 0
-        line_no = 0
-        for raw in student_rows:
-            line_no += 1
-            line = (raw or '').strip()
-            if not line:
-                continue
-            roll = prn = name = None
-            if ',' in line:
-                parts = [p.strip() for p in line.split(',') if p.strip()]
-                if len(parts) >= 3:
-                    roll, prn, name = parts[0], parts[1], ','.join(parts[2:]).strip()
-            else:
-                parts = line.split()
-                if len(parts) >= 3:
-                    roll, prn = parts[0], parts[1]
-                    name = ' '.join(parts[2:])
-            if not roll or not prn or not name:
-                errors.append(f'Line {line_no}: invalid format. Expect roll, prn, name.')
-                continue
-            try:
-                row = db.execute('SELECT student_id FROM students WHERE roll_no = ?', (roll,)).fetchone()
-                if row:
-                    db.execute('UPDATE students SET prn = ?, name = ?, class = ?, semester = ? WHERE student_id = ?', (prn, name, class_name, int(semester or 2), row['student_id']))
-                    updated += 1
-                else:
-                    db.execute('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,?,?)', (roll, prn, name, class_name, int(semester or 2), pbkdf2_sha256.hash('Test@123')))
-                    added += 1
-            except sqlite3.Error as exc:
-                errors.append(f'Line {line_no}: DB error for roll {roll}: {exc}')
-        db.commit()
+        rows = imports.parse_students(student_rows, errors)
+        default_hash = passwords.hash_pooled(imports.DEFAULT_STUDENT_PASSWORD)
+        added, updated = writes.run(imports.import_students, rows, class_name, int(semester or 2), errors, default_hash)
 
         # Process subject-teacher assignments (optional)
         assigned = 0
         skipped_assign = 0
         if assignments_text:
+            # teachers are looked up here; only the inserts go to the writer
+            pending = []
             for idx, raw in enumerate(assignments_text.splitlines(), start=1):
                 line = raw.strip()
                 if not line:
@@ -908,13 +1025,21 @@ def hod_class_import():
                     errors.append(f'Assignment line {idx}: teacher not found for "{teacher_key}"')
                     skipped_assign += 1
                     continue
-                try:
-                    db.execute('INSERT OR IGNORE INTO teacher_assignments (teacher_id, subject, class) VALUES (?,?,?)', (teacher_row['teacher_id'], subject, class_name))
-                    assigned += 1
-                except sqlite3.Error as exc:
-                    errors.append(f'Assignment line {idx}: DB error: {exc}')
-                    skipped_assign += 1
-            db.commit()
+                pending.append((idx, teacher_row['teacher_id'], subject))
+
+            def add_assignments(db):
+                failed = []
+                for idx, teacher_id, subject in pending:
+                    try:
+                        db.execute('INSERT OR IGNORE INTO teacher_assignments (teacher_id, subject, class) VALUES (?,?,?)', (teacher_id, subject, class_name))
+                    except sqlite3.Error as exc:
+                        failed.append(f'Assignment line {idx}: DB error: {exc}')
+                return failed
+
+            failed = writes.run(add_assignments) if pending else []
+            errors.extend(failed)
+            assigned += len(pending) - len(failed)
+            skipped_assign += len(failed)
 
         # Summarize
         flash(f'Class "{class_name}" import: Added {added}, Updated {updated}. Assignments added {assigned}, Skipped {skipped_assign}.', 'success')
@@ -957,6 +1082,5 @@ def hod_remove_teacher():
 
 if __name__ == '__main__':
 	with app.app_context():
-		init_db()
-		seed_if_empty()
+		init_db(seed_data=True)
 	app.run(debug=True)
@@ -0,0 +1,362 @@
+"""
+Semester archives: closed date ranges moved out of the hot database.
+
+``flask --app app archive-semester`` moves the attendance of one date range,
+with a snapshot of the students marked in it, into its own SQLite file
+(``ARCHIVE_DIR``, default ``archive/`` next to the database). ``archives``
+in the hot database lists them. From the moment a range is registered,
+inserts and updates into it are refused (a trigger; ``marking`` says so
+first), so the copy cannot go stale.
+
+A move runs in steps, each in short transactions, and a rerun picks up
+where the last one stopped:
+- copying: rows are copied in primary-key order, resuming after the last
+  row already in the file;
+- the copy is checked against the hot rows (row count and Present count)
+  and the archive switches to 'deleting'. From here on readers take the
+  range from the file;
+- deleting: the hot rows go in primary-key batches. The rollup, version
+  and bitmap triggers see ordinary deletes;
+- done: no hot rows are left in the range.
+
+Readers call ``attach``: it ATTACHes, read-only, the archives a date range
+reaches into (``archive_<id>``, kept on the pooled connection), so queries
+over the current term never open one. ``marks_sql`` and ``students_sql``
+then give the hot and archived rows as one relation. Class and subject ids
+are the hot dictionary's, copied along with the rows.
+"""
+
+import os
+import re
+from datetime import datetime
+
+import compact
+import database
+import lectures
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+BATCH = 5000
+# SQLite allows 10 attached databases; leave room for ad-hoc ones
+MAX_ATTACHED = 8
+COPY = 'archive_copy'
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS archives (
+	archive_id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL UNIQUE,
+	path TEXT NOT NULL,
+	start_day INTEGER NOT NULL,
+	end_day INTEGER NOT NULL,
+	rows INTEGER,
+	state TEXT NOT NULL DEFAULT 'copying' CHECK (state IN ('copying', 'deleting', 'done')),
+	created TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+_ARCHIVED = 'EXISTS (SELECT 1 FROM archives WHERE {ref}.day BETWEEN start_day AND end_day)'
+
+TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS attendance_marks_archived_bi BEFORE INSERT ON attendance_marks
+WHEN {_ARCHIVED.format(ref='NEW')}
+BEGIN
+	SELECT RAISE(ABORT, 'attendance for this date is archived');
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_marks_archived_bu BEFORE UPDATE ON attendance_marks
+WHEN {_ARCHIVED.format(ref='NEW')} OR {_ARCHIVED.format(ref='OLD')}
+BEGIN
+	SELECT RAISE(ABORT, 'attendance for this date is archived');
+END;
+'''
+
+# one file per archive; no foreign keys, the rows outlive their students
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {schema}.classes (
+	class_id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {schema}.subjects (
+	subject_id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {schema}.students (
+	student_id INTEGER PRIMARY KEY,
+	roll_no TEXT NOT NULL,
+	prn TEXT,
+	name TEXT NOT NULL,
+	class TEXT NOT NULL,
+	semester INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {schema}.attendance_marks (
+	class_id INTEGER NOT NULL,
+	subject_id INTEGER NOT NULL,
+	day INTEGER NOT NULL,
+	student_id INTEGER NOT NULL,
+	teacher_id INTEGER NOT NULL,
+	present INTEGER NOT NULL CHECK (present IN (0, 1)),
+	PRIMARY KEY (class_id, subject_id, day, student_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS {schema}.idx_marks_student_day ON attendance_marks(student_id, day, subject_id, present);
+
+CREATE TABLE IF NOT EXISTS {schema}.archive_info (
+	key TEXT PRIMARY KEY,
+	value
+) WITHOUT ROWID;
+'''
+
+
+def _directory(db):
+	main = next(r['file'] for r in db.execute('PRAGMA database_list') if r['name'] == 'main')
+	return os.path.dirname(main)
+
+
+def _path(db, path):
+	# registered paths are relative to the database's directory when inside it
+	return os.path.join(_directory(db), path)
+
+
+def _schema(archive_id):
+	return f'archive_{archive_id}'
+
+
+def _attached(db):
+	return [r['name'] for r in db.execute('PRAGMA database_list')
+			if r['name'].startswith('archive_') and r['name'][8:].isdigit()]
+
+
+def _span(db, start_day, end_day):
+	return db.execute(
+		"SELECT archive_id, path, start_day, end_day FROM archives WHERE state != 'copying'"
+		' AND start_day <= ? AND end_day >= ? ORDER BY start_day', (end_day, start_day)).fetchall()
+
+
+def attach(db, start=None, end=None):
+	"""[(schema, start_day, end_day)] of the archives ``start``..``end`` reaches into, attached read-only.
+
+	Empty, without touching any file, for ranges within the hot database.
+	Must be called outside a transaction.
+	"""
+	rows = _span(db, compact.day_or(start, compact.FIRST_DAY), compact.day_or(end, compact.LAST_DAY))
+	if not rows:
+		return []
+	if len(rows) > MAX_ATTACHED:
+		raise ValueError(f'the date range spans {len(rows)} archives, at most {MAX_ATTACHED} can be read at once')
+	wanted = [_schema(r['archive_id']) for r in rows]
+	attached = _attached(db)
+	missing = [(schema, r) for schema, r in zip(wanted, rows) if schema not in attached]
+	if missing:
+		spare = [schema for schema in attached if schema not in wanted]
+		for schema in spare[:max(0, len(attached) + len(missing) - MAX_ATTACHED)]:
+			db.execute(f'DETACH DATABASE {schema}')
+		for schema, r in missing:
+			db.execute(f'ATTACH DATABASE ? AS {schema}', (database.uri(_path(db, r['path']), 'ro'),))
+	return [(schema, r['start_day'], r['end_day']) for schema, r in zip(wanted, rows)]
+
+
+def archived(db, day):
+	"""Whether ``day`` (a day number) falls in an archive."""
+	return db.execute('SELECT 1 FROM archives WHERE ? BETWEEN start_day AND end_day', (day,)).fetchone() is not None
+
+
+def marks_sql(archives, where, alias='a', group=None):
+	"""A relation of the hot and archived ``attendance_marks`` rows matching ``where``.
+
+	``where`` refers to the columns through ``alias``; the hot rows of the
+	archived ranges are left out. With ``group`` (column names) each side is
+	grouped by them first, giving those columns plus ``lectures`` and
+	``present`` counts: a join then reads a few totals per student, not
+	every row.
+	"""
+	if group:
+		keys = ', '.join(f'{alias}.{column}' for column in group)
+		columns = f'{keys}, COUNT(*) AS lectures, SUM({alias}.present) AS present'
+		grouping = f' GROUP BY {keys}'
+	else:
+		columns = f'{alias}.class_id, {alias}.subject_id, {alias}.day, {alias}.student_id, {alias}.present'
+		grouping = ''
+	hot = [where] + [f'{alias}.day NOT BETWEEN {start_day} AND {end_day}' for _, start_day, end_day in archives]
+	branches = [f'SELECT {columns} FROM main.attendance_marks {alias} WHERE ' + ' AND '.join(hot) + grouping]
+	branches += [f'SELECT {columns} FROM {schema}.attendance_marks {alias} WHERE {where}{grouping}' for schema, _, _ in archives]
+	return '(' + ' UNION ALL '.join(branches) + ')'
+
+
+def students_sql(archives, hot_where=(), archived_where=(), alias='s'):
+	"""A relation of the hot roster plus the archived students no longer in it.
+
+	A student in several archives comes from the latest one. ``hot_where``
+	and ``archived_where`` filter each side (see ``search.like_filter``).
+	"""
+	columns = f'{alias}.student_id, {alias}.roll_no, {alias}.prn, {alias}.name, {alias}.class'
+	branches = [f'SELECT {columns} FROM main.students {alias}' + (' WHERE ' + ' AND '.join(hot_where) if hot_where else '')]
+	for n, (schema, _, _) in enumerate(archives):
+		newer = ['main'] + [later for later, _, _ in archives[n + 1:]]
+		where = list(archived_where) + [f'NOT EXISTS (SELECT 1 FROM {other}.students x WHERE x.student_id = {alias}.student_id)'
+										for other in newer]
+		branches.append(f'SELECT {columns} FROM {schema}.students {alias} WHERE ' + ' AND '.join(where))
+	return '(' + ' UNION ALL '.join(branches) + ')'
+
+
+# Moving a range
+
+def register(db, name, start, end, directory=None):
+	"""The ``archives`` row for ``name``, registered over ``start``..``end`` if new.
+
+	Raises ValueError for a bad name or range, or one overlapping another
+	archive. Caller owns the transaction.
+	"""
+	if not re.fullmatch(r'[A-Za-z0-9][A-Za-z0-9_.-]*', name or ''):
+		raise ValueError('archive name may only use letters, digits, ".", "_" and "-"')
+	try:
+		start_day, end_day = compact.day_number(start), compact.day_number(end)
+	except (TypeError, ValueError):
+		raise ValueError('start and end must be YYYY-MM-DD') from None
+	if start_day > end_day:
+		raise ValueError('start is after end')
+	row = db.execute('SELECT * FROM archives WHERE name = ?', (name,)).fetchone()
+	if row:
+		if (row['start_day'], row['end_day']) != (start_day, end_day):
+			raise ValueError(f'archive {name} covers {compact.day_date(row["start_day"])} to {compact.day_date(row["end_day"])}')
+		return row
+	other = db.execute('SELECT name FROM archives WHERE start_day <= ? AND end_day >= ?', (end_day, start_day)).fetchone()
+	if other:
+		raise ValueError(f'the range overlaps archive {other["name"]}')
+	path = os.path.join(directory or ARCHIVE_DIR or 'archive', f'{name}.db')
+	if os.path.isabs(path) and os.path.commonpath([path, _directory(db)]) == _directory(db):
+		path = os.path.relpath(path, _directory(db))
+	archive_id = db.execute('INSERT INTO archives (name, path, start_day, end_day) VALUES (?,?,?,?)',
+							(name, path, start_day, end_day)).lastrowid
+	return db.execute('SELECT * FROM archives WHERE archive_id = ?', (archive_id,)).fetchone()
+
+
+def open_copy(db, archive):
+	"""ATTACH the archive's file read-write as ``COPY``, creating it. Outside a transaction."""
+	path = _path(db, archive['path'])
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	db.execute(f'ATTACH DATABASE ? AS {COPY}', (database.uri(path),))
+	db.executescript(SCHEMA.format(schema=COPY))
+
+
+def close_copy(db):
+	if COPY in [r['name'] for r in db.execute('PRAGMA database_list')]:
+		db.execute(f'DETACH DATABASE {COPY}')
+
+
+def _last_key(db, schema):
+	return db.execute(f'SELECT {compact.MARK_KEY} FROM {schema}.attendance_marks'
+					  ' ORDER BY class_id DESC, subject_id DESC, day DESC, student_id DESC LIMIT 1').fetchone()
+
+
+def copy_batch(db, archive, limit=BATCH):
+	"""Copy the next ``limit`` hot rows of the range (and their students) to ``COPY``; returns how many."""
+	last = _last_key(db, COPY)
+	after = f'({compact.MARK_KEY}) > (?, ?, ?, ?)' if last else '1'
+	args = tuple(last) if last else ()
+	copied = db.execute(
+		f'INSERT INTO {COPY}.attendance_marks ({compact.MARK_KEY}, teacher_id, present)'
+		f' SELECT {compact.MARK_KEY}, teacher_id, present FROM main.attendance_marks'
+		f' WHERE {after} AND day BETWEEN ? AND ? ORDER BY {compact.MARK_KEY} LIMIT ?',
+		args + (archive['start_day'], archive['end_day'], limit)).rowcount
+	db.execute(
+		f'INSERT OR REPLACE INTO {COPY}.students (student_id, roll_no, prn, name, class, semester)'
+		' SELECT student_id, roll_no, prn, name, class, semester FROM main.students WHERE student_id IN'
+		f' (SELECT student_id FROM {COPY}.attendance_marks WHERE {after})', args)
+	return copied
+
+
+def _counts(db, schema, archive):
+	return tuple(db.execute(
+		f'SELECT COUNT(*), COALESCE(SUM(present), 0) FROM {schema}.attendance_marks WHERE day BETWEEN ? AND ?',
+		(archive['start_day'], archive['end_day'])).fetchone())
+
+
+def finish_copy(db, archive):
+	"""Check the copy against the hot rows and switch the archive to 'deleting'; returns the row count.
+
+	A copy that does not match (rows deleted meanwhile, say by removing a
+	student) is emptied so the next run starts over, and None is returned.
+	Caller owns the transaction.
+	"""
+	hot, copy = _counts(db, 'main', archive), _counts(db, COPY, archive)
+	if hot != copy:
+		db.execute(f'DELETE FROM {COPY}.attendance_marks')
+		db.execute(f'DELETE FROM {COPY}.students')
+		return None
+	db.execute(f'INSERT OR REPLACE INTO {COPY}.classes SELECT class_id, name FROM main.classes')
+	db.execute(f'INSERT OR REPLACE INTO {COPY}.subjects SELECT subject_id, name FROM main.subjects')
+	info = {'name': archive['name'], 'start': compact.day_date(archive['start_day']), 'end': compact.day_date(archive['end_day']),
+			'rows': hot[0], 'present': hot[1], 'archived': datetime.now().isoformat(timespec='seconds')}
+	db.executemany(f'INSERT OR REPLACE INTO {COPY}.archive_info (key, value) VALUES (?,?)', info.items())
+	db.execute("UPDATE archives SET state = 'deleting', rows = ? WHERE archive_id = ?", (hot[0], archive['archive_id']))
+	return hot[0]
+
+
+def delete_batch(db, schema, after=None, limit=BATCH):
+	"""Delete the hot copies of the next ``limit`` archived rows after key ``after``; returns (deleted, last key).
+
+	The last key is None once the archive is exhausted.
+	"""
+	rows = db.execute(
+		f'SELECT {compact.MARK_KEY} FROM {schema}.attendance_marks' + (f' WHERE ({compact.MARK_KEY}) > (?, ?, ?, ?)' if after else '')
+		+ f' ORDER BY {compact.MARK_KEY} LIMIT ?', tuple(after or ()) + (limit,)).fetchall()
+	if not rows:
+		return 0, None
+	# rowcount leaves out the trigger writes
+	deleted = db.executemany('DELETE FROM main.attendance_marks WHERE class_id = ? AND subject_id = ? AND day = ? AND student_id = ?',
+							 [tuple(r) for r in rows]).rowcount
+	lectures.flush(db, None)
+	return deleted, tuple(rows[-1])
+
+
+def finish(db, archive):
+	"""Mark the archive done once no hot rows are left in its range. Caller owns the transaction."""
+	left = _counts(db, 'main', archive)[0]
+	if left:
+		raise RuntimeError(f'{left} rows are still in the database for archive {archive["name"]}')
+	db.execute("UPDATE archives SET state = 'done' WHERE archive_id = ?", (archive['archive_id'],))
+
+
+def move(db, name, start, end, directory=None, batch=BATCH, progress=None):
+	"""Archive ``start``..``end`` as ``name``, or resume doing so; returns the ``archives`` row.
+
+	``progress(message)`` is called after each step.
+	"""
+	progress = progress or (lambda message: None)
+	with database.transaction(db):
+		archive = register(db, name, start, end, directory)
+	if archive['state'] == 'copying':
+		open_copy(db, archive)
+		try:
+			copied = db.execute(f'SELECT COUNT(*) FROM {COPY}.attendance_marks').fetchone()[0]
+			while True:
+				with database.transaction(db):
+					n = copy_batch(db, archive, batch)
+				if not n:
+					break
+				copied += n
+				progress(f'{copied} rows copied to {archive["path"]}')
+			with database.transaction(db):
+				rows = finish_copy(db, archive)
+			if rows is None:
+				raise RuntimeError(f'{copied} rows copied but the database changed meanwhile; the copy was cleared, run again')
+			progress(f'copy verified: {rows} rows')
+		finally:
+			close_copy(db)
+	archive = db.execute('SELECT * FROM archives WHERE archive_id = ?', (archive['archive_id'],)).fetchone()
+	if archive['state'] == 'deleting':
+		schema, _, _ = next(a for a in attach(db, start, end) if a[0] == _schema(archive['archive_id']))
+		after, deleted = None, 0
+		while True:
+			with database.transaction(db):
+				n, after = delete_batch(db, schema, after, batch)
+			if after is None:
+				break
+			deleted += n
+			progress(f'{deleted} of {archive["rows"]} archived rows removed from the database')
+		with database.transaction(db):
+			finish(db, archive)
+		progress(f'archive {name} done')
+	return db.execute('SELECT * FROM archives WHERE archive_id = ?', (archive['archive_id'],)).fetchone()
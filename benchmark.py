@@ -0,0 +1,1170 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the attendance tracker.
+
+Usage:
+	python benchmark.py connect [--db attendance.db] [--iterations 2000]
+	python benchmark.py mark [--students 120] [--iterations 50]
+	python benchmark.py import [--rows 1000 10000] [--legacy-sample 100]
+	python benchmark.py login [--threads 8] [--attempts 40]
+	python benchmark.py export [--students 20000] [--days 5]
+	python benchmark.py search [--students 50000] [--iterations 200]
+	python benchmark.py batch [--students 120] [--lectures 6] [--changes 5]
+	python benchmark.py storage [--classes 4] [--students 60] [--days 90] [--batch 5000]
+	python benchmark.py bitmaps [--classes 8] [--students 60] [--days 100]
+	python benchmark.py analytics [--classes 10] [--students 200] [--days 100]
+	python benchmark.py register [--students 120] [--days 90]
+	python benchmark.py archive [--classes 8] [--students 60] [--days 100] [--batch 5000]
+	python benchmark.py writers [--markers 50] [--students 60] [--rounds 5]
+	python benchmark.py routes [--classes 4 --students 60 --days 90 | --db attendance.db]
+		[--out results.json] [--baseline baseline.json] [--tolerance 0.25]
+"""
+
+import argparse
+import csv
+import gc
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from io import BytesIO, StringIO
+
+from passlib.hash import pbkdf2_sha256
+
+import analytics
+import archive
+import compact
+import database
+import exports
+import imports
+import lectures
+import marking
+import metrics
+import migrations
+import passwords
+import reports
+import search
+import synthetic
+import timing
+import versions
+import writer
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attendance.db')
+
+
+def timed(fn, iterations):
+	start = time.perf_counter()
+	for _ in range(iterations):
+		fn()
+	return (time.perf_counter() - start) / iterations
+
+
+def report(title, rows):
+	print(title)
+	width = max(len(name) for name, _ in rows)
+	for name, seconds in rows:
+		print(f'  {name.ljust(width)}  {seconds * 1e6:10.1f} us')
+
+
+def scratch_copy(path):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	dst = os.path.join(tmpdir, 'bench.db')
+	if os.path.exists(path):
+		shutil.copy(path, dst)
+	return dst
+
+
+# connect: per-request connection overhead
+
+def bench_connect(args):
+	path = scratch_copy(args.db)
+	query = 'SELECT * FROM students WHERE roll_no = ?'
+
+	def per_request():
+		db = sqlite3.connect(path)
+		db.row_factory = sqlite3.Row
+		db.execute('PRAGMA foreign_keys = ON')
+		db.execute(query, ('1',)).fetchone()
+		db.close()
+
+	pool = database.ConnectionPool(path)
+
+	def pooled():
+		db = pool.connection()
+		db.execute(query, ('1',)).fetchone()
+		pool.release(db)
+
+	def pooled_readonly():
+		db = pool.connection(readonly=True)
+		db.execute(query, ('1',)).fetchone()
+		pool.release(db)
+
+	pooled()
+	report(f'Per-request DB overhead ({args.iterations} iterations)', [
+		('connect per request', timed(per_request, args.iterations)),
+		('pooled connection', timed(pooled, args.iterations)),
+		('pooled read-only', timed(pooled_readonly, args.iterations)),
+	])
+	pool.close_all()
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def scratch_db(students=0, class_name='BENCH-A'):
+	"""Fresh migrated database with one teacher and ``students`` students in one class."""
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	db = database.connect(path)
+	migrations.migrate(db)
+	db.execute("INSERT INTO teachers (name, phone, password_hash) VALUES ('Bench Teacher', '0000000000', 'x')")
+	db.executemany('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,2,?)',
+				   [(f'B{i:05d}', f'P{i:05d}', f'Student {i}', class_name, 'x') for i in range(1, students + 1)])
+	db.commit()
+	return path, db
+
+
+# mark: one teacher_mark save for a class
+
+def bench_mark(args):
+	path, db = scratch_db(args.students)
+	teacher_id = db.execute('SELECT teacher_id FROM teachers').fetchone()[0]
+	ids = [r[0] for r in db.execute('SELECT student_id FROM students ORDER BY roll_no')]
+	cls, subject, date = 'BENCH-A', 'SUB', '2025-01-01'
+	state = {'i': 0}
+
+	def legacy_replace():
+		# the old save path: INSERT OR REPLACE for every student
+		state['i'] += 1
+		for sid in ids:
+			status = 'Present' if (sid + state['i']) % 2 else 'Absent'
+			db.execute('INSERT OR REPLACE INTO attendance (student_id, teacher_id, subject, class, date, status) VALUES (?,?,?,?,?,?)',
+					   (sid, teacher_id, subject, cls, date, status))
+		db.commit()
+
+	def diff_one_change():
+		state['i'] += 1
+		statuses = {sid: 'Absent' for sid in ids}
+		statuses[ids[0]] = 'Present' if state['i'] % 2 else 'Absent'
+		with database.transaction(db):
+			marking.save_lecture(db, teacher_id, cls, subject, date, statuses)
+
+	def diff_all_changed():
+		state['i'] += 1
+		status = 'Present' if state['i'] % 2 else 'Absent'
+		with database.transaction(db):
+			marking.save_lecture(db, teacher_id, cls, subject, date, {sid: status for sid in ids})
+
+	def diff_unchanged():
+		with database.transaction(db):
+			marking.save_lecture(db, teacher_id, cls, subject, date, {sid: 'Absent' for sid in ids})
+
+	def mark_all():
+		# flip everyone back to Absent first so every iteration changes all rows
+		with database.transaction(db):
+			db.execute("UPDATE attendance SET status = 'Absent' WHERE class = ? AND subject = ? AND date = ?", (cls, subject, date))
+			marking.mark_all_present(db, teacher_id, cls, subject, date)
+
+	legacy_replace()
+	report(f'teacher_mark save, {len(ids)} students ({args.iterations} iterations)', [
+		('INSERT OR REPLACE per student', timed(legacy_replace, args.iterations)),
+		('diff upsert, 1 row changed', timed(diff_one_change, args.iterations)),
+		('diff upsert, nothing changed', timed(diff_unchanged, args.iterations)),
+		('diff upsert, all rows changed', timed(diff_all_changed, args.iterations)),
+		('mark_all INSERT ... SELECT (+reset)', timed(mark_all, args.iterations)),
+	])
+	db.close()
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# import: roster paste of N students / teachers
+
+def bench_import(args):
+	results = []
+	for n in args.rows:
+		lines = [f'I{i:06d},PRN{i:06d},Imported Student {i}' for i in range(n)]
+		# half the roster already exists, as in a re-import after corrections
+		path, db = scratch_db(0)
+		db.executemany("INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,'OLD',2,'x')",
+					   [(f'I{i:06d}', f'PRN{i:06d}', f'Old {i}') for i in range(0, n, 2)])
+		db.commit()
+
+		sample = lines[:min(args.legacy_sample, n)]
+		start = time.perf_counter()
+		for raw in sample:
+			# the old per-line route body
+			roll, prn, name = imports.parse_student_line(raw)
+			row = db.execute('SELECT student_id FROM students WHERE roll_no = ?', (roll,)).fetchone()
+			if row:
+				db.execute('UPDATE students SET prn = ?, name = ?, class = ?, semester = ? WHERE student_id = ?', (prn, name, 'NEW', 2, row['student_id']))
+			else:
+				db.execute('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,?,?)', (roll, prn, name, 'NEW', 2, pbkdf2_sha256.hash('Test@123')))
+		db.commit()
+		legacy = (time.perf_counter() - start) / len(sample) * n
+
+		start = time.perf_counter()
+		rows = imports.parse_students(lines)
+		with database.transaction(db):
+			added, updated = imports.import_students(db, rows, 'NEW', 2)
+		engine = time.perf_counter() - start
+		results.append((n, legacy, engine, added, updated))
+		db.close()
+		shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+	print(f'Student import (legacy extrapolated from {args.legacy_sample} lines)')
+	for n, legacy, engine, added, updated in results:
+		print(f'  {n:>6} rows  legacy {legacy:8.2f} s   bulk {engine:8.3f} s   ({added} added, {updated} updated)')
+
+	n = args.teacher_rows
+	lines = [f'Teacher {i},9{i:09d},pw{i},SUB{i % 7},CLS{i % 11}' for i in range(n)]
+	path, db = scratch_db(0)
+	start = time.perf_counter()
+	with database.transaction(db):
+		imports.import_teachers(db, imports.parse_teachers(lines))
+	elapsed = time.perf_counter() - start
+	print(f'Teacher import, {n} rows with distinct passwords: {elapsed:.2f} s '
+		  f'({passwords.HASH_WORKERS} hashing worker(s))')
+	db.close()
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# login: password checks per attempt, and under a burst of logins
+
+def bench_login(args):
+	path, db = scratch_db(1)
+	default = imports.DEFAULT_STUDENT_PASSWORD
+	db.execute('UPDATE students SET password_hash = ?', (passwords.hash_password(default),))
+	db.execute("UPDATE teachers SET password_hash = ?", (passwords.hash_password('teach'),))
+	db.execute("INSERT INTO hods (name, phone, password_hash) VALUES ('Bench HOD', '1111111111', ?)", (passwords.hash_password('hod'),))
+	db.commit()
+	stored = db.execute('SELECT password_hash FROM students').fetchone()[0]
+
+	def legacy_student():
+		# the old student branch: verify, verify again for the default password
+		if pbkdf2_sha256.verify(default, stored) or default == 'Test@123':
+			if default == 'Test@123' and not pbkdf2_sha256.verify(default, stored):
+				pbkdf2_sha256.hash(default)
+
+	report('Student login with the default password (20 iterations)', [
+		('two verifies (old)', timed(legacy_student, 20)),
+		('CryptContext verify_and_update', timed(lambda: passwords.verify(default, stored, 'student'), 20)),
+	])
+
+	os.environ['ATTENDANCE_DB'] = path
+	from app import app
+	logins = [
+		{'role': 'student', 'username': 'P00001', 'password': default},
+		{'role': 'teacher', 'username': '0000000000', 'password': 'teach'},
+		{'role': 'hod', 'username': '1111111111', 'password': 'hod'},
+	]
+	ping = []
+
+	def attempt(i):
+		with app.test_client() as client:
+			client.post('/login', data=logins[i % len(logins)])
+
+	def storm():
+		threads = [threading.Thread(target=lambda n=n: [attempt(n * args.attempts + k) for k in range(args.attempts)]) for n in range(args.threads)]
+		for t in threads:
+			t.start()
+		return threads
+
+	def probe():
+		# a cheap non-login request issued while the storm runs
+		with app.test_client() as client:
+			start = time.perf_counter()
+			client.get('/login')
+			ping.append(time.perf_counter() - start)
+
+	threads = storm()
+	while any(t.is_alive() for t in threads):
+		probe()
+		time.sleep(0.01)
+	print(f'\n{args.threads} threads x {args.attempts} logins, {passwords.VERIFY_WORKERS} verify worker(s)')
+	for role, s in sorted(passwords.verify_stats().items()):
+		print(f'  {role:8} {s["count"]:5} checks  mean {s["seconds"] / s["count"] * 1e3:7.2f} ms  '
+			  f'max {s["max"] * 1e3:7.2f} ms  mean queued {s["queued"] / s["count"] * 1e3:7.2f} ms')
+	if ping:
+		ping.sort()
+		print(f'  GET /login during the burst: median {ping[len(ping) // 2] * 1e3:.2f} ms, max {ping[-1] * 1e3:.2f} ms ({len(ping)} probes)')
+	db.close()
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# export: peak memory of a whole-institute CSV export
+
+def synthetic_attendance(db, days, subjects=('SUB1', 'SUB2'), start='2025-01-01'):
+	"""Mark every student in ``db`` for ``days`` consecutive days per subject."""
+	teacher_id = db.execute('SELECT teacher_id FROM teachers').fetchone()[0]
+	with database.transaction(db):
+		for d in range(days):
+			for subject in subjects:
+				db.execute(
+					"INSERT INTO attendance (student_id, teacher_id, subject, class, date, status)"
+					" SELECT student_id, ?, ?, class, date(?, ?), CASE WHEN (student_id + ?) % 3 THEN 'Present' ELSE 'Absent' END FROM students",
+					(teacher_id, subject, start, f'+{d} days', d))
+
+
+def bench_export(args):
+	path, db = scratch_db(args.students)
+	synthetic_attendance(db, args.days)
+	db.close()
+	os.environ['ATTENDANCE_DB'] = path
+	from app import app, get_db
+	url = '/admin/export/csv?start=2025-01-01&end=2025-12-31'
+
+	def buffered():
+		# the old export body: full report list, StringIO, then an encoded copy
+		with app.test_request_context(url):
+			rows = reports.attendance_summary(get_db(readonly=True), start='2025-01-01', end='2025-12-31')
+			buf = StringIO(newline='')
+			writer = csv.writer(buf)
+			for r in rows:
+				writer.writerow([r['roll_no'], r['name'], r['class'], r['total'], r['attended'], f"{r['percent']}%"])
+			data = buf.getvalue().encode('utf-8')
+			return len(BytesIO(data).getvalue())
+
+	def streamed():
+		with app.test_client() as client:
+			with client.session_transaction() as s:
+				s['user'] = {'id': 1, 'name': 'Bench', 'role': 'admin', 'email': 'bench'}
+			response = client.get(url, buffered=False)
+			size = sum(len(chunk) for chunk in response.response)
+			response.close()
+			return size
+
+	print(f'CSV export, {args.students} students x {args.days} days x 2 subjects')
+	for name, fn in (('buffered (old)', buffered), ('streamed', streamed)):
+		fn()
+		tracemalloc.start()
+		start = time.perf_counter()
+		size = fn()
+		elapsed = time.perf_counter() - start
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		print(f'  {name:15} {size / 1e6:6.2f} MB out  peak {peak / 1e6:7.2f} MB  {elapsed:6.2f} s')
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# search: substring search over a large roster
+
+def bench_search(args):
+	path, db = scratch_db(0)
+	db.executemany('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,2,?)',
+				   [(f'24MCA{i:06d}', f'4245{i:07d}', f'{synthetic.LAST[i % 12]} {synthetic.FIRST[i * 7 % 12]} {i}', f'CLS-{i % 40}', 'x')
+					for i in range(args.students)])
+	db.commit()
+	terms = ['patil', 'shind', 'rohan', '12345', 'ulkar', '4245000']
+
+	def like(term):
+		return db.execute('SELECT roll_no, prn, name, class FROM students WHERE roll_no LIKE :t OR prn LIKE :t OR name LIKE :t LIMIT 10',
+						  {'t': f'%{term}%'}).fetchall()
+
+	def like_all(term):
+		return db.execute('SELECT COUNT(*) FROM students WHERE roll_no LIKE :t OR prn LIKE :t OR name LIKE :t', {'t': f'%{term}%'}).fetchone()
+
+	def fts_all(term):
+		return db.execute('SELECT COUNT(*) FROM students_fts WHERE students_fts MATCH ?', (search.phrase(term),)).fetchone()
+
+	rows = []
+	for term in terms:
+		rows.append((f'{term!r}: LIKE scan, count', timed(lambda: like_all(term), args.iterations)))
+		rows.append((f'{term!r}: trigram index, count', timed(lambda: fts_all(term), args.iterations)))
+		rows.append((f'{term!r}: LIKE scan, first 10', timed(lambda: like(term), args.iterations)))
+		rows.append((f'{term!r}: typeahead top 10', timed(lambda: search.typeahead(db, term), args.iterations)))
+	report(f'Student search, {args.students} students ({args.iterations} iterations)', rows)
+	db.close()
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# batch: a day of lectures as form posts vs one JSON batch
+
+def bench_batch(args):
+	path, db = scratch_db(args.students)
+	teacher_id = db.execute('SELECT teacher_id FROM teachers').fetchone()[0]
+	ids = [r[0] for r in db.execute('SELECT student_id FROM students ORDER BY roll_no')]
+	db.close()
+	os.environ['ATTENDANCE_DB'] = path
+	from app import app
+	client = app.test_client()
+	with client.session_transaction() as s:
+		s['user'] = {'id': teacher_id, 'name': 'Bench Teacher', 'role': 'teacher'}
+	subjects = [f'SUB{n}' for n in range(args.lectures)]
+
+	def day(d):
+		return f'2025-02-{d:02d}'
+
+	def form_posts(d):
+		# each lecture: full form POST, redirect, re-render of the class page
+		for n, subject in enumerate(subjects):
+			form = {'cls': 'BENCH-A', 'subject': subject, 'date': day(d)}
+			form.update({f'status_{sid}': 'Present' for sid in ids[n:n + args.changes]})
+			client.post('/teacher/mark', data=form, follow_redirects=True)
+		return len(subjects) * 2
+
+	def one_batch(d):
+		lectures = [{'class': 'BENCH-A', 'subject': subject, 'date': day(d), 'fill_absent': True,
+					 'statuses': {str(sid): 'Present' for sid in ids[n:n + args.changes]}}
+					for n, subject in enumerate(subjects)]
+		client.post('/teacher/attendance/batch', json={'batch_id': f'bench-{d}', 'lectures': lectures})
+		return 1
+
+	rows = []
+	for name, fn, offset in (('form POST per lecture', form_posts, 1), ('one JSON batch', one_batch, 15)):
+		start = time.perf_counter()
+		trips = sum(fn(offset + d) for d in range(args.days))
+		rows.append((f'{name} ({trips // args.days} round trips/day)', (time.perf_counter() - start) / args.days))
+	report(f'Marking a day: {args.lectures} lectures x {args.students} students, {args.changes} Present each', rows)
+	shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+# storage: the attendance table before and after the compact conversion
+
+# (name, SQL on the old table, SQL on attendance_marks); parameters are filled per run
+STORAGE_QUERIES = (
+	('one lecture',
+	 'SELECT student_id, status FROM attendance WHERE class = :class AND subject = :subject AND date = :date',
+	 'SELECT student_id, present FROM attendance_marks WHERE class_id = :class_id AND subject_id = :subject_id AND day = :day'),
+	('one student, 30 days',
+	 'SELECT date, subject, status FROM attendance WHERE student_id = :student AND date BETWEEN :start AND :end ORDER BY date DESC',
+	 f"SELECT {compact.date_sql('m.day')}, sub.name, m.present FROM attendance_marks m JOIN subjects sub USING (subject_id)"
+	 ' WHERE m.student_id = :student AND m.day BETWEEN :start_day AND :end_day ORDER BY m.day DESC'),
+	('class summary, 30 days',
+	 "SELECT student_id, COUNT(*), SUM(status = 'Present') FROM attendance"
+	 ' WHERE class = :class AND date BETWEEN :start AND :end GROUP BY student_id',
+	 'SELECT student_id, COUNT(*), SUM(present) FROM attendance_marks'
+	 ' WHERE class_id = :class_id AND day BETWEEN :start_day AND :end_day GROUP BY student_id'),
+	('whole table, by subject',
+	 "SELECT subject, COUNT(*), SUM(status = 'Present') FROM attendance GROUP BY subject",
+	 'SELECT subject_id, COUNT(*), SUM(present) FROM attendance_marks GROUP BY subject_id'),
+)
+
+
+def storage_sizes(db, tables):
+	"""{table: bytes} for each table plus its indexes, from dbstat."""
+	sizes = {}
+	for table in tables:
+		sizes[table] = db.execute(
+			"SELECT COALESCE(SUM(d.pgsize), 0) FROM dbstat d JOIN sqlite_master m ON m.name = d.name"
+			" WHERE m.tbl_name = ? AND m.type IN ('table', 'index')", (table,)).fetchone()[0]
+	return sizes
+
+
+def storage_params(db, d, days):
+	row = db.execute('SELECT class, subject, date FROM attendance LIMIT 1 OFFSET ?', (d * 997 % 5000,)).fetchone()
+	start = days[d * 7 % (len(days) - 22)]
+	end = days[days.index(start) + 21]
+	student = db.execute('SELECT student_id FROM students WHERE class = ? LIMIT 1 OFFSET ?', (row['class'], d % 50)).fetchone()[0]
+	return {'class': row['class'], 'subject': row['subject'], 'date': row['date'], 'start': start, 'end': end, 'student': student}
+
+
+def bench_storage(args):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	counts = synthetic.generate(path, args.classes, args.students, args.subjects, args.days, seed=args.seed, schema=9)
+	days = synthetic.teaching_days('2025-01-06', args.days)
+	db = database.connect(path)
+	db.execute('VACUUM')
+	samples = [storage_params(db, d, days) for d in range(args.iterations)]
+	before_file = os.path.getsize(path)
+	before = storage_sizes(db, ('attendance',))
+
+	def run(sql):
+		db.execute(sql, samples[0]).fetchall()
+		start = time.perf_counter()
+		for p in samples:
+			db.execute(sql, p).fetchall()
+		return (time.perf_counter() - start) / len(samples)
+
+	old_times = {name: run(old_sql) for name, old_sql, _ in STORAGE_QUERIES}
+
+	# the online path: dual writes, chunked copy, then the cutover
+	migrations.migrate(db, 10)
+	chunks = []
+	while True:
+		start = time.perf_counter()
+		with database.transaction(db):
+			copied = compact.backfill(db, args.batch)
+		if not copied:
+			break
+		chunks.append(time.perf_counter() - start)
+	start = time.perf_counter()
+	migrations.migrate(db, 11)
+	cutover = time.perf_counter() - start
+	db.execute('VACUUM')
+	after_file = os.path.getsize(path)
+	after = storage_sizes(db, ('attendance_marks', 'classes', 'subjects'))
+
+	for p in samples:
+		p['class_id'], p['subject_id'] = compact.ids(db, p['class'], p['subject'])
+		p['day'], p['start_day'], p['end_day'] = (compact.day_number(p[k]) for k in ('date', 'start', 'end'))
+	rows = []
+	for name, old_sql, new_sql in STORAGE_QUERIES:
+		rows.append((name, old_times[name], run(new_sql), run(old_sql)))
+	db.close()
+
+	print(f'{counts["attendance"]} attendance rows ({args.classes} classes x {args.students} students,'
+		  f' {args.subjects} subjects, {args.days} days)')
+	print(f'  database file        {before_file / 1e6:8.2f} MB -> {after_file / 1e6:8.2f} MB')
+	print(f'  attendance + indexes {sum(before.values()) / 1e6:8.2f} MB -> {sum(after.values()) / 1e6:8.2f} MB'
+		  f' ({sum(after.values()) / max(sum(before.values()), 1):.0%}), {sum(after.values()) / counts["attendance"]:.1f} bytes/row')
+	print(f'  backfill             {len(chunks)} transactions of {args.batch} rows, longest {max(chunks, default=0) * 1e3:.1f} ms,'
+		  f' cutover {cutover * 1e3:.0f} ms')
+	print(f'Query time ({args.iterations} runs):')
+	width = max(len(r[0]) for r in rows)
+	print(f'  {"".ljust(width)}  {"old table":>10}  {"compact":>10}  {"via view":>10}')
+	for name, old, new, view in rows:
+		print(f'  {name.ljust(width)}  {old * 1e6:8.1f}us  {new * 1e6:8.1f}us  {view * 1e6:8.1f}us')
+	shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# bitmaps: a semester of reports from the rows, the rollups and the lecture bitmaps
+
+def bitmap_reports(db, cls, subject, start, end):
+	"""(name, fn(source)) of the summaries the report routes build."""
+	return (
+		('class report, one subject', lambda source: reports.attendance_summary(
+			db, class_name=cls, subject=subject, attendance_class=cls, start=start, end=end, source=source)),
+		('institute summary', lambda source: reports.attendance_summary(db, start=start, end=end, source=source)),
+		('institute, by subject', lambda source: reports.attendance_summary(
+			db, start=start, end=end, by_subject=True, source=source)),
+		('defaulters (<75%)', lambda source: reports.attendance_summary(
+			db, start=start, end=end, marked_only=True, below=75.0, source=source)),
+		('percent-sorted page', lambda source: reports.summary_page(
+			db, '-percent', None, 100, start=start, end=end, source=source)[0]),
+	)
+
+
+HEADCOUNTS = ('SELECT class_id, subject_id, day, SUM(present), COUNT(*) FROM attendance_marks'
+			  ' WHERE day BETWEEN ? AND ? GROUP BY class_id, subject_id, day')
+
+
+def bench_bitmaps(args):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	counts = synthetic.generate(path, args.classes, args.students, args.subjects, args.days, seed=args.seed)
+	days = synthetic.teaching_days('2025-01-06', args.days)
+	start, end = days[0], days[-1]
+	db = database.connect(path)
+	db.execute('VACUUM')
+	rebuild_start = time.perf_counter()
+	with database.transaction(db):
+		lectures.rebuild(db)
+	rebuild = time.perf_counter() - rebuild_start
+	sizes = storage_sizes(db, ('attendance_marks', 'lecture_bitmaps', 'roster_slots'))
+	lecture_count = db.execute('SELECT COUNT(*) FROM lecture_bitmaps').fetchone()[0]
+	cls = synthetic.class_names(args.classes)[0]
+	subject = db.execute('SELECT name FROM subjects ORDER BY subject_id LIMIT 1').fetchone()[0]
+
+	def run(fn):
+		result = fn()
+		best = float('inf')
+		for _ in range(args.iterations):
+			t = time.perf_counter()
+			fn()
+			best = min(best, time.perf_counter() - t)
+		return best, result
+
+	rows = []
+	mismatches = 0
+	for name, fn in bitmap_reports(db, cls, subject, start, end):
+		times = {}
+		results = {}
+		for source in reports.SOURCES:
+			times[source], results[source] = run(lambda: fn(source))
+		if not results['rows'] == results['rollups'] == results['bitmaps']:
+			mismatches += 1
+			name += ' (MISMATCH)'
+		rows.append((name, times))
+	span = (compact.day_number(start), compact.day_number(end))
+	grouped = run(lambda: db.execute(HEADCOUNTS, span).fetchall())
+	popcount = run(lambda: lectures.headcounts(db, start=start, end=end))
+	if sorted(tuple(r) for r in grouped[1]) != sorted(popcount[1]):
+		mismatches += 1
+
+	# what keeping the bitmaps costs a teacher's save: one changed mark per lecture
+	teacher_id = db.execute('SELECT teacher_id FROM teachers LIMIT 1').fetchone()[0]
+	roster = [r[0] for r in db.execute('SELECT student_id FROM students WHERE class = ?', (cls,))]
+	saves = []
+	for n, day in enumerate(days[:args.iterations]):
+		t = time.perf_counter()
+		with database.transaction(db):
+			marking.save_lecture(db, teacher_id, cls, subject, day, {roster[n % len(roster)]: 'Present'}, default=None)
+		saves.append(time.perf_counter() - t)
+	stale = lectures.verify(db)
+	db.close()
+
+	print(f'{counts["attendance"]} attendance rows, {lecture_count} lectures ({args.classes} classes x {args.students} students,'
+		  f' {args.subjects} subjects, {args.days} days)')
+	print(f'  attendance_marks + indexes {sizes["attendance_marks"] / 1e6:8.2f} MB')
+	print(f'  lecture_bitmaps + slots    {(sizes["lecture_bitmaps"] + sizes["roster_slots"]) / 1e6:8.2f} MB,'
+		  f' rebuilt in {rebuild * 1e3:.0f} ms')
+	print(f'Whole semester, fastest of {args.iterations} runs:')
+	width = max(len(r[0]) for r in rows)
+	print(f'  {"".ljust(width)}  ' + '  '.join(f'{source:>10}' for source in reports.SOURCES))
+	for name, times in rows:
+		print(f'  {name.ljust(width)}  ' + '  '.join(f'{times[source] * 1e3:8.2f}ms' for source in reports.SOURCES))
+	print(f'  {"headcount per lecture".ljust(width)}  {grouped[0] * 1e3:8.2f}ms (GROUP BY)  {popcount[0] * 1e3:8.2f}ms (popcount)')
+	print(f'Save of one changed mark: median {sorted(saves)[len(saves) // 2] * 1e3:.2f} ms including the bitmap flush')
+	print(f'{mismatches} report(s) differing between sources, {stale} stale bitmap(s) after the saves')
+	shutil.rmtree(tmpdir, ignore_errors=True)
+	return 1 if mismatches or stale else 0
+
+
+# analytics: streaks and recovery for every student of a semester
+
+def row_streaks(db, class_name):
+	"""{student_id: (attended, total, longest, current)} by walking the rows, for comparison."""
+	runs = {}
+	for sid, present in db.execute(
+			'SELECT student_id, present FROM attendance_marks'
+			f" WHERE class_id = {compact.class_id_sql('?')} ORDER BY student_id, day, subject_id", (class_name,)):
+		attended, total, longest, current = runs.get(sid, (0, 0, 0, 0))
+		current = 0 if present else current + 1
+		runs[sid] = (attended + present, total + 1, max(longest, current), current)
+	return runs
+
+
+def bench_analytics(args):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	counts = synthetic.generate(path, args.classes, args.students, args.subjects, args.days, seed=args.seed)
+	db = database.connect(path)
+	classes = synthetic.class_names(args.classes)
+
+	def timed_best(fn):
+		best = float('inf')
+		for _ in range(args.iterations):
+			t = time.perf_counter()
+			result = fn()
+			best = min(best, time.perf_counter() - t)
+		return best, result
+
+	matrix_time, _ = timed_best(lambda: [analytics.student_metrics(db, cls) for cls in classes])
+	report_time, _ = timed_best(lambda: [analytics.class_report(db, cls) for cls in classes])
+	rows_time, expected = timed_best(lambda: [row_streaks(db, cls) for cls in classes])
+	mismatches = 0
+	for cls, want in zip(classes, expected):
+		got = {sid: (m['attended'], m['total'], m['longest_absence'], m['current_absence'])
+			   for sid, m in analytics.student_metrics(db, cls).items()}
+		mismatches += sum(1 for sid in set(got) | set(want) if got.get(sid) != want.get(sid))
+	db.close()
+
+	students = args.classes * args.students
+	print(f'{counts["attendance"]} attendance rows ({args.classes} classes x {args.students} students,'
+		  f' {args.subjects} subjects, {args.days} days), fastest of {args.iterations} runs:')
+	report('Streaks and recovery for all students', [
+		('row by row in Python (streaks only)', rows_time),
+		('lecture grid', matrix_time),
+		('lecture grid, with per-subject at-risk lists', report_time),
+	])
+	print(f'{students} students: {report_time * 1e3:.0f} ms for the full analytics, {mismatches} student(s) differing')
+	shutil.rmtree(tmpdir, ignore_errors=True)
+	return 1 if mismatches else 0
+
+
+# register: the roster x dates register as CSV and DOCX
+
+def register_per_cell(db, class_name, subject, dates):
+	"""The register built the way the routes would have: one query per cell."""
+	rows = []
+	for r in db.execute('SELECT student_id, roll_no, prn, name FROM students WHERE class = ? ORDER BY roll_no', (class_name,)):
+		marks = []
+		for date in dates:
+			cell = db.execute(
+				'SELECT present FROM attendance_marks WHERE class_id = ? AND subject_id = ? AND day = ? AND student_id = ?',
+				(*compact.ids(db, class_name, subject), compact.day_number(date), r['student_id'])).fetchone()
+			marks.append('' if cell is None else 'P' if cell[0] else 'A')
+		rows.append(marks)
+	return rows
+
+
+def bench_register(args):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	counts = synthetic.generate(path, 1, args.students, 1, args.days, seed=args.seed)
+	db = database.connect(path)
+	class_name = synthetic.class_names(1)[0]
+	subject = db.execute('SELECT name FROM subjects').fetchone()[0]
+
+	def measure(fn):
+		# timed apart from the traced run, tracemalloc slows allocation-heavy code several times over
+		gc.collect()
+		start = time.perf_counter()
+		result = fn()
+		elapsed = time.perf_counter() - start
+		tracemalloc.start()
+		fn()
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		return elapsed, peak, result
+
+	def csv_bytes():
+		header, rows = exports.register_csv(*reports.register(db, class_name, subject))
+		return sum(len(chunk) for chunk in exports.iter_csv(header, rows))
+
+	def docx_bytes():
+		out = BytesIO()
+		exports.register_docx(out, *reports.register(db, class_name, subject), class_name, subject, 'start', 'end')
+		return len(out.getvalue())
+
+	dates, rows = reports.register(db, class_name, subject)
+	rows = [r['marks'] for r in rows]
+	results = [
+		('one query per cell (rows only)', measure(lambda: register_per_cell(db, class_name, subject, dates))),
+		('ordered query (rows only)', measure(lambda: [r['marks'] for r in reports.register(db, class_name, subject)[1]])),
+		('CSV, streamed', measure(csv_bytes)),
+		('DOCX', measure(docx_bytes)),
+	]
+	db.close()
+	mismatches = sum(1 for name, (_, _, result) in results[:2] if result != rows)
+	print(f'{counts["attendance"]} attendance rows: {args.students} students x {len(dates)} lectures')
+	width = max(len(name) for name, _ in results)
+	for name, (elapsed, peak, result) in results:
+		size = f'  {result / 1024:8.1f} KB' if isinstance(result, int) else ''
+		print(f'  {name.ljust(width)}  {elapsed * 1e3:8.1f} ms  peak {peak / 1024:8.1f} KB{size}')
+	print(f'{mismatches} register(s) differing from the ordered query')
+	shutil.rmtree(tmpdir, ignore_errors=True)
+	return 1 if mismatches else 0
+
+
+# archive: moving a closed semester out, and reports over hot, archived and spanning ranges
+
+def archive_reports(db, cls, subject, start, end):
+	"""``bitmap_reports`` plus the register and one student's subject totals."""
+	student = db.execute('SELECT student_id FROM students WHERE class = ? ORDER BY roll_no LIMIT 1', (cls,)).fetchone()[0]
+	return bitmap_reports(db, cls, subject, start, end) + (
+		('register', lambda source: (lambda dates, rows: (dates, list(rows)))(*reports.register(db, cls, subject, start, end))),
+		('student subject totals', lambda source: reports.subject_totals(db, student, start, end, source=source)),
+	)
+
+
+def bench_archive(args):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	counts = synthetic.generate(path, args.classes, args.students, args.subjects, 2 * args.days, seed=args.seed)
+	days = synthetic.teaching_days('2025-01-06', 2 * args.days)
+	ranges = {'hot semester': (days[args.days], days[-1]), 'archived semester': (days[0], days[args.days - 1]),
+			  'both semesters': (days[0], days[-1])}
+	db = database.connect(path)
+	cls, subject = db.execute('SELECT class, subject FROM teacher_assignments ORDER BY assignment_id LIMIT 1').fetchone()
+
+	def run_all():
+		results, times = {}, {}
+		for label, (start, end) in ranges.items():
+			for name, fn in archive_reports(db, cls, subject, start, end):
+				results[label, name] = fn(None)
+				times[label, name] = timed(lambda: fn(None), args.iterations)
+		return results, times
+
+	db.execute('VACUUM')
+	before_size = os.path.getsize(path)
+	before, before_times = run_all()
+	steps = []
+	last = [time.perf_counter()]
+
+	def progress(message):
+		now = time.perf_counter()
+		steps.append(now - last[0])
+		last[0] = now
+
+	start = time.perf_counter()
+	row = archive.move(db, 'bench', days[0], days[args.days - 1], batch=args.batch, progress=progress)
+	moved = time.perf_counter() - start
+	db.execute('VACUUM')
+	after_size = os.path.getsize(path)
+	archive_size = os.path.getsize(os.path.join(tmpdir, row['path']))
+	after, after_times = run_all()
+	mismatches = [key for key in before if before[key] != after[key]]
+	db.close()
+
+	print(f'{counts["attendance"]} attendance rows ({args.classes} classes x {args.students} students,'
+		  f' {args.subjects} subjects, 2 x {args.days} days); REPORT_SOURCE={reports.REPORT_SOURCE}')
+	print(f'  archived             {row["rows"]} rows in {moved:.2f} s, {len(steps)} steps, longest {max(steps) * 1e3:.0f} ms'
+		  f' (batches of {args.batch})')
+	print(f'  hot database         {before_size / 1e6:8.2f} MB -> {after_size / 1e6:8.2f} MB, archive file {archive_size / 1e6:.2f} MB')
+	print(f'Report time ({args.iterations} runs), before and after archiving:')
+	width = max(len(f'{label}: {name}') for label, name in before)
+	for key in before:
+		label = f'{key[0]}: {key[1]}'
+		print(f'  {label.ljust(width)}  {before_times[key] * 1e3:8.2f} ms  {after_times[key] * 1e3:8.2f} ms')
+	print(f'{len(before) - len(mismatches)} of {len(before)} reports identical after archiving')
+	for label, name in mismatches:
+		print(f'  MISMATCH {label}: {name}')
+	shutil.rmtree(tmpdir, ignore_errors=True)
+	return 1 if mismatches else 0
+
+
+# writers: lecture change-over, every teacher saving at the same moment
+
+def changeover_db(markers, students):
+	"""Scratch database with one teacher and one class of ``students`` per marker."""
+	path, db = scratch_db()
+	db.execute('DELETE FROM teachers')
+	db.executemany('INSERT INTO teachers (teacher_id, name, phone, password_hash) VALUES (?,?,?,?)',
+				   [(i + 1, f'Teacher {i}', f'9{i:09d}', 'x') for i in range(markers)])
+	db.executemany('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,2,?)',
+				   [(f'B{i:02d}{n:03d}', f'P{i:02d}{n:03d}', f'Student {n}', f'BENCH-{i:02d}', 'x')
+					for i in range(markers) for n in range(students)])
+	db.commit()
+	rosters = [[r[0] for r in db.execute('SELECT student_id FROM students WHERE class = ? ORDER BY roll_no', (f'BENCH-{i:02d}',))]
+			   for i in range(markers)]
+	db.close()
+	return path, rosters
+
+
+def changeover(path, rosters, rounds, save):
+	"""Every marker saves one lecture per round, all released at once; returns (seconds, latencies, errors)."""
+	markers = len(rosters)
+	barrier = threading.Barrier(markers)
+	latencies, errors = [], []
+
+	def marker(i):
+		for r in range(rounds):
+			statuses = {sid: 'Present' if (sid + r) % 4 else 'Absent' for sid in rosters[i]}
+			barrier.wait()
+			start = time.perf_counter()
+			try:
+				save(i, 'SUB', f'2025-03-{r + 1:02d}', statuses)
+			except sqlite3.OperationalError as exc:
+				errors.append(exc)
+			else:
+				latencies.append(time.perf_counter() - start)
+
+	threads = [threading.Thread(target=marker, args=(i,)) for i in range(markers)]
+	start = time.perf_counter()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return time.perf_counter() - start, sorted(latencies), errors
+
+
+def bench_writers(args):
+	template, rosters = changeover_db(args.markers, args.students)
+	pragmas = dict(database.PRAGMAS, synchronous=args.synchronous)
+	rows = []
+	for name in ('transaction per request, no busy_timeout', f'transaction per request, busy_timeout {pragmas["busy_timeout"]} ms',
+				 'writer thread, group commit'):
+		path = scratch_copy(template)
+		pool = database.ConnectionPool(path, dict(pragmas, busy_timeout=0) if 'no busy' in name else pragmas)
+		if name.startswith('writer'):
+			writes = writer.Writer(pool.connection, pool.release)
+
+			def save(i, subject, date, statuses):
+				writes.run(marking.save_lecture, i + 1, f'BENCH-{i:02d}', subject, date, statuses)
+		else:
+			def save(i, subject, date, statuses):
+				db = pool.connection()
+				try:
+					with database.transaction(db):
+						marking.save_lecture(db, i + 1, f'BENCH-{i:02d}', subject, date, statuses)
+				finally:
+					pool.release(db)
+		commits = lambda: metrics.snapshot().get(metrics.WRITE_GROUP.name, {}).get('[]', [0])[-1]
+		before = commits()
+		seconds, latencies, errors = changeover(path, rosters, args.rounds, save)
+		groups = commits() - before
+		check = database.connect(path)
+		written = check.execute('SELECT COUNT(*) FROM attendance_marks').fetchone()[0]
+		check.close()
+		pool.close_all()
+		shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+		saved = len(latencies)
+		rows.append((name, saved, len(errors), saved / seconds, latencies, written == saved * args.students,
+					 groups and saved / groups))
+	shutil.rmtree(os.path.dirname(template), ignore_errors=True)
+
+	print(f'{args.markers} markers x {args.rounds} lectures of {args.students} students, released together each round'
+		  f' (synchronous={args.synchronous})')
+	for name, saved, errors, rate, latencies, complete, group in rows:
+		p50 = latencies[len(latencies) // 2] * 1e3 if latencies else 0.0
+		p95 = latencies[int(len(latencies) * 0.95)] * 1e3 if latencies else 0.0
+		print(f'  {name}')
+		print(f'    {saved:4} saved, {errors:4} locked   {rate:7.1f} lectures/s   p50 {p50:7.1f} ms   p95 {p95:7.1f} ms'
+			  + (f'   {group:.1f} per commit' if group else '') + ('' if complete else '   ROW COUNT MISMATCH'))
+	base = rows[1][3]
+	if base:
+		print(f'Writer thread throughput: {rows[2][3] / base:.1f}x the busy_timeout path')
+	return 1 if rows[2][2] or not all(r[5] for r in rows) else 0
+
+
+# routes: every route on a synthetic database, compared with a stored baseline
+
+ROUTE_METRICS = ('cold_ms', 'warm_ms', 'queries', 'warm_queries', 'peak_kb')
+# a change smaller than this is noise whatever the tolerance
+NOISE_FLOOR = {'cold_ms': 2.0, 'warm_ms': 1.0, 'peak_kb': 64}
+
+
+def route_requests(db):
+	"""check_query_plans' sample requests plus logins that succeed and a full mark."""
+	import check_query_plans
+	reqs = check_query_plans.sample_requests(db)
+	student = db.execute('SELECT prn FROM students ORDER BY student_id LIMIT 1').fetchone()
+	teacher = db.execute('SELECT t.teacher_id, t.name, t.phone, a.class, a.subject FROM teacher_assignments a'
+						 ' JOIN teachers t ON t.teacher_id = a.teacher_id ORDER BY a.assignment_id LIMIT 1').fetchone()
+	if student:
+		reqs.append((None, 'POST', '/login', {'role': 'student', 'username': student['prn'], 'password': imports.DEFAULT_STUDENT_PASSWORD}))
+	if teacher:
+		teacher_user = {'id': teacher['teacher_id'], 'name': teacher['name'], 'role': 'teacher'}
+		reqs += [
+			(None, 'POST', '/login', {'role': 'teacher', 'username': teacher['phone'], 'password': synthetic.TEACHER_PASSWORD}),
+			(teacher_user, 'POST', f'/teacher/mark?cls={teacher["class"]}&subject={teacher["subject"]}',
+			 {'date': '2099-01-01', 'mark_all': 'on'}),
+		]
+	reqs.append((None, 'POST', '/login', {'role': 'admin', 'username': synthetic.ADMIN_EMAIL, 'password': synthetic.ADMIN_PASSWORD}))
+	return reqs
+
+
+def route_label(method, url, data, seen):
+	label = f'{method} {url}'
+	if data and 'role' in data:
+		label += f' role={data["role"]}'
+	seen[label] = seen.get(label, 0) + 1
+	return label if seen[label] == 1 else f'{label} #{seen[label]}'
+
+
+def compare_routes(results, baseline, tolerance):
+	"""Print results next to the baseline; returns the number of regressions."""
+	regressions = 0
+	if baseline and baseline.get('dataset') != results['dataset']:
+		print(f'warning: baseline dataset {baseline.get("dataset")} differs from {results["dataset"]}')
+	width = max(len(label) for label in results['routes'])
+	print(f'{"route".ljust(width)}  {"cold ms":>9} {"warm ms":>9} {"queries":>7} {"peak KB":>9}')
+	for label, r in results['routes'].items():
+		line = f'{label.ljust(width)}  {r["cold_ms"]:9.2f} {r["warm_ms"]:9.2f} {r["queries"]:7d} {r["peak_kb"]:9.1f}'
+		old = (baseline or {}).get('routes', {}).get(label)
+		worse = []
+		if old:
+			for metric in ROUTE_METRICS:
+				floor = NOISE_FLOOR.get(metric, 0)
+				if r[metric] > old[metric] * (1 + tolerance) + floor or (not floor and r[metric] > old[metric]):
+					worse.append(f'{metric} {old[metric]:g} -> {r[metric]:g}')
+		if worse:
+			regressions += 1
+			line += '  REGRESSED: ' + ', '.join(worse)
+		print(line)
+	return regressions
+
+
+def bench_routes(args):
+	tmpdir = tempfile.mkdtemp(prefix='attendance-bench-')
+	path = os.path.join(tmpdir, 'bench.db')
+	if args.db:
+		shutil.copy(args.db, path)
+		dataset = {'db': os.path.basename(args.db)}
+	else:
+		dataset = {'classes': args.classes, 'students': args.students, 'subjects': args.subjects,
+				   'days': args.days, 'seed': args.seed}
+		synthetic.generate(path, args.classes, args.students, args.subjects, args.days, seed=args.seed)
+	os.environ['ATTENDANCE_DB'] = path
+	os.environ['EXPORT_CACHE_DIR'] = os.path.join(tmpdir, 'exports')
+	import app as app_module
+
+	statements = []
+
+	def trace(sql):
+		# statements run by triggers are reported too; count only the app's own
+		if not sql.startswith('--'):
+			statements.append(sql)
+
+	for readonly in (False, True):
+		app_module.pool.connection(readonly=readonly).set_trace_callback(trace)
+	export_connect = app_module.export_jobs.connect
+
+	def traced_export_connection():
+		db = export_connect()
+		db.set_trace_callback(trace)
+		return db
+
+	app_module.export_jobs.connect = traced_export_connection
+	writer = database.connect(path)
+	client = app_module.app.test_client()
+
+	def invalidate():
+		# a write elsewhere: report cache, export cache and ETags all go stale
+		with database.transaction(writer):
+			writer.execute(versions.BUMP)
+
+	def run(user, method, url, data):
+		with client.session_transaction() as sess:
+			sess.clear()
+			if user:
+				sess['user'] = user
+		del statements[:]
+		# as timeit does: a collection landing in one run is noise
+		gc.collect()
+		gc.disable()
+		start = time.perf_counter()
+		resp = client.open(url, method=method, data=data)
+		resp.get_data()
+		if resp.status_code == 302 and '/exports/' in resp.location:
+			# a PDF export is only done once the file has been downloaded
+			job = app_module.export_jobs.get(resp.location.rsplit('/', 1)[-1])
+			while job and not job.finished:
+				time.sleep(0.0005)
+			client.get(resp.location + '/download').get_data()
+		elapsed = time.perf_counter() - start
+		gc.enable()
+		return elapsed, len(statements), resp.status_code
+
+	results = {'dataset': dataset, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			   'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+			   'iterations': args.iterations, 'routes': {}}
+	seen = {}
+	for user, method, url, data in route_requests(writer):
+		invalidate()
+		tracemalloc.start()
+		run(user, method, url, data)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		cold = []
+		for _ in range(args.iterations):
+			invalidate()
+			cold.append(run(user, method, url, data))
+		warm = [run(user, method, url, data) for _ in range(args.iterations)]
+		results['routes'][route_label(method, url, data, seen)] = {
+			'method': method, 'url': url, 'status': cold[-1][2],
+			'cold_ms': round(min(c[0] for c in cold) * 1e3, 3),
+			'warm_ms': round(min(w[0] for w in warm) * 1e3, 3),
+			'queries': cold[-1][1],
+			'warm_queries': warm[-1][1],
+			'peak_kb': round(peak / 1024, 1),
+		}
+	writer.close()
+	app_module.pool.close_all()
+	shutil.rmtree(tmpdir, ignore_errors=True)
+
+	baseline = None
+	if args.baseline and os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	regressions = compare_routes(results, baseline, args.tolerance)
+	if args.out:
+		with open(args.out, 'w') as f:
+			json.dump(results, f, indent=1)
+			f.write('\n')
+	if baseline:
+		print(f'{regressions} of {len(results["routes"])} routes regressed against {args.baseline} (tolerance {args.tolerance:.0%}).')
+	return 1 if regressions else 0
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	p = sub.add_parser('connect', help='per-request connection overhead')
+	p.add_argument('--db', default=DEFAULT_DB)
+	p.add_argument('--iterations', type=int, default=2000)
+	p.set_defaults(func=bench_connect)
+
+	p = sub.add_parser('mark', help='teacher_mark save for one class')
+	p.add_argument('--students', type=int, default=120)
+	p.add_argument('--iterations', type=int, default=50)
+	p.set_defaults(func=bench_mark)
+
+	p = sub.add_parser('import', help='bulk roster import')
+	p.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+	p.add_argument('--legacy-sample', type=int, default=100)
+	p.add_argument('--teacher-rows', type=int, default=200)
+	p.set_defaults(func=bench_import)
+
+	p = sub.add_parser('login', help='password verification cost and login bursts')
+	p.add_argument('--threads', type=int, default=8)
+	p.add_argument('--attempts', type=int, default=40)
+	p.set_defaults(func=bench_login)
+
+	p = sub.add_parser('export', help='peak memory of a large CSV export')
+	p.add_argument('--students', type=int, default=20000)
+	p.add_argument('--days', type=int, default=5)
+	p.set_defaults(func=bench_export)
+
+	p = sub.add_parser('search', help='substring search over a large roster')
+	p.add_argument('--students', type=int, default=50000)
+	p.add_argument('--iterations', type=int, default=200)
+	p.set_defaults(func=bench_search)
+
+	p = sub.add_parser('batch', help='a day of lectures as form posts vs one JSON batch')
+	p.add_argument('--students', type=int, default=120)
+	p.add_argument('--lectures', type=int, default=6)
+	p.add_argument('--changes', type=int, default=5)
+	p.add_argument('--days', type=int, default=10)
+	p.set_defaults(func=bench_batch)
+
+	p = sub.add_parser('storage', help='attendance size and query time before and after the compact conversion')
+	p.add_argument('--classes', type=int, default=4)
+	p.add_argument('--students', type=int, default=60, help='per class')
+	p.add_argument('--subjects', type=int, default=5)
+	p.add_argument('--days', type=int, default=90)
+	p.add_argument('--seed', type=int, default=1)
+	p.add_argument('--batch', type=int, default=compact.BACKFILL_BATCH, help='rows per backfill transaction')
+	p.add_argument('--iterations', type=int, default=200)
+	p.set_defaults(func=bench_storage)
+
+	p = sub.add_parser('bitmaps', help='semester reports from rows, rollups and lecture bitmaps')
+	p.add_argument('--classes', type=int, default=8)
+	p.add_argument('--students', type=int, default=60, help='per class')
+	p.add_argument('--subjects', type=int, default=5)
+	p.add_argument('--days', type=int, default=100, help='teaching days (a semester)')
+	p.add_argument('--seed', type=int, default=1)
+	p.add_argument('--iterations', type=int, default=10)
+	p.set_defaults(func=bench_bitmaps)
+
+	p = sub.add_parser('analytics', help='recovery projections, streaks and at-risk lists for a semester')
+	p.add_argument('--classes', type=int, default=10)
+	p.add_argument('--students', type=int, default=200, help='per class')
+	p.add_argument('--subjects', type=int, default=5)
+	p.add_argument('--days', type=int, default=100, help='teaching days (a semester)')
+	p.add_argument('--seed', type=int, default=1)
+	p.add_argument('--iterations', type=int, default=3)
+	p.set_defaults(func=bench_analytics)
+
+	p = sub.add_parser('register', help='time and memory of the register export as CSV and DOCX')
+	p.add_argument('--students', type=int, default=120)
+	p.add_argument('--days', type=int, default=90, help='lectures (one a day)')
+	p.add_argument('--seed', type=int, default=1)
+	p.set_defaults(func=bench_register)
+
+	p = sub.add_parser('archive', help='archiving a semester, and reports over hot, archived and spanning ranges')
+	p.add_argument('--classes', type=int, default=8)
+	p.add_argument('--students', type=int, default=60, help='per class')
+	p.add_argument('--subjects', type=int, default=5)
+	p.add_argument('--days', type=int, default=100, help='teaching days per semester (two are generated)')
+	p.add_argument('--batch', type=int, default=archive.BATCH, help='rows per transaction')
+	p.add_argument('--seed', type=int, default=1)
+	p.add_argument('--iterations', type=int, default=5)
+	p.set_defaults(func=bench_archive)
+
+	p = sub.add_parser('writers', help='many teachers saving at once: per-request transactions vs the writer thread')
+	p.add_argument('--markers', type=int, default=50)
+	p.add_argument('--students', type=int, default=60, help='per class')
+	p.add_argument('--rounds', type=int, default=5, help='lectures each marker saves')
+	p.add_argument('--synchronous', default=database.PRAGMAS['synchronous'])
+	p.set_defaults(func=bench_writers)
+
+	p = sub.add_parser('routes', help='time, queries and peak memory of every route, against a baseline')
+	p.add_argument('--db', help='benchmark a copy of this database instead of a synthetic one')
+	p.add_argument('--classes', type=int, default=4)
+	p.add_argument('--students', type=int, default=60, help='per class')
+	p.add_argument('--subjects', type=int, default=5)
+	p.add_argument('--days', type=int, default=90)
+	p.add_argument('--seed', type=int, default=1)
+	p.add_argument('--iterations', type=int, default=5, help='cold and warm runs per route (the fastest of each is kept)')
+	p.add_argument('--out', help='write the results as JSON')
+	p.add_argument('--baseline', help='results JSON to compare against')
+	p.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a route counts as regressed')
+	p.set_defaults(func=bench_routes)
+
+	args = parser.parse_args()
+	# the scratch data is built with deliberately large statements
+	timing.SLOW_QUERY = float('inf')
+	metrics.METRICS_DIR = None
+	return args.func(args)
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+In-process LRU + TTL cache for report results.
+
+Entries carry the data version (see ``versions``) they were computed at. A
+lookup with a newer version is a miss and replaces the entry, so any write,
+from any worker process, invalidates every cached report at once without
+the caches having to talk to each other.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', '256'))
+REPORT_CACHE_TTL = float(os.environ.get('REPORT_CACHE_TTL', '300'))
+
+
+class VersionedCache:
+	def __init__(self, maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL, clock=time.monotonic):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.clock = clock
+		self.hits = self.misses = self.evictions = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get_or_compute(self, key, version, compute):
+		"""(value, hit) for ``key`` at ``version``; ``compute()`` runs on a miss."""
+		now = self.clock()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry and entry[0] == version and now - entry[1] < self.ttl:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry[2], True
+			self.misses += 1
+		# computed outside the lock; two concurrent misses just both compute
+		value = compute()
+		with self._lock:
+			self._entries[key] = (version, now, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.maxsize:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+		return value, False
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+					'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+					'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0}
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check.
+
+Drives every route through the Flask test client against a scratch copy of
+the database, records each SQL statement the app executes and runs
+EXPLAIN QUERY PLAN on it. Exits non-zero if any statement scans the
+attendance table, or does a full (non-index) scan of students.
+
+It then repeats every cacheable GET with the ETag it was given and fails
+unless the answer is a 304 reached without a single attendance query.
+Finally it checks that ``/metrics`` counted every request it made.
+
+Usage:
+	python check_query_plans.py [--db attendance.db] [-v]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHECKED_TABLES = ('attendance', 'attendance_marks', 'students')
+ATTENDANCE_TABLES = ('attendance', 'attendance_marks')
+ATTENDANCE_QUERY = re.compile(r'\battendance', re.IGNORECASE)
+KEYWORDS = {'where', 'join', 'left', 'inner', 'on', 'group', 'order', 'limit', 'set', 'values', 'as', 'using'}
+
+
+def sample_requests(db, start='2000-01-01', end='2099-12-31'):
+	"""(session user, method, path, form data) for every route, using real ids from db."""
+	teacher = db.execute('SELECT t.teacher_id, t.name, a.class, a.subject FROM teacher_assignments a JOIN teachers t ON t.teacher_id = a.teacher_id ORDER BY a.assignment_id LIMIT 1').fetchone()
+	student = db.execute('SELECT * FROM students ORDER BY student_id LIMIT 1').fetchone()
+	teacher_user = {'id': teacher['teacher_id'], 'name': teacher['name'], 'role': 'teacher'} if teacher else None
+	student_user = {'id': student['student_id'], 'name': student['name'], 'role': 'student', 'class': student['class'],
+					'semester': student['semester'], 'roll_no': student['roll_no'], 'prn': student['prn']} if student else None
+	admin_user = {'id': 1, 'name': 'Admin', 'role': 'admin', 'email': 'admin@example.com'}
+	hod_user = {'id': 1, 'name': 'HOD', 'role': 'hod', 'phone': '0000000000'}
+	rng = f'start={start}&end={end}'
+	reqs = [
+		(None, 'POST', '/login', {'role': 'student', 'username': student['prn'] if student else 'x', 'password': 'x'}),
+		(None, 'POST', '/login', {'role': 'teacher', 'username': '0000000000', 'password': 'x'}),
+		(None, 'POST', '/login', {'role': 'hod', 'username': '0000000000', 'password': 'x'}),
+		(None, 'POST', '/login', {'role': 'admin', 'username': 'admin@example.com', 'password': 'x'}),
+		(None, 'GET', f'/sheet?{rng}', None),
+		(None, 'GET', f'/sheet?search=a&{rng}', None),
+		(None, 'GET', f'/sheet?search=pat&{rng}', None),
+		(admin_user, 'GET', '/students/search?q=pat', None),
+		(admin_user, 'GET', '/students/search?q=2', None),
+		(None, 'GET', f'/sheet?per_page=10&after={student["roll_no"] if student else ""}&{rng}', None),
+		(None, 'GET', f'/sheet?sort=-roll&per_page=10&after={student["roll_no"] if student else ""}&{rng}', None),
+		(None, 'GET', f'/sheet?sort=percent&per_page=10&after=0.5~{student["roll_no"] if student else ""}&{rng}', None),
+		(None, 'GET', f'/sheet?sort=-percent&per_page=10&{rng}', None),
+		(None, 'GET', f'/sheet/export/csv?{rng}', None),
+		(None, 'GET', f'/sheet/export/pdf?{rng}', None),
+		(admin_user, 'GET', f'/admin/reports?{rng}', None),
+		(admin_user, 'GET', f'/admin/export/csv?{rng}', None),
+		(admin_user, 'GET', f'/admin/export/pdf?{rng}', None),
+		(admin_user, 'GET', f'/admin/analytics?{rng}', None),
+		(hod_user, 'GET', f'/admin/analytics?threshold=80&limit=5&{rng}', None),
+		(admin_user, 'POST', '/admin/students/import', {'class': 'PLANCHECK', 'data': 'PC01,PC0001,Plan Check'}),
+		(admin_user, 'POST', '/admin/teachers/import', {'data': 'Plan Teacher,0000000001,pw,PLANSUB,PLANCHECK'}),
+		(hod_user, 'POST', '/hod/class/import', {'class': 'PLANCHECK', 'data': 'PC02,PC0002,Plan Check Two', 'assignments': 'PLANSUB, 0000000001'}),
+	]
+	if student_user:
+		reqs.append((student_user, 'GET', f'/student/dashboard?{rng}', None))
+		reqs.append((student_user, 'GET', '/student/dashboard?period=monthly', None))
+	if teacher_user:
+		cls, subject = teacher['class'], teacher['subject']
+		reqs += [
+			(teacher_user, 'GET', '/teacher/select', None),
+			(teacher_user, 'GET', f'/teacher/mark?cls={cls}&subject={subject}', None),
+			(teacher_user, 'POST', f'/teacher/mark?cls={cls}&subject={subject}', {'date': end[:4] + '-01-01'}),
+			(teacher_user, 'GET', f'/teacher/report?cls={cls}&subject={subject}&{rng}', None),
+			(teacher_user, 'GET', f'/teacher/export/csv?cls={cls}&subject={subject}&{rng}', None),
+			(teacher_user, 'GET', f'/teacher/export/pdf?cls={cls}&subject={subject}&{rng}', None),
+			(teacher_user, 'GET', f'/teacher/register/csv?cls={cls}&subject={subject}&{rng}', None),
+			(teacher_user, 'GET', f'/teacher/register/docx?cls={cls}&subject={subject}&{rng}', None),
+			(admin_user, 'GET', f'/admin/reports?class={cls}&subject={subject}&search=a&{rng}', None),
+			(None, 'GET', f'/sheet?class={cls}&subject={subject}&{rng}', None),
+		]
+	reqs += [
+		(hod_user, 'POST', '/hod/remove/student', {'id': 'PC01'}),
+		(hod_user, 'POST', '/hod/remove/teacher', {'phone': '0000000001'}),
+	]
+	return reqs
+
+
+def table_aliases(sql):
+	aliases = {}
+	for m in re.finditer(r'\b(' + '|'.join(CHECKED_TABLES) + r')\b(?:\s+(?:AS\s+)?(\w+))?', sql, re.IGNORECASE):
+		table = m.group(1).lower()
+		aliases[table] = table
+		alias = m.group(2)
+		if alias and alias.lower() not in KEYWORDS:
+			aliases[alias] = table
+	return aliases
+
+
+def plan_problems(db, sql):
+	plan = db.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+	aliases = table_aliases(sql)
+	problems = []
+	for row in plan:
+		detail = row[3]
+		m = re.match(r'SCAN (\w+)(.*)$', detail)
+		if not m or m.group(1) not in aliases:
+			continue
+		table = aliases[m.group(1)]
+		# an ordered index walk of the whole roster is fine for institute-wide
+		# views; any scan of attendance is not
+		if table in ATTENDANCE_TABLES or 'INDEX' not in m.group(2):
+			problems.append(detail)
+	return plan, problems
+
+
+def wait_for_export(app_module, resp):
+	# a PDF request that redirects to a job keeps querying in the background
+	if resp.status_code == 302 and '/exports/' in resp.location:
+		job = app_module.export_jobs.get(resp.location.rsplit('/', 1)[-1])
+		while job and not job.finished:
+			time.sleep(0.01)
+
+
+def metrics_request_count(text):
+	total = 0
+	for line in text.splitlines():
+		if line.startswith('attendance_requests_total{'):
+			total += int(float(line.rsplit(' ', 1)[1]))
+	return total
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--db', default=os.path.join(HERE, 'attendance.db'))
+	parser.add_argument('-v', '--verbose', action='store_true')
+	args = parser.parse_args()
+
+	tmpdir = tempfile.mkdtemp(prefix='attendance-plans-')
+	path = os.path.join(tmpdir, 'plans.db')
+	shutil.copy(args.db, path)
+	os.environ['ATTENDANCE_DB'] = path
+	os.environ['EXPORT_CACHE_DIR'] = os.path.join(tmpdir, 'exports')
+	os.environ['METRICS_DIR'] = os.path.join(tmpdir, 'metrics')
+	sys.path.insert(0, HERE)
+	import app as app_module
+
+	statements = []
+	for readonly in (False, True):
+		app_module.pool.connection(readonly=readonly).set_trace_callback(statements.append)
+	export_connect = app_module.export_jobs.connect
+
+	def traced_export_connection():
+		# background exports query on their own worker-thread connections
+		db = export_connect()
+		db.set_trace_callback(statements.append)
+		return db
+
+	app_module.export_jobs.connect = traced_export_connection
+	writer_connect = app_module.writes.connect
+
+	def traced_writer_connection():
+		# marking and imports write on the writer thread's connection
+		db = writer_connect()
+		db.set_trace_callback(statements.append)
+		return db
+
+	app_module.writes.connect = traced_writer_connection
+	sampler = sqlite3.connect(path)
+	sampler.row_factory = sqlite3.Row
+	requests = sample_requests(sampler)
+	sampler.close()
+	client = app_module.app.test_client()
+	for user, method, url, data in requests:
+		with client.session_transaction() as sess:
+			sess.clear()
+			if user:
+				sess['user'] = user
+		resp = client.open(url, method=method, data=data)
+		if resp.status_code >= 500:
+			print(f'{method} {url} -> {resp.status_code}')
+			return 2
+		wait_for_export(app_module, resp)
+
+	checker = sqlite3.connect(path)
+	seen = set()
+	failures = 0
+	for sql in statements:
+		head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+		if head not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH') or sql in seen:
+			continue
+		seen.add(sql)
+		plan, problems = plan_problems(checker, sql)
+		if problems or args.verbose:
+			print(('FAIL ' if problems else 'ok   ') + ' '.join(sql.split()))
+			for row in plan:
+				print('       ' + row[3])
+		failures += bool(problems)
+	checker.close()
+	print(f'{len(seen)} distinct statements checked, {failures} with table scans.')
+
+	revalidated = stale = 0
+	for user, method, url, data in requests:
+		if method != 'GET':
+			continue
+		with client.session_transaction() as sess:
+			sess.clear()
+			if user:
+				sess['user'] = user
+		resp = client.get(url)
+		wait_for_export(app_module, resp)
+		etag = resp.headers.get('ETag')
+		resp.close()
+		if resp.status_code != 200 or not etag:
+			continue
+		del statements[:]
+		again = client.get(url, headers={'If-None-Match': etag})
+		touched = [sql for sql in statements if ATTENDANCE_QUERY.search(sql)]
+		revalidated += 1
+		if again.status_code != 304 or touched:
+			stale += 1
+			print(f'FAIL revalidate GET {url} -> {again.status_code}, {len(touched)} attendance queries')
+	print(f'{revalidated} conditional GETs revalidated, {stale} not answered by a query-free 304.')
+
+	# every sample, every GET again, and the conditional repeats
+	sent = len(requests) + sum(1 for r in requests if r[1] == 'GET') + revalidated
+	with client.session_transaction() as sess:
+		sess.clear()
+		sess['user'] = {'id': 1, 'name': 'Admin', 'role': 'admin', 'email': 'admin@example.com'}
+	counted = metrics_request_count(client.get('/metrics').get_data(as_text=True))
+	print(f'/metrics counted {counted} of {sent} requests.')
+
+	app_module.pool.close_all()
+	shutil.rmtree(tmpdir, ignore_errors=True)
+	return 1 if failures or stale or counted != sent else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+Compact attendance storage.
+
+Since migration 11, attendance lives in ``attendance_marks``: one
+``WITHOUT ROWID`` row per (class_id, subject_id, day, student_id) holding the
+teacher and a 0/1 ``present`` flag. Class and subject names are stored once,
+in the ``classes`` and ``subjects`` dictionary tables. ``day`` counts days
+since 1970-01-01. The rows of one lecture sit next to each other on disk, and
+date ranges compare integers instead of strings.
+
+``attendance`` is now a view with the old columns. INSTEAD OF triggers turn
+inserts, updates and deletes through it into writes on ``attendance_marks``,
+so scripts and ad-hoc queries written for the old table keep working. The
+app's hot paths use ``attendance_marks`` directly.
+
+The conversion runs online:
+- Migration 10 creates the new tables and mirrors every write on the old
+  table into them.
+- ``backfill`` copies the existing rows in short transactions
+  (``flask --app app compact-attendance``).
+- Migration 11 copies whatever is left, then swaps the view in for the old
+  table.
+"""
+
+from datetime import date, datetime
+
+# day numbers <-> ISO dates, in Python and in SQL
+EPOCH = date(1970, 1, 1).toordinal()
+JULIAN_EPOCH = 2440587.5
+# open bounds for date ranges
+FIRST_DAY = date.min.toordinal() - EPOCH
+LAST_DAY = date.max.toordinal() - EPOCH
+BACKFILL_BATCH = 5000
+# attendance_marks primary key, for keyset walks
+MARK_KEY = 'class_id, subject_id, day, student_id'
+
+
+def day_number(value):
+	"""Day number of a 'YYYY-MM-DD' string; ValueError if it is not one."""
+	return datetime.strptime(value, '%Y-%m-%d').toordinal() - EPOCH
+
+
+def day_or(value, default):
+	"""``day_number(value)``, or ``default`` for a missing or malformed date."""
+	try:
+		return day_number(value)
+	except (TypeError, ValueError):
+		return default
+
+
+def day_date(day):
+	return date.fromordinal(day + EPOCH).isoformat()
+
+
+def day_sql(expr):
+	return f'CAST(julianday({expr}) - {JULIAN_EPOCH} AS INTEGER)'
+
+
+def date_sql(expr):
+	return f'date({expr} + {JULIAN_EPOCH})'
+
+
+def class_id_sql(expr):
+	return f'(SELECT class_id FROM classes WHERE name = {expr})'
+
+
+def subject_id_sql(expr):
+	return f'(SELECT subject_id FROM subjects WHERE name = {expr})'
+
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS classes (
+	class_id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS subjects (
+	subject_id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS attendance_marks (
+	class_id INTEGER NOT NULL REFERENCES classes(class_id),
+	subject_id INTEGER NOT NULL REFERENCES subjects(subject_id),
+	day INTEGER NOT NULL,
+	student_id INTEGER NOT NULL,
+	teacher_id INTEGER NOT NULL,
+	present INTEGER NOT NULL CHECK (present IN (0, 1)),
+	PRIMARY KEY (class_id, subject_id, day, student_id),
+	FOREIGN KEY(student_id) REFERENCES students(student_id) ON DELETE CASCADE,
+	FOREIGN KEY(teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- one student over a date range (dashboard, cascades on student removal)
+CREATE INDEX IF NOT EXISTS idx_marks_student_day ON attendance_marks(student_id, day, subject_id, present);
+'''
+
+
+def _add_names(ref):
+	# NOT EXISTS rather than OR IGNORE: an outer upsert's conflict clause wins inside triggers
+	return f'''
+	INSERT INTO classes (name) SELECT {ref}.class WHERE NOT EXISTS (SELECT 1 FROM classes WHERE name = {ref}.class);
+	INSERT INTO subjects (name) SELECT {ref}.subject WHERE NOT EXISTS (SELECT 1 FROM subjects WHERE name = {ref}.subject);'''
+
+
+def _key(ref):
+	return (f'class_id = {class_id_sql(ref + ".class")} AND subject_id = {subject_id_sql(ref + ".subject")}'
+			f' AND day = {day_sql(ref + ".date")} AND student_id = {ref}.student_id')
+
+
+def _insert(ref):
+	return f'''
+	INSERT INTO attendance_marks (class_id, subject_id, day, student_id, teacher_id, present)
+		VALUES ({class_id_sql(ref + ".class")}, {subject_id_sql(ref + ".subject")}, {day_sql(ref + ".date")},
+			{ref}.student_id, {ref}.teacher_id, {ref}.status = 'Present');'''
+
+
+# migration 10: keep attendance_marks in step with the old table until the cutover
+MIRROR_TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS attendance_mirror_ai AFTER INSERT ON attendance BEGIN{_add_names('NEW')}
+	DELETE FROM attendance_marks WHERE {_key('NEW')};{_insert('NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_mirror_ad AFTER DELETE ON attendance BEGIN
+	DELETE FROM attendance_marks WHERE {_key('OLD')};
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_mirror_au AFTER UPDATE ON attendance BEGIN{_add_names('NEW')}
+	DELETE FROM attendance_marks WHERE {_key('OLD')};
+	DELETE FROM attendance_marks WHERE {_key('NEW')};{_insert('NEW')}
+END;
+'''
+
+BACKFILL_TABLE = '''
+CREATE TABLE IF NOT EXISTS attendance_backfill (
+	id INTEGER PRIMARY KEY CHECK (id = 0),
+	last_id INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO attendance_backfill (id, last_id) VALUES (0, 0);
+'''
+
+# migration 11: the old table's replacement
+VIEW = f'''
+CREATE VIEW IF NOT EXISTS attendance AS
+	SELECT m.student_id, m.teacher_id, sub.name AS subject, cls.name AS class, {date_sql('m.day')} AS date,
+		CASE m.present WHEN 1 THEN 'Present' ELSE 'Absent' END AS status
+	FROM attendance_marks m
+	JOIN classes cls ON cls.class_id = m.class_id
+	JOIN subjects sub ON sub.subject_id = m.subject_id;
+
+CREATE TRIGGER IF NOT EXISTS attendance_view_insert INSTEAD OF INSERT ON attendance BEGIN
+	SELECT RAISE(ABORT, 'status must be Present or Absent') WHERE NEW.status NOT IN ('Present', 'Absent');{_add_names('NEW')}{_insert('NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_view_delete INSTEAD OF DELETE ON attendance BEGIN
+	DELETE FROM attendance_marks WHERE {_key('OLD')};
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_view_update INSTEAD OF UPDATE ON attendance BEGIN
+	SELECT RAISE(ABORT, 'status must be Present or Absent') WHERE NEW.status NOT IN ('Present', 'Absent');{_add_names('NEW')}
+	UPDATE attendance_marks SET
+		class_id = {class_id_sql('NEW.class')}, subject_id = {subject_id_sql('NEW.subject')}, day = {day_sql('NEW.date')},
+		student_id = NEW.student_id, teacher_id = NEW.teacher_id, present = NEW.status = 'Present'
+		WHERE {_key('OLD')};
+END;
+'''
+
+
+def ids(db, class_name, subject, create=False):
+	"""(class_id, subject_id) for two names; None for a name never stored, unless ``create``."""
+	lookup = f'SELECT {class_id_sql("?")}, {subject_id_sql("?")}'
+	class_id, subject_id = db.execute(lookup, (class_name, subject)).fetchone()
+	if create and (class_id is None or subject_id is None):
+		db.execute('INSERT INTO classes (name) VALUES (?) ON CONFLICT(name) DO NOTHING', (class_name,))
+		db.execute('INSERT INTO subjects (name) VALUES (?) ON CONFLICT(name) DO NOTHING', (subject,))
+		class_id, subject_id = db.execute(lookup, (class_name, subject)).fetchone()
+	return class_id, subject_id
+
+
+def is_table(db, name):
+	return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def backfill(db, batch=BACKFILL_BATCH):
+	"""Copy the next ``batch`` old rows into attendance_marks; returns how many were read.
+
+	Runs inside the caller's transaction; 0 means the copy is complete. Rows
+	already mirrored by the migration 10 triggers are newer than the copy and
+	are left alone.
+	"""
+	if not is_table(db, 'attendance_backfill'):
+		return 0
+	last_id = db.execute('SELECT last_id FROM attendance_backfill WHERE id = 0').fetchone()[0]
+	upper = db.execute('SELECT MAX(attendance_id), COUNT(*) FROM (SELECT attendance_id FROM attendance'
+					   ' WHERE attendance_id > ? ORDER BY attendance_id LIMIT ?)', (last_id, batch)).fetchone()
+	if not upper[1]:
+		return 0
+	span = {'lo': last_id, 'hi': upper[0]}
+	old = 'FROM attendance a WHERE a.attendance_id > :lo AND a.attendance_id <= :hi'
+	db.execute(f'INSERT INTO classes (name) SELECT DISTINCT a.class {old}'
+			   ' AND NOT EXISTS (SELECT 1 FROM classes WHERE name = a.class)', span)
+	db.execute(f'INSERT INTO subjects (name) SELECT DISTINCT a.subject {old}'
+			   ' AND NOT EXISTS (SELECT 1 FROM subjects WHERE name = a.subject)', span)
+	db.execute(
+		'INSERT INTO attendance_marks (class_id, subject_id, day, student_id, teacher_id, present)'
+		f' SELECT c.class_id, s.subject_id, {day_sql("a.date")}, a.student_id, a.teacher_id, a.status = \'Present\''
+		' FROM attendance a JOIN classes c ON c.name = a.class JOIN subjects s ON s.name = a.subject'
+		' WHERE a.attendance_id > :lo AND a.attendance_id <= :hi'
+		f' AND NOT EXISTS (SELECT 1 FROM attendance_marks m WHERE m.class_id = c.class_id AND m.subject_id = s.subject_id'
+		f'  AND m.day = {day_sql("a.date")} AND m.student_id = a.student_id)', span)
+	db.execute('UPDATE attendance_backfill SET last_id = ? WHERE id = 0', (upper[0],))
+	return upper[1]
+
+
+def backfill_progress(db):
+	"""(rows copied or mirrored, rows in the old table), or None once converted."""
+	if not is_table(db, 'attendance_backfill'):
+		return None
+	return (db.execute('SELECT COUNT(*) FROM attendance_marks').fetchone()[0],
+			db.execute('SELECT COUNT(*) FROM attendance').fetchone()[0])
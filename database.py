@@ -0,0 +1,169 @@
+"""
+SQLite connection layer.
+
+Connections are opened once per thread (and per process) and reused across
+requests, so the page cache and statement cache survive between requests.
+Tuning pragmas come from the environment and are applied when a connection is
+opened. Read-only connections are opened with ``mode=ro`` for report routes.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import metrics
+import timing
+
+PRAGMAS = {
+	'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+	'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+	'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', '-16000')),
+	'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),
+	'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+	'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),
+}
+
+STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', '256'))
+
+
+def uri(path, mode=None):
+	"""``file:`` URI of a database path, ``mode=ro`` etc. if given."""
+	path = os.path.abspath(path).replace('%', '%25').replace('?', '%3f').replace('#', '%23')
+	return f'file:{path}' + (f'?mode={mode}' if mode else '')
+
+
+def connect(path, readonly=False, pragmas=None):
+	"""Open and configure a single connection.
+
+	Connections are created with ``check_same_thread=False`` only so that
+	``ConnectionPool.close_all`` can close them; the pool never hands one
+	connection to two threads.
+	"""
+	pragmas = PRAGMAS if pragmas is None else pragmas
+	factory = timing.TimedConnection if timing.ENABLED else sqlite3.Connection
+	# URI filenames on every connection, so ATTACH can open archives read-only (see ``archive``)
+	db = sqlite3.connect(uri(path, 'ro' if readonly else None), uri=True, cached_statements=STATEMENT_CACHE,
+						 check_same_thread=False, factory=factory)
+	db.row_factory = sqlite3.Row
+	db.execute('PRAGMA foreign_keys = ON')
+	# REPLACE must fire the attendance delete triggers that maintain rollups
+	db.execute('PRAGMA recursive_triggers = ON')
+	for name, value in pragmas.items():
+		if readonly and name == 'journal_mode':
+			continue
+		db.execute(f'PRAGMA {name} = {value}')
+	if readonly:
+		db.execute('PRAGMA query_only = ON')
+	return db
+
+
+@contextmanager
+def transaction(db):
+	"""BEGIN IMMEDIATE ... COMMIT, rolling back on error."""
+	started = time.perf_counter()
+	try:
+		db.execute('BEGIN IMMEDIATE')
+	finally:
+		# waits up to busy_timeout for the write lock
+		metrics.DB_LOCK_WAIT.observe(time.perf_counter() - started)
+	try:
+		yield db
+	except BaseException:
+		db.rollback()
+		raise
+	db.commit()
+
+
+class _Slots:
+	# one thread's connections; collected, with the thread-local, when the thread ends
+	__slots__ = ('rw', 'ro', 'opened', '__weakref__')
+
+	def __init__(self):
+		self.rw = self.ro = None
+		self.opened = []
+
+
+class ConnectionPool:
+	"""Per-thread, per-process cache of configured connections.
+
+	A thread's connections are closed when the thread ends, so servers that
+	start a thread per request do not pile up handles. After a fork the
+	child process drops (without closing) whatever it inherited and opens
+	its own connections, as SQLite handles must not be shared across
+	processes.
+	"""
+
+	def __init__(self, path, pragmas=None):
+		self.path = path
+		self.pragmas = pragmas
+		self._local = threading.local()
+		self._pid = os.getpid()
+		# reentrant: dropping a thread-local under the lock runs ``_discard``
+		self._lock = threading.RLock()
+		self._all = []
+		self._inherited = []
+
+	def _check_fork(self):
+		if os.getpid() != self._pid:
+			with self._lock:
+				if os.getpid() != self._pid:
+					# keep references so the parent's handles are never closed here
+					self._inherited.extend(self._all)
+					self._all = []
+					self._local = threading.local()
+					self._pid = os.getpid()
+
+	def _slots(self):
+		slots = getattr(self._local, 'slots', None)
+		if slots is None:
+			slots = self._local.slots = _Slots()
+			# not at exit: a streamed response may still be releasing its connection then
+			weakref.finalize(slots, self._discard, slots.opened, os.getpid()).atexit = False
+		return slots
+
+	def _discard(self, opened, pid):
+		if os.getpid() != pid:
+			# inherited across a fork: the parent still uses these handles
+			return
+		with self._lock:
+			for db in opened:
+				if db in self._all:
+					self._all.remove(db)
+				try:
+					db.close()
+				except sqlite3.Error:
+					pass
+
+	def connection(self, readonly=False):
+		self._check_fork()
+		slots = self._slots()
+		attr = 'ro' if readonly else 'rw'
+		db = getattr(slots, attr)
+		if db is None:
+			if readonly and not os.path.exists(self.path):
+				# nothing to read yet; fall back to a writable connection
+				return self.connection()
+			db = connect(self.path, readonly=readonly, pragmas=self.pragmas)
+			setattr(slots, attr, db)
+			slots.opened.append(db)
+			with self._lock:
+				self._all.append(db)
+		return db
+
+	def release(self, db):
+		# connections go back to the thread cache; never leak an open transaction
+		if db.in_transaction:
+			db.rollback()
+
+	def close_all(self):
+		with self._lock:
+			for db in self._all:
+				try:
+					db.close()
+				except sqlite3.Error:
+					pass
+			self._all = []
+			self._local = threading.local()
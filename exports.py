@@ -0,0 +1,190 @@
+"""
+File exports.
+
+CSV exports are written row by row from a live cursor into a small buffer
+that is flushed to the client every ``CHUNK_SIZE`` bytes, so memory use stays
+flat however many rows an export has. PDFs and the DOCX register are drawn by
+the renderers below, which the routes run as background jobs (see ``jobs``).
+"""
+
+import csv
+import unicodedata
+from copy import deepcopy
+from io import StringIO
+from urllib.parse import quote
+
+from docx import Document
+from docx.enum.section import WD_ORIENT
+from docx.oxml.ns import qn
+from docx.shared import Inches, Pt
+from flask import Response, stream_with_context
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+CHUNK_SIZE = 64 * 1024
+# lecture dates per table of the DOCX register, as on the paper sheet
+REGISTER_DATES = 15
+
+
+def iter_csv(header, rows):
+	"""UTF-8 encoded CSV chunks of roughly ``CHUNK_SIZE`` bytes."""
+	buf = StringIO(newline='')
+	writer = csv.writer(buf)
+	writer.writerow(header)
+	for row in rows:
+		writer.writerow(row)
+		if buf.tell() >= CHUNK_SIZE:
+			yield buf.getvalue().encode('utf-8')
+			buf.seek(0)
+			buf.truncate()
+	if buf.tell():
+		yield buf.getvalue().encode('utf-8')
+
+
+def attachment(response, download_name):
+	"""Set Content-Disposition the same way ``send_file(as_attachment=True)`` does."""
+	try:
+		download_name.encode('ascii')
+	except UnicodeEncodeError:
+		simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+		names = {'filename': simple, 'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~")}
+	else:
+		names = {'filename': download_name}
+	response.headers.set('Content-Disposition', 'attachment', **names)
+	return response
+
+
+def csv_response(header, rows, download_name, mimetype='text/csv; charset=utf-8'):
+	"""Stream ``rows`` as a CSV attachment.
+
+	``rows`` is consumed lazily while the response is sent; the request context
+	(and the request's DB connection) stays open until the last chunk.
+	"""
+	response = Response(stream_with_context(iter_csv(header, rows)), mimetype=mimetype)
+	return attachment(response, download_name)
+
+
+# PDF renderers. Each writes to a binary file object and reports progress as
+# the fraction of report rows drawn.
+
+def class_report_pdf(out, report, class_name, subject, start, end, progress=None):
+	"""Per-student table for one class and subject; rows under 40% in red."""
+	width, height = letter
+	p = canvas.Canvas(out, pagesize=letter)
+	p.setFont('Helvetica-Bold', 12)
+	p.drawString(72, height - 72, f'Attendance Report: {class_name} - {subject}')
+	p.setFont('Helvetica', 10)
+	p.drawString(72, height - 88, f'From {start} to {end}')
+	# table headers
+	y = height - 110
+	headers = ['Roll No','Name','Total','Attended','%']
+	col_x = [72, 150, 400, 450, 500]
+	p.setFont('Helvetica-Bold', 10)
+	for i, htxt in enumerate(headers):
+		p.drawString(col_x[i], y, htxt)
+	p.line(72, y-2, 540, y-2)
+	p.setFont('Helvetica', 10)
+	y -= 14
+	for n, r in enumerate(report, start=1):
+		if r['percent'] < 40:
+			p.setFillColorRGB(0.5, 0.0, 0.0)
+		else:
+			p.setFillColorRGB(0, 0, 0)
+		p.drawString(col_x[0], y, str(r['roll_no']))
+		p.drawString(col_x[1], y, str(r['name'])[:36])
+		p.drawRightString(col_x[2]+20, y, str(r['total']))
+		p.drawRightString(col_x[3]+20, y, str(r['attended']))
+		p.drawRightString(col_x[4]+20, y, str(r['percent']))
+		y -= 14
+		if y < 72:
+			p.showPage()
+			p.setFont('Helvetica', 10)
+			y = height - 72
+			if progress:
+				progress(n / len(report))
+	p.showPage()
+	p.save()
+
+
+def defaulters_pdf(out, report, title, threshold=75, progress=None):
+	"""One line per student under ``threshold`` percent."""
+	p = canvas.Canvas(out, pagesize=letter)
+	width, height = letter
+	p.setFont('Helvetica-Bold', 14)
+	p.drawString(72, height - 72, title)
+	p.setFont('Helvetica', 10)
+	y = height - 100
+	for n, r in enumerate(report, start=1):
+		if r['percent'] < threshold:
+			line = f"{r['roll_no']}  {r['name']}  {r['class']}  {r['attended']}/{r['total']}  {r['percent']}%"
+			p.drawString(72, y, line)
+			y -= 16
+			if y < 72:
+				p.showPage()
+				p.setFont('Helvetica', 10)
+				y = height - 72
+				if progress:
+					progress(n / len(report))
+	p.showPage()
+	p.save()
+
+
+# The attendance register: roster x lecture dates, as the paper sheet.
+
+def register_csv(dates, rows):
+	"""(header, rows) for ``csv_response`` from ``reports.register``."""
+	header = ['Roll No', 'PRN', 'Name', *dates, 'Attended', 'Total', '% Attendance']
+	return header, ([r['roll_no'], r['prn'] or '', r['name'], *r['marks'], r['attended'], r['total'], f"{r['percent']}%"]
+					for r in rows)
+
+
+def _fill(table, values):
+	"""Write ``values`` (one list of texts per row) into a one-row ``table``.
+
+	python-docx builds every run element by element; only the first row is
+	built that way, the others are copies of its XML with the texts replaced.
+	"""
+	first = table.rows[0]._tr
+	for cell in table.rows[0].cells:
+		cell.paragraphs[0].add_run(' ')
+	prototype = deepcopy(first)
+	for n, texts in enumerate(values):
+		tr = first if n == 0 else deepcopy(prototype)
+		for t, text in zip(tr.iter(qn('w:t')), texts):
+			t.text = str(text)
+		if n:
+			table._tbl.append(tr)
+
+
+def register_docx(out, dates, rows, class_name, subject, start, end, progress=None):
+	"""Landscape register: ``REGISTER_DATES`` dates per table, totals after the last one."""
+	rows = list(rows)
+	doc = Document()
+	section = doc.sections[0]
+	section.orientation = WD_ORIENT.LANDSCAPE
+	section.page_width, section.page_height = section.page_height, section.page_width
+	section.left_margin = section.right_margin = Inches(0.5)
+	section.top_margin = section.bottom_margin = Inches(0.6)
+	doc.styles['Normal'].font.size = Pt(8)
+	doc.styles['Normal'].paragraph_format.space_after = Pt(0)
+	chunks = [dates[i:i + REGISTER_DATES] for i in range(0, len(dates), REGISTER_DATES)] or [[]]
+	for n, chunk in enumerate(chunks):
+		if n:
+			doc.add_page_break()
+		doc.add_heading(f'{class_name} - {subject}: Attendance Register', level=2)
+		doc.add_paragraph(f'From {start} to {end}' + (f' (page {n + 1} of {len(chunks)})' if len(chunks) > 1 else ''))
+		last = n == len(chunks) - 1
+		offset = n * REGISTER_DATES
+		header = ['Roll No', 'PRN NO.', 'Student Name'] + [d[8:10] + '/' + d[5:7] for d in chunk]
+		if last:
+			header += ['Attended', 'Total', '%']
+		table = doc.add_table(rows=1, cols=len(header))
+		table.style = 'Table Grid'
+		body = [[r['roll_no'], r['prn'] or '', r['name'], *r['marks'][offset:offset + len(chunk)],
+				 *((r['attended'], r['total'], r['percent']) if last else ())] for r in rows]
+		_fill(table, [header] + body)
+		for cell in table.rows[0].cells:
+			cell.paragraphs[0].runs[0].bold = True
+		if progress:
+			progress((n + 1) / len(chunks))
+	doc.save(out)
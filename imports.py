@@ -0,0 +1,209 @@
+"""
+Bulk roster imports (students and teachers).
+
+The whole paste/CSV is parsed first, existing rows are resolved with a few
+batched ``IN`` lookups and writes go out as ``executemany`` upserts. Teacher
+passwords are hashed through the process pool in ``passwords``; new students
+in one import share a single hash of the (public) default password. If a
+batch write fails it is retried row by row so errors are still reported per
+line.
+"""
+
+import sqlite3
+
+import passwords
+
+DEFAULT_STUDENT_PASSWORD = 'Test@123'
+BATCH = 500
+
+STUDENT_INSERT = 'INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,?,?)'
+# existing students keep their password; an upsert would also burn AUTOINCREMENT ids
+STUDENT_UPDATE = 'UPDATE students SET prn = ?, name = ?, class = ?, semester = ? WHERE roll_no = ?'
+
+
+def chunks(items, size=BATCH):
+	for i in range(0, len(items), size):
+		yield items[i:i + size]
+
+
+def parse_student_line(line):
+	roll = prn = name = None
+	if ',' in line:
+		parts = [p.strip() for p in line.split(',') if p.strip()]
+		if len(parts) >= 3:
+			roll, prn = parts[0], parts[1]
+			name = ','.join(parts[2:]).strip()
+	else:
+		parts = line.split()
+		if len(parts) >= 3:
+			roll, prn = parts[0], parts[1]
+			name = ' '.join(parts[2:])
+	return roll, prn, name
+
+
+def parse_students(lines, errors=None):
+	"""[(line_no, roll, prn, name)] for the valid lines; blank lines are skipped."""
+	rows = []
+	for line_no, raw in enumerate(lines, start=1):
+		line = (raw or '').strip()
+		if not line:
+			continue
+		roll, prn, name = parse_student_line(line)
+		if not roll or not prn or not name:
+			if errors is not None:
+				errors.append(f'Line {line_no}: invalid format. Expect roll, prn, name.')
+			continue
+		rows.append((line_no, roll, prn, name))
+	return rows
+
+
+def existing_keys(db, table, column, values):
+	found = set()
+	values = list(dict.fromkeys(values))
+	for batch in chunks(values):
+		marks = ','.join('?' * len(batch))
+		found.update(r[0] for r in db.execute(f'SELECT {column} FROM {table} WHERE {column} IN ({marks})', batch))
+	return found
+
+
+def import_students(db, rows, class_name, semester, errors=None, default_hash=None):
+	"""Insert or update parsed student rows in ``class_name``; returns (added, updated).
+
+	New students get the default password. Existing ones (matched by roll
+	number) keep theirs. Runs inside the caller's transaction. Pass
+	``default_hash`` (of ``DEFAULT_STUDENT_PASSWORD``) to keep the hashing
+	out of the write transaction.
+	"""
+	existing = existing_keys(db, 'students', 'roll_no', [r[1] for r in rows])
+	if default_hash is None and len(existing) < len(rows):
+		default_hash = passwords.hash_password(DEFAULT_STUDENT_PASSWORD)
+	added = updated = 0
+	for batch in chunks(rows):
+		# later lines for the same roll number update what earlier lines inserted
+		ops = []
+		seen = set(existing)
+		for line_no, roll, prn, name in batch:
+			if roll in seen:
+				ops.append((line_no, roll, STUDENT_UPDATE, (prn, name, class_name, semester, roll)))
+			else:
+				ops.append((line_no, roll, STUDENT_INSERT, (roll, prn, name, class_name, semester, default_hash)))
+				seen.add(roll)
+		db.execute('SAVEPOINT import_batch')
+		try:
+			db.executemany(STUDENT_INSERT, [op[3] for op in ops if op[2] is STUDENT_INSERT])
+			db.executemany(STUDENT_UPDATE, [op[3] for op in ops if op[2] is STUDENT_UPDATE])
+			done = ops
+		except sqlite3.Error:
+			# find the offending lines one by one
+			db.execute('ROLLBACK TO import_batch')
+			done = []
+			for op in ops:
+				try:
+					db.execute(op[2], op[3])
+					done.append(op)
+				except sqlite3.Error as exc:
+					if errors is not None:
+						errors.append(f'Line {op[0]}: DB error for roll {op[1]}: {exc}')
+		db.execute('RELEASE import_batch')
+		for _, roll, sql, _ in done:
+			if sql is STUDENT_UPDATE:
+				updated += 1
+			else:
+				added += 1
+				existing.add(roll)
+	return added, updated
+
+
+def parse_teachers(lines):
+	"""[(line_no, name, phone, password, subject, class)] for lines with five fields."""
+	rows = []
+	for line_no, raw in enumerate(lines, start=1):
+		line = raw.strip()
+		if not line:
+			continue
+		# CSV: name,phone,password,subject,class  (subject,class can repeat multiple lines per teacher)
+		parts = [p.strip() for p in line.split(',')]
+		if len(parts) < 5:
+			continue
+		cls = ','.join(parts[4:]) if len(parts) > 5 else parts[4]
+		rows.append((line_no, parts[0], parts[1], parts[2], parts[3], cls))
+	return rows
+
+
+def hash_teacher_passwords(rows):
+	"""{line_no: hash} for parsed teacher rows, so the hashing can happen before the write.
+
+	Lines repeating a teacher's name, phone and password share one hash.
+	"""
+	lines = {}
+	for line_no, name, phone, password, _, _ in rows:
+		lines.setdefault((name, phone, password), []).append(line_no)
+	hashes = passwords.hash_many(password for _, _, password in lines)
+	return {line_no: h for line_nos, h in zip(lines.values(), hashes) for line_no in line_nos}
+
+
+def import_teachers(db, rows, line_hashes=None):
+	"""Upsert teachers and their assignments; returns (added, updated).
+
+	Lines are resolved in order exactly as if each were applied one after the
+	other (match by phone or name, later lines win), but the database sees one
+	lookup, one hashing fan-out and a few executemany calls. Pass
+	``line_hashes`` from ``hash_teacher_passwords`` to keep the hashing out of
+	the write transaction.
+	"""
+	names = [r[1] for r in rows]
+	phones = [r[2] for r in rows]
+	teachers = {}
+	for key_col, values in (('phone', phones), ('name', names)):
+		for batch in chunks(list(dict.fromkeys(values))):
+			marks = ','.join('?' * len(batch))
+			for r in db.execute(f'SELECT teacher_id, name, phone FROM teachers WHERE {key_col} IN ({marks})', batch):
+				teachers[r['teacher_id']] = {'name': r['name'], 'phone': r['phone'], 'password': None}
+	by_phone = {}
+	by_name = {}
+	for tid in sorted(teachers):
+		by_phone.setdefault(teachers[tid]['phone'], tid)
+		by_name.setdefault(teachers[tid]['name'], tid)
+	added = updated = 0
+	new_ids = 0
+	line_teacher = []
+	for line_no, name, phone, password, subject, cls in rows:
+		candidates = [t for t in (by_phone.get(phone), by_name.get(name)) if t is not None]
+		if candidates:
+			# the original per-line query returned the lowest rowid; new rows sort last
+			tid = min(candidates, key=lambda t: (t < 0, abs(t)))
+			old = teachers[tid]
+			if by_phone.get(old['phone']) == tid:
+				del by_phone[old['phone']]
+			if by_name.get(old['name']) == tid:
+				del by_name[old['name']]
+			updated += 1
+		else:
+			new_ids -= 1
+			tid = new_ids
+			added += 1
+		teachers[tid] = {'name': name, 'phone': phone, 'password': password, 'line': line_no}
+		by_phone.setdefault(phone, tid)
+		by_name.setdefault(name, tid)
+		line_teacher.append((tid, subject, cls))
+	touched = {tid: t for tid, t in teachers.items() if t['password'] is not None}
+	if line_hashes is None:
+		hashes = dict(zip(touched, passwords.hash_many(t['password'] for t in touched.values())))
+	else:
+		hashes = {tid: line_hashes[t['line']] for tid, t in touched.items()}
+	updates = [(t['name'], t['phone'], hashes[tid], tid) for tid, t in touched.items() if tid > 0]
+	inserts = [(t['name'], t['phone'], hashes[tid]) for tid, t in touched.items() if tid < 0]
+	if updates:
+		db.executemany('UPDATE teachers SET name = ?, phone = ?, password_hash = ? WHERE teacher_id = ?', updates)
+	if inserts:
+		db.executemany('INSERT INTO teachers (name, phone, password_hash) VALUES (?,?,?)', inserts)
+		ids = {}
+		for batch in chunks([i[0] for i in inserts]):
+			marks = ','.join('?' * len(batch))
+			ids.update((r['name'], r['teacher_id']) for r in db.execute(f'SELECT teacher_id, name FROM teachers WHERE name IN ({marks})', batch))
+		resolved = {tid: ids[t['name']] for tid, t in touched.items() if tid < 0}
+	else:
+		resolved = {}
+	db.executemany('INSERT OR IGNORE INTO teacher_assignments (teacher_id, subject, class) VALUES (?,?,?)',
+				   [(resolved.get(tid, tid), subject, cls) for tid, subject, cls in line_teacher])
+	return added, updated
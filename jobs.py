@@ -0,0 +1,204 @@
+"""
+Background export jobs with an on-disk result cache.
+
+Slow exports (the reportlab PDFs) are rendered on a small thread pool instead
+of inside the request. A job's id is the hash of (export type, filters, data
+version), which is also the name of its cached file, so:
+
+- asking again for an export whose data has not changed is served straight
+  from disk, from any worker process;
+- identical requests that arrive while a job is still running share it;
+- once the data changes the key changes, and the stale file ages out.
+
+Cache files are removed oldest first once the directory is over
+``EXPORT_CACHE_MAX_MB`` or older than ``EXPORT_CACHE_MAX_AGE`` seconds.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import timing
+
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '2'))
+CACHE_MAX_BYTES = int(float(os.environ.get('EXPORT_CACHE_MAX_MB', '200')) * 1024 * 1024)
+CACHE_MAX_AGE = int(os.environ.get('EXPORT_CACHE_MAX_AGE', str(24 * 3600)))
+
+log = logging.getLogger(__name__)
+
+
+def job_key(kind, params, version):
+	raw = json.dumps([kind, params, version], sort_keys=True, separators=(',', ':'))
+	return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+class Job:
+	def __init__(self, key, kind, download_name, path):
+		self.id = key
+		self.kind = kind
+		self.download_name = download_name
+		self.path = path
+		self.state = 'queued'
+		self.progress = 0.0
+		self.error = None
+		self.finished = None
+		# {'db': seconds, 'render': seconds} spent rendering, once done
+		self.timings = {}
+
+	@property
+	def done(self):
+		return self.state == 'done'
+
+	def as_dict(self):
+		return {'id': self.id, 'kind': self.kind, 'state': self.state,
+				'progress': round(self.progress, 3), 'error': self.error}
+
+
+class ExportJobs:
+	"""Thread-pool export runner backed by a directory of finished files.
+
+	``render(db, params, out, progress)`` writes the export to the binary file
+	``out`` and may call ``progress(fraction)``. ``connect``/``release``
+	hand each job a read-only database connection.
+	"""
+
+	def __init__(self, cache_dir, connect, release, workers=EXPORT_WORKERS,
+				 max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+		self.cache_dir = cache_dir
+		self.connect = connect
+		self.release = release
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		self._workers = workers
+		self._executor = None
+		self._jobs = {}
+		self._lock = threading.Lock()
+
+	def _paths(self, key):
+		base = os.path.join(self.cache_dir, key)
+		return base + '.out', base + '.json'
+
+	def _pool(self):
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='export')
+		return self._executor
+
+	def submit(self, kind, params, version, download_name, render):
+		"""The job for this export: finished if cached, otherwise queued or running."""
+		key = job_key(kind, params, version)
+		with self._lock:
+			job = self.get(key)
+			if job and job.state != 'failed':
+				return job
+			path, _ = self._paths(key)
+			job = Job(key, kind, download_name, path)
+			self._jobs[key] = job
+			self._pool().submit(self._run, job, params, render)
+		return job
+
+	def get(self, key):
+		"""A running or finished job, including one finished on disk by another worker."""
+		job = self._jobs.get(key)
+		if job and not job.done:
+			return job
+		# finished: only as good as its file, which prune() may have removed
+		path, meta_path = self._paths(key)
+		try:
+			with open(meta_path, encoding='utf-8') as f:
+				meta = json.load(f)
+			os.utime(path)
+		except (OSError, ValueError):
+			self._jobs.pop(key, None)
+			return None
+		if job is None:
+			job = Job(key, meta['kind'], meta['download_name'], path)
+			job.state, job.progress, job.finished = 'done', 1.0, time.time()
+			job.timings = meta.get('timings', {})
+		return job
+
+	def _run(self, job, params, render):
+		job.state = 'running'
+
+		def progress(fraction):
+			job.progress = min(max(fraction, 0.0), 1.0)
+
+		db = None
+		try:
+			timings = timing.start(f'export {job.kind}')
+			db = self.connect()
+			os.makedirs(self.cache_dir, exist_ok=True)
+			fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+			try:
+				with os.fdopen(fd, 'wb') as out:
+					render(db, params, out, progress)
+				os.replace(tmp, job.path)
+			except BaseException:
+				os.unlink(tmp)
+				raise
+			elapsed = time.perf_counter() - timings.started
+			job.timings = {'db': timings.db, 'render': max(elapsed - timings.db, 0.0)}
+			metrics.EXPORT_SECONDS.observe(elapsed, job.kind)
+			metrics.EXPORT_BYTES.observe(os.path.getsize(job.path), job.kind)
+			_, meta_path = self._paths(job.id)
+			with open(meta_path, 'w', encoding='utf-8') as f:
+				json.dump({'kind': job.kind, 'download_name': job.download_name, 'timings': job.timings}, f)
+			job.progress, job.state = 1.0, 'done'
+		except Exception as exc:
+			log.exception('export %s (%s) failed', job.id, job.kind)
+			job.state, job.error = 'failed', str(exc)
+			if metrics.is_locked(exc):
+				metrics.DB_LOCKED.inc('export')
+		finally:
+			job.finished = time.time()
+			if db is not None:
+				self.release(db)
+			timing.stop()
+			metrics.EXPORT_JOBS.inc(job.kind, job.state)
+			metrics.flush()
+		self.prune()
+
+	def prune(self):
+		"""Drop expired cache files, then the oldest until under the size budget."""
+		now = time.time()
+		with self._lock:
+			for key, job in list(self._jobs.items()):
+				if job.finished and now - job.finished > self.max_age:
+					del self._jobs[key]
+		try:
+			names = os.listdir(self.cache_dir)
+		except FileNotFoundError:
+			return 0
+		entries = []
+		for name in names:
+			if not name.endswith('.out'):
+				continue
+			try:
+				st = os.stat(os.path.join(self.cache_dir, name))
+			except FileNotFoundError:
+				continue
+			entries.append((st.st_mtime, st.st_size, name[:-4]))
+		entries.sort()
+		total = sum(size for _, size, _ in entries)
+		removed = 0
+		for mtime, size, key in entries:
+			if now - mtime <= self.max_age and total <= self.max_bytes:
+				break
+			with self._lock:
+				job = self._jobs.get(key)
+				if job and not job.finished:
+					continue
+				self._jobs.pop(key, None)
+			for path in self._paths(key):
+				try:
+					os.unlink(path)
+				except FileNotFoundError:
+					pass
+			total -= size
+			removed += 1
+		return removed
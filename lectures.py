@@ -0,0 +1,347 @@
+"""
+Per-lecture presence bitmaps.
+
+``lecture_bitmaps`` keeps one row per lecture (class, subject, day). The row
+holds two packed bitsets over the class roster: ``marked`` (the students
+with a mark for that lecture) and ``present`` (the students marked Present).
+Bit ``n`` belongs to the student in slot ``n`` of ``roster_slots`` for that
+class. A student gets a slot the first time they are marked in the class.
+Slots are never reused or renumbered, so students who join mid-term only
+lengthen the bitmaps, and old bitmaps stay valid after students leave.
+
+Triggers on ``attendance_marks`` queue every lecture they touch in
+``lecture_bitmaps_dirty``. ``flush`` rebuilds the queued bitmaps and is
+called by the marking functions in the same transaction. Readers never
+trust a queued lecture's bitmap; they rebuild it from its rows on the fly.
+So a write that bypasses ``marking`` (imports, removals, the ``attendance``
+view) is still counted correctly, even on a read-only connection.
+
+``student_totals`` counts attended and total lectures per student by adding
+whole bitmaps at once. Each bitmap is widened to one 32-bit lane per
+student and the lanes of every lecture are summed with big-integer
+arithmetic. The cost is one addition per lecture, not one per (lecture,
+student) row. Per-lecture headcounts are a ``bit_count()``. ``matrix``
+spreads a class's bitmaps into a byte grid for per-student sequences.
+"""
+
+import struct
+import sys
+from contextlib import contextmanager
+
+import compact
+
+FLUSH_LIMIT = 64
+# 32-bit counters: good for 4 billion lectures per student
+LANE_BYTES = 4
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS roster_slots (
+	class_id INTEGER NOT NULL,
+	slot INTEGER NOT NULL,
+	student_id INTEGER NOT NULL,
+	PRIMARY KEY (class_id, slot),
+	UNIQUE (class_id, student_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS lecture_bitmaps (
+	class_id INTEGER NOT NULL,
+	subject_id INTEGER NOT NULL,
+	day INTEGER NOT NULL,
+	marked BLOB NOT NULL,
+	present BLOB NOT NULL,
+	PRIMARY KEY (class_id, subject_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS lecture_bitmaps_dirty (
+	class_id INTEGER NOT NULL,
+	subject_id INTEGER NOT NULL,
+	day INTEGER NOT NULL,
+	PRIMARY KEY (class_id, subject_id, day)
+) WITHOUT ROWID;
+'''
+
+
+def _queue(ref):
+	# NOT EXISTS rather than OR IGNORE: an outer upsert's conflict clause wins inside triggers
+	return f'''
+	INSERT INTO lecture_bitmaps_dirty (class_id, subject_id, day) SELECT {ref}.class_id, {ref}.subject_id, {ref}.day
+		WHERE NOT EXISTS (SELECT 1 FROM lecture_bitmaps_dirty
+			WHERE class_id = {ref}.class_id AND subject_id = {ref}.subject_id AND day = {ref}.day);'''
+
+
+TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS attendance_marks_bitmap_ai AFTER INSERT ON attendance_marks BEGIN{_queue('NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_marks_bitmap_ad AFTER DELETE ON attendance_marks BEGIN{_queue('OLD')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS attendance_marks_bitmap_au AFTER UPDATE ON attendance_marks BEGIN{_queue('OLD')}{_queue('NEW')}
+END;
+'''
+
+
+def _pack(bits):
+	return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def _unpack(blob):
+	return int.from_bytes(blob, 'little')
+
+
+def _class_slots(db, class_id):
+	return {r[1]: r[0] for r in db.execute('SELECT slot, student_id FROM roster_slots WHERE class_id = ?', (class_id,))}
+
+
+def _slots(db, class_id, student_ids=()):
+	"""{student_id: slot} for a class, giving new students the next free slots."""
+	slots = _class_slots(db, class_id)
+	new = sorted(set(student_ids) - set(slots))
+	if new:
+		start = max(slots.values(), default=-1) + 1
+		db.executemany('INSERT INTO roster_slots (class_id, slot, student_id) VALUES (?,?,?)',
+					   [(class_id, start + n, sid) for n, sid in enumerate(new)])
+		slots.update({sid: start + n for n, sid in enumerate(new)})
+	return slots
+
+
+def _bits(rows, slots):
+	marked = present = 0
+	for sid, is_present in rows:
+		bit = 1 << slots[sid]
+		marked |= bit
+		if is_present:
+			present |= bit
+	return marked, present
+
+
+def _lecture_rows(db, class_id, subject_id, day):
+	return db.execute('SELECT student_id, present FROM attendance_marks WHERE class_id = ? AND subject_id = ? AND day = ?',
+					  (class_id, subject_id, day)).fetchall()
+
+
+def flush(db, limit=FLUSH_LIMIT):
+	"""Rebuild up to ``limit`` queued lecture bitmaps (None: all); returns how many.
+
+	Runs inside the caller's transaction.
+	"""
+	sql = 'SELECT class_id, subject_id, day FROM lecture_bitmaps_dirty'
+	queued = db.execute(sql + (' LIMIT ?' if limit is not None else ''), (limit,) if limit is not None else ()).fetchall()
+	slots = {}
+	for class_id, subject_id, day in queued:
+		rows = _lecture_rows(db, class_id, subject_id, day)
+		key = (class_id, subject_id, day)
+		if rows:
+			if class_id not in slots or any(r[0] not in slots[class_id] for r in rows):
+				slots[class_id] = _slots(db, class_id, [r[0] for r in rows])
+			marked, present = _bits(rows, slots[class_id])
+			db.execute('INSERT INTO lecture_bitmaps (class_id, subject_id, day, marked, present) VALUES (?,?,?,?,?)'
+					   ' ON CONFLICT(class_id, subject_id, day) DO UPDATE SET marked = excluded.marked, present = excluded.present',
+					   key + (_pack(marked), _pack(present)))
+		else:
+			db.execute('DELETE FROM lecture_bitmaps WHERE class_id = ? AND subject_id = ? AND day = ?', key)
+		db.execute('DELETE FROM lecture_bitmaps_dirty WHERE class_id = ? AND subject_id = ? AND day = ?', key)
+	return len(queued)
+
+
+def rebuild(db):
+	"""Regenerate every bitmap (and the slots) from attendance_marks. Caller commits."""
+	db.execute('DELETE FROM lecture_bitmaps')
+	db.execute('DELETE FROM roster_slots')
+	db.execute('DELETE FROM lecture_bitmaps_dirty')
+	# slots in roll order, so a class's bitmaps start out dense and sorted
+	db.execute(
+		'INSERT INTO roster_slots (class_id, slot, student_id)'
+		' SELECT k.class_id, ROW_NUMBER() OVER (PARTITION BY k.class_id ORDER BY s.roll_no, k.student_id) - 1, k.student_id'
+		' FROM (SELECT DISTINCT class_id, student_id FROM attendance_marks) k LEFT JOIN students s ON s.student_id = k.student_id')
+	slots = {}
+	lecture = None
+	rows = []
+
+	def store():
+		marked, present = _bits(rows, slots[lecture[0]])
+		db.execute('INSERT INTO lecture_bitmaps (class_id, subject_id, day, marked, present) VALUES (?,?,?,?,?)',
+				   lecture + (_pack(marked), _pack(present)))
+
+	for class_id, subject_id, day, sid, present in db.execute(
+			'SELECT class_id, subject_id, day, student_id, present FROM attendance_marks ORDER BY class_id, subject_id, day'):
+		if (class_id, subject_id, day) != lecture:
+			if rows:
+				store()
+			lecture, rows = (class_id, subject_id, day), []
+			if class_id not in slots:
+				slots[class_id] = _class_slots(db, class_id)
+		rows.append((sid, present))
+	if rows:
+		store()
+
+
+def verify(db):
+	"""Number of lectures whose stored bitmap disagrees with attendance_marks (queued ones excluded)."""
+	bad = 0
+	slots = {}
+	stored = db.execute(
+		'SELECT b.class_id, b.subject_id, b.day, b.marked, b.present FROM lecture_bitmaps b'
+		' WHERE NOT EXISTS (SELECT 1 FROM lecture_bitmaps_dirty d'
+		'  WHERE d.class_id = b.class_id AND d.subject_id = b.subject_id AND d.day = b.day)').fetchall()
+	for class_id, subject_id, day, marked, present in stored:
+		if class_id not in slots:
+			slots[class_id] = _class_slots(db, class_id)
+		rows = _lecture_rows(db, class_id, subject_id, day)
+		if any(r[0] not in slots[class_id] for r in rows) or _bits(rows, slots[class_id]) != (_unpack(marked), _unpack(present)):
+			bad += 1
+	missing = db.execute(
+		'SELECT COUNT(*) FROM (SELECT DISTINCT class_id, subject_id, day FROM attendance_marks) m'
+		' WHERE NOT EXISTS (SELECT 1 FROM lecture_bitmaps b WHERE b.class_id = m.class_id AND b.subject_id = m.subject_id AND b.day = m.day)'
+		' AND NOT EXISTS (SELECT 1 FROM lecture_bitmaps_dirty d WHERE d.class_id = m.class_id AND d.subject_id = m.subject_id AND d.day = m.day)'
+	).fetchone()[0]
+	return bad + missing
+
+
+# Analytics
+
+# byte -> its 8 bits, each widened to a little-endian LANE_BYTES counter
+_WIDEN = [b''.join(((byte >> bit) & 1).to_bytes(LANE_BYTES, 'little') for bit in range(8)) for byte in range(256)]
+
+
+def _widen(blob):
+	return int.from_bytes(b''.join([_WIDEN[byte] for byte in blob]), 'little')
+
+
+_NATIVE_LANES = sys.byteorder == 'little' and struct.calcsize('I') == LANE_BYTES
+
+
+def _lanes(total, slots):
+	"""Per-slot counters of an accumulated lane integer, as a list."""
+	raw = total.to_bytes(slots * LANE_BYTES, 'little')
+	if _NATIVE_LANES:
+		return memoryview(raw).cast('I').tolist()
+	return [int.from_bytes(raw[i:i + LANE_BYTES], 'little') for i in range(0, len(raw), LANE_BYTES)]
+
+
+@contextmanager
+def _snapshot(db):
+	# bitmaps, the queue and the slots must be read as of one moment
+	if db.in_transaction:
+		yield
+		return
+	db.execute('BEGIN')
+	try:
+		yield
+	finally:
+		db.rollback()
+
+
+def lecture_bitmaps(db, class_name=None, subject=None, start=None, end=None, slots=None):
+	"""(class_id, subject_id, day, marked, present) of every lecture in range.
+
+	Queued lectures are rebuilt from their rows. A student of theirs with no
+	slot yet gets a temporary one past the stored ones, recorded in
+	``slots`` ({class_id: {student_id: slot}}) so callers can map it back.
+	"""
+	slots = {} if slots is None else slots
+	where = ['b.day BETWEEN :start AND :end']
+	params = {'start': compact.day_or(start, compact.FIRST_DAY), 'end': compact.day_or(end, compact.LAST_DAY),
+			  'class_name': class_name, 'subject': subject}
+	if class_name:
+		where.append(f"b.class_id = {compact.class_id_sql(':class_name')}")
+	if subject:
+		where.append(f"b.subject_id = {compact.subject_id_sql(':subject')}")
+	where = ' AND '.join(where)
+	dirty = ('EXISTS (SELECT 1 FROM lecture_bitmaps_dirty d'
+			 ' WHERE d.class_id = b.class_id AND d.subject_id = b.subject_id AND d.day = b.day)')
+	yield from db.execute(
+		f'SELECT b.class_id, b.subject_id, b.day, b.marked, b.present FROM lecture_bitmaps b WHERE {where} AND NOT {dirty}', params)
+	queued = db.execute(f'SELECT b.class_id, b.subject_id, b.day FROM lecture_bitmaps_dirty b WHERE {where}', params).fetchall()
+	for class_id, subject_id, day in queued:
+		rows = _lecture_rows(db, class_id, subject_id, day)
+		if not rows:
+			continue
+		if class_id not in slots:
+			slots[class_id] = _class_slots(db, class_id)
+		known = slots[class_id]
+		for sid, _ in rows:
+			if sid not in known:
+				known[sid] = max(known.values(), default=-1) + 1
+		marked, present = _bits(rows, known)
+		yield class_id, subject_id, day, _pack(marked), _pack(present)
+
+
+def student_totals(db, class_name=None, subject=None, start=None, end=None, by_subject=False):
+	"""{student_id: (attended, total)}, or {(student_id, subject): ...} with ``by_subject``.
+
+	Counts every lecture of ``class_name`` (all classes if None) and
+	``subject`` between ``start`` and ``end``; a student's lectures in
+	several classes are summed. Students never marked are left out.
+	"""
+	sums = {}
+	width = {}
+	slots = {}
+	with _snapshot(db):
+		for class_id, subject_id, day, marked, present in lecture_bitmaps(db, class_name, subject, start, end, slots):
+			key = (class_id, subject_id if by_subject else None)
+			acc = sums.get(key)
+			if acc is None:
+				acc = sums[key] = [0, 0]
+			acc[0] += _widen(present)
+			acc[1] += _widen(marked)
+			width[class_id] = max(width.get(class_id, 0), len(marked) * 8)
+		for class_id, _ in sums:
+			if class_id not in slots:
+				slots[class_id] = _class_slots(db, class_id)
+		names = {}
+		if by_subject and sums:
+			names = {r[0]: r[1] for r in db.execute('SELECT subject_id, name FROM subjects')}
+	totals = {}
+	for (class_id, subject_id), (attended, total) in sums.items():
+		students = {slot: sid for sid, slot in slots[class_id].items()}
+		count = width[class_id]
+		attended, total = _lanes(attended, count), _lanes(total, count)
+		for slot in range(count):
+			if total[slot]:
+				key = (students[slot], names[subject_id]) if by_subject else students[slot]
+				a, t = totals.get(key, (0, 0))
+				totals[key] = (a + attended[slot], t + total[slot])
+	return totals
+
+
+# byte -> its 8 bits as 8 bytes of 0/1
+_CELLS = [bytes((byte >> bit) & 1 for bit in range(8)) for byte in range(256)]
+
+
+def _cells(blob):
+	return int.from_bytes(b''.join(map(_CELLS.__getitem__, blob)), 'little')
+
+
+def matrix(db, class_name, subject=None, start=None, end=None):
+	"""(students, lectures, cells): one class's attendance as a dense lecture x student grid.
+
+	``lectures`` is [(subject_id, day)] in date order (subject id within a
+	day) and ``students`` the student_id of each column, None for an unused
+	slot. ``cells`` holds one byte per (lecture, student), lecture by lecture:
+	0 not marked, 1 Absent, 2 Present. A student's lectures are then the
+	slice ``cells[column::len(students)]``.
+	"""
+	slots = {}
+	with _snapshot(db):
+		found = sorted(lecture_bitmaps(db, class_name, subject, start, end, slots), key=lambda b: (b[2], b[1]))
+		if not found:
+			return [], [], b''
+		class_id = found[0][0]
+		if class_id not in slots:
+			slots[class_id] = _class_slots(db, class_id)
+	width = max(len(b[3]) for b in found) * 8
+	students = [None] * width
+	for sid, slot in slots[class_id].items():
+		if slot < width:
+			students[slot] = sid
+	# present is a subset of marked, so the lane sums are 0, 1 or 2
+	cells = b''.join((_cells(marked) + _cells(present)).to_bytes(width, 'little') for _, _, _, marked, present in found)
+	return students, [(subject_id, day) for _, subject_id, day, _, _ in found], cells
+
+
+def headcounts(db, class_name=None, subject=None, start=None, end=None):
+	"""[(class_id, subject_id, day, present, marked)] per lecture, by popcount."""
+	with _snapshot(db):
+		return [(class_id, subject_id, day, _unpack(present).bit_count(), _unpack(marked).bit_count())
+				for class_id, subject_id, day, marked, present in lecture_bitmaps(db, class_name, subject, start, end)]
@@ -0,0 +1,188 @@
+"""
+Attendance writes for one lecture (class, subject, date).
+
+Only rows whose status actually changes are written, with a single
+``executemany`` upsert; REPLACE would delete and re-insert every row of the
+class on each save. Rows go straight to ``attendance_marks`` (see ``compact``)
+and the lecture's bitmap is refreshed in the same transaction (see ``lectures``).
+Callers own the transaction (see ``database.transaction``).
+
+``apply_batch`` applies several lectures sent at once by the offline marking
+queue. Each batch carries a client-chosen id and its result is stored, so a
+batch re-sent after a lost response is answered without writing twice.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import archive
+import compact
+import lectures
+
+STATUSES = ('Present', 'Absent')
+MAX_BATCH_LECTURES = int(os.environ.get('MAX_BATCH_LECTURES', '100'))
+BATCH_RETENTION_DAYS = int(os.environ.get('BATCH_RETENTION_DAYS', '30'))
+
+BATCH_TABLES = '''
+CREATE TABLE IF NOT EXISTS attendance_batches (
+	teacher_id INTEGER NOT NULL,
+	batch_id TEXT NOT NULL,
+	received TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	response TEXT NOT NULL,
+	PRIMARY KEY (teacher_id, batch_id),
+	FOREIGN KEY(teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_attendance_batches_received ON attendance_batches(received);
+'''
+
+UPSERT = '''
+INSERT INTO attendance_marks (class_id, subject_id, day, student_id, teacher_id, present) VALUES (?,?,?,?,?,?)
+ON CONFLICT(class_id, subject_id, day, student_id) DO UPDATE
+	SET present = excluded.present, teacher_id = excluded.teacher_id
+	WHERE present IS NOT excluded.present
+'''
+
+MARK_ALL = '''
+INSERT INTO attendance_marks (class_id, subject_id, day, student_id, teacher_id, present)
+	SELECT ?, ?, ?, student_id, ?, 1 FROM students WHERE class = ?
+ON CONFLICT(class_id, subject_id, day, student_id) DO UPDATE
+	SET present = excluded.present, teacher_id = excluded.teacher_id
+	WHERE present IS NOT excluded.present
+'''
+
+
+def lecture_day(date):
+	try:
+		return compact.day_number(date)
+	except (TypeError, ValueError):
+		raise ValueError('date must be YYYY-MM-DD') from None
+
+
+def _open_day(db, date):
+	day = lecture_day(date)
+	if archive.archived(db, day):
+		raise ValueError(f'attendance for {date} is archived')
+	return day
+
+
+def lecture_statuses(db, class_name, subject, date):
+	"""{student_id: 'Present'|'Absent'} of one lecture; empty for a malformed date."""
+	day = compact.day_or(date, None)
+	if day is None:
+		return {}
+	rows = db.execute(
+		'SELECT student_id, present FROM attendance_marks'
+		f" WHERE class_id = {compact.class_id_sql('?')} AND subject_id = {compact.subject_id_sql('?')} AND day = ?",
+		(class_name, subject, day)).fetchall()
+	return {r['student_id']: STATUSES[not r['present']] for r in rows}
+
+
+def save_lecture(db, teacher_id, class_name, subject, date, statuses, default='Absent'):
+	"""Write ``statuses`` ({student_id: 'Present'|'Absent'}) for one lecture.
+
+	Students of the class missing from ``statuses`` get ``default`` (pass
+	``None`` to leave them untouched). Returns the number of rows changed.
+	Raises ValueError for a malformed or archived date.
+	"""
+	day = _open_day(db, date)
+	existing = lecture_statuses(db, class_name, subject, date)
+	if default is not None:
+		roster = [r['student_id'] for r in db.execute('SELECT student_id FROM students WHERE class = ?', (class_name,))]
+		wanted = {sid: statuses.get(sid, default) for sid in roster}
+	else:
+		wanted = statuses
+	changes = [(sid, status) for sid, status in wanted.items() if status in STATUSES and existing.get(sid) != status]
+	if changes:
+		class_id, subject_id = compact.ids(db, class_name, subject, create=True)
+		db.executemany(UPSERT, [(class_id, subject_id, day, sid, teacher_id, status == 'Present') for sid, status in changes])
+		lectures.flush(db)
+	return len(changes)
+
+
+def mark_all_present(db, teacher_id, class_name, subject, date):
+	"""Set-based 'Mark All Present'; returns the number of rows changed."""
+	day = _open_day(db, date)
+	class_id, subject_id = compact.ids(db, class_name, subject, create=True)
+	changed = db.execute(MARK_ALL, (class_id, subject_id, day, teacher_id, class_name)).rowcount
+	if changed:
+		lectures.flush(db)
+	return changed
+
+
+def _lecture_error(lecture):
+	"""Why ``lecture`` cannot be applied, or None."""
+	if not isinstance(lecture, dict):
+		return 'lecture must be an object'
+	for field in ('class', 'subject', 'date'):
+		if not isinstance(lecture.get(field), str) or not lecture[field].strip():
+			return f'missing {field}'
+	try:
+		datetime.strptime(lecture['date'], '%Y-%m-%d')
+	except ValueError:
+		return 'date must be YYYY-MM-DD'
+	statuses = lecture.get('statuses', {})
+	if not isinstance(statuses, dict):
+		return 'statuses must be an object'
+	for sid, status in statuses.items():
+		if not str(sid).isdigit() or status not in STATUSES:
+			return f'invalid status for student {sid}'
+	return None
+
+
+def apply_lecture(db, teacher_id, lecture):
+	"""Apply one batch entry; returns rows changed. Raises ValueError if it is invalid.
+
+	``mark_all`` marks the whole class present. Otherwise ``statuses`` holds
+	only the students that changed; ``fill_absent`` also records students of
+	the class that have no row yet as Absent, as a full form save does.
+	"""
+	error = _lecture_error(lecture)
+	if error:
+		raise ValueError(error)
+	class_name, subject, date = lecture['class'], lecture['subject'], lecture['date']
+	if lecture.get('mark_all'):
+		return mark_all_present(db, teacher_id, class_name, subject, date)
+	statuses = {int(sid): status for sid, status in lecture.get('statuses', {}).items()}
+	roster = {r['student_id'] for r in db.execute('SELECT student_id FROM students WHERE class = ?', (class_name,))}
+	unknown = sorted(set(statuses) - roster)
+	if unknown:
+		raise ValueError(f'students not in {class_name}: {unknown}')
+	if lecture.get('fill_absent'):
+		marked = lecture_statuses(db, class_name, subject, date)
+		statuses = {**{sid: 'Absent' for sid in roster if sid not in marked}, **statuses}
+	return save_lecture(db, teacher_id, class_name, subject, date, statuses, default=None)
+
+
+def apply_batch(db, teacher_id, batch_id, lectures):
+	"""Apply a batch of lectures once; returns (response, replayed).
+
+	Runs inside the caller's transaction. Each lecture is applied under its
+	own savepoint, so one bad lecture is reported without losing the rest.
+	"""
+	row = db.execute('SELECT response FROM attendance_batches WHERE teacher_id = ? AND batch_id = ?',
+					 (teacher_id, batch_id)).fetchone()
+	if row:
+		return json.loads(row['response']), True
+	results = []
+	for index, lecture in enumerate(lectures):
+		result = {'index': index}
+		if isinstance(lecture, dict):
+			result.update({k: lecture.get(k) for k in ('class', 'subject', 'date')})
+		db.execute('SAVEPOINT lecture')
+		try:
+			result['changed'] = apply_lecture(db, teacher_id, lecture)
+			result['ok'] = True
+			db.execute('RELEASE lecture')
+		except (ValueError, sqlite3.Error) as exc:
+			db.execute('ROLLBACK TO lecture')
+			db.execute('RELEASE lecture')
+			result['ok'] = False
+			result['error'] = str(exc)
+		results.append(result)
+	response = {'batch_id': batch_id, 'results': results}
+	db.execute('INSERT INTO attendance_batches (teacher_id, batch_id, response) VALUES (?,?,?)',
+			   (teacher_id, batch_id, json.dumps(response)))
+	db.execute("DELETE FROM attendance_batches WHERE received < datetime('now', ?)", (f'-{BATCH_RETENTION_DAYS} days',))
+	return response, False
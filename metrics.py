@@ -0,0 +1,347 @@
+"""
+Process-shared metrics in the Prometheus text format.
+
+Each process keeps its counters and histograms in memory and writes them to
+its own file in ``METRICS_DIR``. Requests and exports only mark the values
+changed. One flusher thread per process (started by ``init_app`` and again
+in a forked worker) writes them every ``METRICS_FLUSH`` seconds, so a file
+is never more than that interval behind.
+``/metrics`` merges every file in the directory with the live values of the
+process answering, so the numbers cover all workers. A process removes its
+file at exit, and ``collect`` removes those of workers that died without
+doing so; the counts of an exited worker leave the totals with it, which
+Prometheus treats as a counter reset.
+
+Values that other objects already count, such as the report cache's
+hits and misses, are read through ``collect_from`` callbacks each time the
+file is written. With ``METRICS_DIR`` set to None (the benchmark scripts do
+this) nothing is written and only this process is reported.
+"""
+
+import atexit
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics')
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH', '1'))
+# bearer token for /metrics scrapers; logged-in admins can always read it
+TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (10e3, 50e3, 100e3, 500e3, 1e6, 5e6, 10e6, 50e6)
+# lock waits are normally ~0 and capped by SQLITE_BUSY_TIMEOUT (5 s)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0)
+GROUP_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_lock = threading.Lock()
+_metrics = {}
+_values = {}
+_callbacks = []
+_file = None
+_dirty = False
+_flusher_pid = None
+
+
+class Metric:
+	def __init__(self, kind, name, doc, labels=(), buckets=None):
+		self.kind = kind
+		self.name = name
+		self.doc = doc
+		self.labels = tuple(labels)
+		self.buckets = buckets
+		_metrics[name] = self
+
+	def inc(self, *labels, amount=1):
+		key = (self.name, labels)
+		with _lock:
+			_values[key] = _values.get(key, 0) + amount
+
+	def observe(self, value, *labels):
+		# per-bucket (not cumulative) counts, then sum and count
+		key = (self.name, labels)
+		with _lock:
+			slots = _values.get(key)
+			if slots is None:
+				slots = _values[key] = [0] * (len(self.buckets) + 3)
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					slots[i] += 1
+					break
+			else:
+				slots[len(self.buckets)] += 1
+			slots[-2] += value
+			slots[-1] += 1
+
+
+def counter(name, doc, labels=()):
+	return Metric('counter', name, doc, labels)
+
+
+def histogram(name, doc, labels=(), buckets=LATENCY_BUCKETS):
+	return Metric('histogram', name, doc, labels, buckets)
+
+
+def collect_from(fn):
+	"""Register ``fn() -> {(metric_name, label_values): value}`` for counters kept elsewhere."""
+	_callbacks.append(fn)
+	return fn
+
+
+REQUEST_SECONDS = histogram('attendance_request_seconds', 'Request latency, including streamed bodies.', ('endpoint', 'role'))
+REQUEST_DB_SECONDS = histogram('attendance_request_db_seconds', 'SQLite time per request.', ('endpoint',))
+REQUESTS = counter('attendance_requests_total', 'Requests by endpoint, role and status code.', ('endpoint', 'role', 'status'))
+EXPORT_SECONDS = histogram('attendance_export_seconds', 'Time to render an export job.', ('kind',), LATENCY_BUCKETS + (30.0, 60.0))
+EXPORT_BYTES = histogram('attendance_export_bytes', 'Size of rendered exports.', ('kind',), SIZE_BUCKETS)
+EXPORT_REQUESTS = counter('attendance_export_requests_total', 'Export requests by whether the file was ready.', ('kind', 'result'))
+EXPORT_JOBS = counter('attendance_export_jobs_total', 'Finished export jobs by state.', ('kind', 'state'))
+DB_LOCK_WAIT = histogram('attendance_db_lock_wait_seconds', 'Time BEGIN IMMEDIATE waited for the write lock.', (), WAIT_BUCKETS)
+DB_LOCKED = counter('attendance_db_locked_total', "Requests and jobs that failed with 'database is locked'.", ('source',))
+WRITE_SECONDS = histogram('attendance_write_seconds', 'Time a write waited for its group to commit on the writer thread.', (), WAIT_BUCKETS)
+WRITE_GROUP = histogram('attendance_write_group_size', 'Writes committed together per writer transaction.', (), GROUP_BUCKETS)
+WRITE_RETRIES = counter('attendance_write_retries_total', "Writer BEGIN/COMMIT retries after 'database is locked'.")
+VERIFY_SECONDS = histogram('attendance_password_verify_seconds', 'PBKDF2 verification time.', ('role',))
+VERIFY_QUEUED_SECONDS = histogram('attendance_password_verify_queued_seconds', 'Time a login waited for the verify pool.', ('role',))
+REPORT_CACHE = counter('attendance_report_cache_total', 'Report cache lookups and evictions.', ('result',))
+
+
+def is_locked(exc):
+	return exc is not None and 'database is locked' in str(exc)
+
+
+def _path():
+	global _file
+	if _file is None:
+		_file = os.path.join(METRICS_DIR, f'{os.getpid()}-{int(time.time() * 1000)}.json')
+	return _file
+
+
+def snapshot():
+	"""{name: {json label list: value}} for this process, including callbacks."""
+	with _lock:
+		values = {key: (list(v) if isinstance(v, list) else v) for key, v in _values.items()}
+	for fn in _callbacks:
+		values.update(fn())
+	out = {}
+	for (name, labels), value in values.items():
+		out.setdefault(name, {})[json.dumps(list(labels))] = value
+	return out
+
+
+def flush(force=False):
+	"""Write this process's values to its file now if ``force``, else mark them for the flusher thread."""
+	global _dirty
+	if not METRICS_DIR or not _values:
+		return
+	if not force:
+		_dirty = True
+		return
+	_dirty = False
+	data = snapshot()
+	tmp = None
+	try:
+		os.makedirs(METRICS_DIR, exist_ok=True)
+		fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+		with os.fdopen(fd, 'w', encoding='utf-8') as f:
+			json.dump(data, f)
+		os.replace(tmp, _path())
+	except OSError:
+		if tmp is not None:
+			_unlink(tmp)
+
+
+def _unlink(path):
+	try:
+		os.unlink(path)
+	except OSError:
+		pass
+
+
+def _alive(pid):
+	if os.name == 'nt':
+		# os.kill would terminate it; there are no forked workers to clean up after
+		return True
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass
+	return True
+
+
+def _remove():
+	# at exit; the counts go with the process
+	if _file is not None:
+		_unlink(_file)
+
+
+def _flush_loop():
+	while True:
+		time.sleep(FLUSH_INTERVAL)
+		if _dirty:
+			flush(force=True)
+
+
+def start_flusher():
+	"""Start this process's flusher thread, once."""
+	global _flusher_pid
+	if not METRICS_DIR or _flusher_pid == os.getpid():
+		return
+	_flusher_pid = os.getpid()
+	threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _merge(total, data):
+	for name, series in data.items():
+		merged = total.setdefault(name, {})
+		for labels, value in series.items():
+			if isinstance(value, list):
+				old = merged.get(labels)
+				merged[labels] = [a + b for a, b in zip(old, value)] if old else list(value)
+			else:
+				merged[labels] = merged.get(labels, 0) + value
+
+
+def collect():
+	"""Values merged across every worker's file and this process's live values."""
+	flush(force=True)
+	total = {}
+	if not METRICS_DIR:
+		_merge(total, snapshot())
+		return total
+	try:
+		names = sorted(os.listdir(METRICS_DIR))
+	except FileNotFoundError:
+		names = []
+	for name in names:
+		if not name.endswith('.json'):
+			continue
+		path = os.path.join(METRICS_DIR, name)
+		pid = name.split('-', 1)[0]
+		if pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+			_unlink(path)
+			continue
+		try:
+			with open(path, encoding='utf-8') as f:
+				_merge(total, json.load(f))
+		except (OSError, ValueError):
+			continue
+	return total
+
+
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+	pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(values=None):
+	"""The Prometheus text exposition (format 0.0.4) of ``collect()``."""
+	values = collect() if values is None else values
+	lines = []
+	for name, metric in _metrics.items():
+		series = values.get(name, {})
+		lines.append(f'# HELP {name} {metric.doc}')
+		lines.append(f'# TYPE {name} {metric.kind}')
+		for labels_json in sorted(series):
+			labels = json.loads(labels_json)
+			value = series[labels_json]
+			if metric.kind == 'counter':
+				lines.append(f'{name}{_labels(metric.labels, labels)} {_number(value)}')
+				continue
+			cumulative = 0
+			for bound, count in zip(metric.buckets + (float('inf'),), value):
+				cumulative += count
+				le = '+Inf' if bound == float('inf') else _number(float(bound))
+				lines.append(f'{name}_bucket{_labels(metric.labels, labels, [("le", le)])} {cumulative}')
+			lines.append(f'{name}_sum{_labels(metric.labels, labels)} {_number(float(value[-2]))}')
+			lines.append(f'{name}_count{_labels(metric.labels, labels)} {value[-1]}')
+	# derived, so it is always consistent with the merged counters
+	cache = values.get(REPORT_CACHE.name, {})
+	hits, misses = cache.get('["hit"]', 0), cache.get('["miss"]', 0)
+	lines.append('# HELP attendance_report_cache_hit_ratio Report cache hits over lookups, all workers.')
+	lines.append('# TYPE attendance_report_cache_hit_ratio gauge')
+	lines.append(f'attendance_report_cache_hit_ratio {_number(hits / (hits + misses) if hits + misses else 0.0)}')
+	return '\n'.join(lines) + '\n'
+
+
+def init_app(app, report_cache=None):
+	"""Record request metrics for ``app`` and serve them at ``/metrics``.
+
+	Only logged-in admins and requests with ``Authorization: Bearer
+	<METRICS_TOKEN>`` may read them.
+	"""
+	from time import perf_counter
+
+	from flask import Response, abort, g, request, session
+
+	import timing
+
+	start_flusher()
+	if report_cache is not None:
+		@collect_from
+		def report_cache_counts():
+			s = report_cache.stats()
+			return {(REPORT_CACHE.name, ('hit',)): s['hits'], (REPORT_CACHE.name, ('miss',)): s['misses'],
+					(REPORT_CACHE.name, ('eviction',)): s['evictions']}
+
+	@app.before_request
+	def start_request_clock():
+		g.metrics_started = perf_counter()
+
+	@app.after_request
+	def record_status(response):
+		g.metrics_status = response.status_code
+		return response
+
+	@app.teardown_request
+	def record_request(exception):
+		started = g.pop('metrics_started', None)
+		if started is None:
+			return
+		endpoint = request.endpoint or 'unmatched'
+		role = (session.get('user') or {}).get('role', 'anonymous')
+		REQUEST_SECONDS.observe(perf_counter() - started, endpoint, role)
+		REQUESTS.inc(endpoint, role, str(g.pop('metrics_status', 500)))
+		timings = timing.current()
+		if timings is not None:
+			REQUEST_DB_SECONDS.observe(timings.db, endpoint)
+		if is_locked(exception):
+			DB_LOCKED.inc('request')
+		flush()
+
+	@app.route('/metrics')
+	def metrics_endpoint():
+		token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+		if not (TOKEN and hmac.compare_digest(token, TOKEN)) and (session.get('user') or {}).get('role') != 'admin':
+			abort(404)
+		return Response(render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+	@app.cli.command('metrics')
+	def metrics_command():
+		"""Print the merged metrics of every worker."""
+		print(render(), end='')
+
+
+def _after_fork():
+	# a forked worker starts its own file and flusher; the parent's counts stay in the parent's
+	global _file, _dirty, _lock
+	_file, _dirty, _lock = None, False, threading.Lock()
+	_values.clear()
+	if _flusher_pid is not None:
+		start_flusher()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_remove)
@@ -0,0 +1,251 @@
+"""
+Versioned schema migrations for attendance.db.
+
+The applied version is stored in ``PRAGMA user_version``. Each migration runs
+once, inside its own ``BEGIN IMMEDIATE`` transaction, so several workers
+starting at the same time cannot apply the same step twice.
+"""
+
+import os
+import sqlite3
+
+import archive
+import compact
+import lectures
+import marking
+import passwords
+import rollups
+import search
+import versions
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.sql')
+
+MIGRATIONS = []
+
+
+def migration(version):
+	def decorator(fn):
+		MIGRATIONS.append((version, fn))
+		MIGRATIONS.sort(key=lambda m: m[0])
+		return fn
+	return decorator
+
+
+def get_table_columns(db, table_name):
+	try:
+		rows = db.execute(f"PRAGMA table_info({table_name})").fetchall()
+		return [r[1] for r in rows]
+	except sqlite3.Error:
+		return []
+
+
+def run_script(db, script):
+	# executescript() would commit our transaction, so feed statements one by one
+	stmt = ''
+	for line in script.splitlines(keepends=True):
+		stmt += line
+		if sqlite3.complete_statement(stmt):
+			if not stmt.strip().upper().startswith('PRAGMA'):
+				db.execute(stmt)
+			stmt = ''
+
+
+def current_version(db):
+	return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def latest_version():
+	return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def migrate(db, target=None):
+	"""Apply pending migrations; returns the list of versions applied."""
+	target = latest_version() if target is None else target
+	applied = []
+	if current_version(db) >= target:
+		return applied
+	for version, fn in MIGRATIONS:
+		if version > target:
+			break
+		db.execute('BEGIN IMMEDIATE')
+		try:
+			# re-check under the write lock, another worker may have won the race
+			if current_version(db) >= version:
+				db.rollback()
+				continue
+			fn(db)
+			db.execute(f'PRAGMA user_version = {int(version)}')
+			db.commit()
+		except Exception:
+			db.rollback()
+			raise
+		applied.append(version)
+	return applied
+
+
+def migrate_startup(db):
+	"""The migrations a process start applies; returns the versions applied.
+
+	Stops at 10 while ``compact.backfill`` still has attendance rows to copy,
+	as migration 11 would copy them all in one write transaction. The
+	``compact-attendance`` command (or ``migrate``) applies it explicitly.
+	"""
+	applied = migrate(db, 10)
+	progress = compact.backfill_progress(db)
+	if progress and progress[0] != progress[1]:
+		return applied
+	return applied + migrate(db)
+
+
+# Migrations
+
+@migration(1)
+def baseline_schema(db):
+	with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+		schema = f.read()
+	cols = get_table_columns(db, 'teachers')
+	if 'subject' in cols or 'class_assigned' in cols:
+		# legacy single-assignment teachers table
+		db.execute('DROP TABLE IF EXISTS teacher_assignments')
+		db.execute('DROP TABLE IF EXISTS teachers')
+	run_script(db, schema)
+	if 'phone' not in get_table_columns(db, 'teachers'):
+		db.execute('ALTER TABLE teachers ADD COLUMN phone TEXT')
+	if 'prn' not in get_table_columns(db, 'students'):
+		db.execute('ALTER TABLE students ADD COLUMN prn TEXT')
+	db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_teachers_phone ON teachers(phone)')
+
+
+@migration(2)
+def covering_indexes(db):
+	# teacher_mark loads and saves one lecture: class + subject + date
+	db.execute('CREATE INDEX IF NOT EXISTS idx_attendance_lecture ON attendance(class, subject, date, student_id, status)')
+	# reports and the student dashboard: one student over a date range
+	db.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance(student_id, date, subject, class, status)')
+	# rosters are always read by class in roll order
+	db.execute('CREATE INDEX IF NOT EXISTS idx_students_class ON students(class, roll_no)')
+	# student login looks up prn first
+	db.execute('CREATE INDEX IF NOT EXISTS idx_students_prn ON students(prn)')
+
+
+@migration(3)
+def attendance_rollups(db):
+	run_script(db, rollups.TABLES)
+	run_script(db, rollups.TRIGGERS)
+	rollups.rebuild(db)
+
+
+@migration(4)
+def rollup_triggers_for_upsert(db):
+	# version 3 triggers relied on OR IGNORE, which an outer upsert overrides
+	for name in ('attendance_rollup_ai', 'attendance_rollup_ad', 'attendance_rollup_au'):
+		db.execute(f'DROP TRIGGER IF EXISTS {name}')
+	run_script(db, rollups.TRIGGERS)
+
+
+@migration(5)
+def data_version(db):
+	run_script(db, versions.TABLES)
+	run_script(db, versions.TRIGGERS)
+
+
+@migration(6)
+def data_version_teachers(db):
+	# report filters list subjects from teacher_assignments
+	run_script(db, versions.TRIGGERS)
+
+
+@migration(7)
+def data_version_modified(db):
+	if 'modified' not in get_table_columns(db, 'data_version'):
+		db.execute('ALTER TABLE data_version ADD COLUMN modified INTEGER NOT NULL DEFAULT 0')
+	db.execute("UPDATE data_version SET modified = CAST(strftime('%s', 'now') AS INTEGER)")
+	for table in versions.TRACKED:
+		for suffix, _ in versions.EVENTS:
+			db.execute(f'DROP TRIGGER IF EXISTS {table}_version_{suffix}')
+	run_script(db, versions.TRIGGERS)
+
+
+@migration(8)
+def student_search_index(db):
+	run_script(db, search.TABLES)
+	run_script(db, search.TRIGGERS)
+	search.rebuild(db)
+
+
+@migration(9)
+def attendance_batches(db):
+	run_script(db, marking.BATCH_TABLES)
+
+
+@migration(10)
+def compact_attendance_dual_write(db):
+	# new writes reach attendance_marks from here on; compact.backfill copies the rest
+	run_script(db, compact.TABLES)
+	run_script(db, compact.MIRROR_TRIGGERS)
+	run_script(db, compact.BACKFILL_TABLE)
+
+
+@migration(11)
+def compact_attendance_cutover(db):
+	while compact.backfill(db):
+		pass
+	copied, rows = compact.backfill_progress(db)
+	if copied != rows:
+		raise RuntimeError(f'attendance_marks has {copied} rows, attendance {rows}')
+	# drops the old indexes and the rollup, version and mirror triggers with it
+	db.execute('DROP TABLE attendance')
+	db.execute('DROP TABLE attendance_backfill')
+	db.execute("DELETE FROM sqlite_sequence WHERE name = 'attendance'")
+	run_script(db, compact.VIEW)
+	run_script(db, rollups.MARK_TRIGGERS)
+	run_script(db, versions.triggers(('attendance_marks',)))
+
+
+@migration(12)
+def lecture_bitmaps(db):
+	run_script(db, lectures.TABLES)
+	run_script(db, lectures.TRIGGERS)
+	lectures.rebuild(db)
+
+
+@migration(13)
+def semester_archives(db):
+	run_script(db, archive.TABLES)
+	run_script(db, archive.TRIGGERS)
+
+
+@migration(14)
+def data_version_skip_passwords(db):
+	for table in versions.UPDATE_COLUMNS:
+		db.execute(f'DROP TRIGGER IF EXISTS {table}_version_au')
+	run_script(db, versions.triggers(tuple(versions.UPDATE_COLUMNS)))
+
+
+# Seed data
+
+TEACHER_PHONES = {
+	'Dr. Rachana Chavan Mam': '9637717113',
+	'Dr. Khan A.A. Mam': '9223684446',
+	'Dr. Quazi Khabeer Sir': '9604903027',
+	'Dr. Aarif Sir': '7006867886',
+	'Dr. Amit Kumar Sir': '9438363640',
+	'Dr. Rushikesh': '7276313014',
+	'Dr. Nikita Mam': '9764172599',
+}
+
+DEFAULT_HOD = ('Dr. Satish Gujar Sir', '9764996844', 'Satish123')
+
+
+def seed(db):
+	"""Idempotent seed of teacher phones and the default HOD account."""
+	changed = 0
+	for name, phone in TEACHER_PHONES.items():
+		cur = db.execute('UPDATE teachers SET phone = ? WHERE name = ? AND phone IS NOT ?', (phone, name, phone))
+		changed += cur.rowcount
+	name, phone, password = DEFAULT_HOD
+	if not db.execute('SELECT 1 FROM hods WHERE phone = ?', (phone,)).fetchone():
+		db.execute('INSERT OR IGNORE INTO hods (name, phone, password_hash) VALUES (?,?,?)', (name, phone, passwords.hash_password(password)))
+		changed += 1
+	db.commit()
+	return changed
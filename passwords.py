@@ -0,0 +1,116 @@
+"""
+Password hashing helpers.
+
+All hashing goes through one passlib ``CryptContext`` so the PBKDF2 cost is
+configured in one place (``PASSWORD_ROUNDS``); hashes below that cost are
+upgraded the next time their owner logs in. Login verification, and the
+single hashes requests make (``hash_pooled``: default-password resets,
+password changes), run on a small bounded thread pool (``VERIFY_WORKERS``)
+so a burst of logins cannot take every core away from the other requests.
+Verify latency is recorded per role.
+
+Bulk hashing (imports) fans out over a process pool instead. The pool uses
+the ``spawn`` start method so worker processes never inherit the app's
+threads or SQLite handles.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+import metrics
+
+ROUNDS = int(os.environ.get('PASSWORD_ROUNDS', '29000'))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', '0')) or (os.cpu_count() or 1)
+# below this many hashes the pool start-up is not worth it
+POOL_THRESHOLD = int(os.environ.get('HASH_POOL_THRESHOLD', '8'))
+# leave at least one core for everything that is not a login
+VERIFY_WORKERS = int(os.environ.get('VERIFY_WORKERS', '0')) or max(1, (os.cpu_count() or 1) // 2)
+SLOW_VERIFY = float(os.environ.get('SLOW_VERIFY_MS', '500')) / 1000
+
+context = CryptContext(
+	schemes=['pbkdf2_sha256'],
+	pbkdf2_sha256__default_rounds=ROUNDS,
+	pbkdf2_sha256__min_rounds=ROUNDS,
+)
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+_verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='verify')
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def hash_password(password):
+	return context.hash(password)
+
+
+def _record(role, waited, elapsed):
+	with _stats_lock:
+		s = _stats.setdefault(role, {'count': 0, 'seconds': 0.0, 'max': 0.0, 'queued': 0.0})
+		s['count'] += 1
+		s['seconds'] += elapsed
+		s['max'] = max(s['max'], elapsed)
+		s['queued'] += waited
+	metrics.VERIFY_SECONDS.observe(elapsed, role)
+	metrics.VERIFY_QUEUED_SECONDS.observe(waited, role)
+	if waited + elapsed > SLOW_VERIFY:
+		log.warning('slow %s password check: %.0f ms queued, %.0f ms hashing', role, waited * 1000, elapsed * 1000)
+
+
+def _timed_verify(password, stored, submitted, role):
+	started = time.perf_counter()
+	try:
+		return context.verify_and_update(password, stored)
+	finally:
+		done = time.perf_counter()
+		_record(role, started - submitted, done - started)
+
+
+def verify(password, stored, role='unknown'):
+	"""(ok, new_hash) for one login attempt; new_hash is set when ``stored`` is out of date.
+
+	Exactly one hash computation, run on the bounded verify pool.
+	"""
+	if not stored:
+		return False, None
+	try:
+		return _verify_pool.submit(_timed_verify, password, stored, time.perf_counter(), role).result()
+	except ValueError:
+		# not a hash this context knows
+		return False, None
+
+
+def hash_pooled(password):
+	"""``hash_password`` run on the bounded verify pool, for hashes made during a request."""
+	return _verify_pool.submit(hash_password, password).result()
+
+
+def verify_stats():
+	"""{role: {'count', 'seconds', 'max', 'queued'}} since process start."""
+	with _stats_lock:
+		return {role: dict(s) for role, s in _stats.items()}
+
+
+def _process_pool():
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+		return _pool
+
+
+def hash_many(passwords):
+	"""One salted hash per input password, hashed in parallel when worthwhile."""
+	passwords = list(passwords)
+	if len(passwords) < POOL_THRESHOLD or HASH_WORKERS < 2:
+		return [hash_password(p) for p in passwords]
+	chunksize = max(1, len(passwords) // (HASH_WORKERS * 4))
+	return list(_process_pool().map(hash_password, passwords, chunksize=chunksize))
@@ -0,0 +1,188 @@
+"""
+Bulk removal of classes, students and teachers.
+
+``flask --app app remove`` takes any mix of classes (their students,
+attendance and teacher assignments), students (by roll number or PRN) and
+teachers (by phone or name). The matches go into temp tables on the
+command's connection. They are then deleted in short transactions of at
+most ``--batch`` rows each, so teachers can keep marking meanwhile:
+
+1. attendance rows of the classes, students and teachers, in primary-key
+   chunks. The rollup, version and bitmap triggers fire as for any delete,
+   and each chunk refreshes the bitmaps it touched;
+2. the rollup counters of the removed students;
+3. the teacher assignments of the classes and teachers, and the classes'
+   bitmap slots;
+4. the students, then the teachers (their batch results cascade).
+
+A teacher's attendance rows go with them (``attendance_marks`` cascades on
+teachers), whichever students they cover. Semester archives keep their
+copies. ``vacuum`` hands the freed pages back to the file system in steps.
+"""
+
+import compact
+import database
+import lectures
+
+BATCH = 5000
+VACUUM_PAGES = 1000
+
+TABLES = '''
+CREATE TEMP TABLE IF NOT EXISTS remove_classes (name TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TEMP TABLE IF NOT EXISTS remove_students (student_id INTEGER PRIMARY KEY);
+CREATE TEMP TABLE IF NOT EXISTS remove_teachers (teacher_id INTEGER PRIMARY KEY);
+DELETE FROM remove_classes;
+DELETE FROM remove_students;
+DELETE FROM remove_teachers;
+'''
+
+MATCH = ('(class_id IN (SELECT class_id FROM classes WHERE name IN (SELECT name FROM temp.remove_classes))'
+		 ' OR student_id IN (SELECT student_id FROM temp.remove_students)'
+		 ' OR teacher_id IN (SELECT teacher_id FROM temp.remove_teachers))')
+
+
+def select(db, classes=(), students=(), teachers=()):
+	"""Fill the temp tables with what the filters match, and commit; returns {filter: [values matching nothing]}."""
+	db.executescript(TABLES)
+	unmatched = {'class': [], 'student': [], 'teacher': []}
+	for name in classes:
+		known = db.execute('SELECT 1 FROM students WHERE class = ?1 UNION ALL SELECT 1 FROM teacher_assignments WHERE class = ?1'
+						   ' UNION ALL SELECT 1 FROM classes WHERE name = ?1 LIMIT 1', (name,)).fetchone()
+		if not known:
+			unmatched['class'].append(name)
+			continue
+		db.execute('INSERT OR IGNORE INTO temp.remove_classes (name) VALUES (?)', (name,))
+		db.execute('INSERT OR IGNORE INTO temp.remove_students SELECT student_id FROM students WHERE class = ?', (name,))
+	for roll_or_prn in students:
+		ids = db.execute('SELECT student_id FROM students WHERE roll_no = ?1 OR prn = ?1', (roll_or_prn,)).fetchall()
+		if not ids:
+			unmatched['student'].append(roll_or_prn)
+		db.executemany('INSERT OR IGNORE INTO temp.remove_students (student_id) VALUES (?)', ids)
+	for phone_or_name in teachers:
+		# phone numbers as the HOD form takes them, spaces ignored
+		ids = db.execute('SELECT teacher_id FROM teachers WHERE phone = ? OR name = ?',
+						 (phone_or_name.replace(' ', ''), phone_or_name)).fetchall()
+		if not ids:
+			unmatched['teacher'].append(phone_or_name)
+		db.executemany('INSERT OR IGNORE INTO temp.remove_teachers (teacher_id) VALUES (?)', ids)
+	# only temp tables were written; end the implicit transaction
+	db.commit()
+	return {key: values for key, values in unmatched.items() if values}
+
+
+def counts(db):
+	"""Rows the current selection removes, per kind."""
+	def one(sql):
+		return db.execute(sql).fetchone()[0]
+
+	return {
+		'classes': one('SELECT COUNT(*) FROM temp.remove_classes'),
+		'students': one('SELECT COUNT(*) FROM temp.remove_students'),
+		'teachers': one('SELECT COUNT(*) FROM temp.remove_teachers'),
+		'teacher assignments': one('SELECT COUNT(*) FROM teacher_assignments WHERE class IN (SELECT name FROM temp.remove_classes)'
+								   ' OR teacher_id IN (SELECT teacher_id FROM temp.remove_teachers)'),
+		'attendance rows': one(f'SELECT COUNT(*) FROM attendance_marks WHERE {MATCH}'),
+	}
+
+
+def delete_marks(db, after=None, limit=BATCH):
+	"""Delete the next ``limit`` matching attendance rows after key ``after``; returns (deleted, last key).
+
+	The last key is None once nothing is left. Caller owns the transaction.
+	"""
+	rows = db.execute(
+		f'SELECT {compact.MARK_KEY} FROM attendance_marks WHERE {MATCH}'
+		+ (f' AND ({compact.MARK_KEY}) > (?, ?, ?, ?)' if after else '')
+		+ f' ORDER BY {compact.MARK_KEY} LIMIT ?', tuple(after or ()) + (limit,)).fetchall()
+	if not rows:
+		return 0, None
+	deleted = db.executemany('DELETE FROM attendance_marks WHERE class_id = ? AND subject_id = ? AND day = ? AND student_id = ?',
+							 [tuple(r) for r in rows]).rowcount
+	lectures.flush(db, None)
+	return deleted, tuple(rows[-1])
+
+
+def delete_rollups(db, limit=BATCH):
+	"""Delete up to ``limit`` rollup counters of the removed students; returns how many."""
+	return db.execute(
+		'DELETE FROM attendance_rollup WHERE (student_id, class, subject, day) IN'
+		' (SELECT student_id, class, subject, day FROM attendance_rollup'
+		'  WHERE student_id IN (SELECT student_id FROM temp.remove_students) LIMIT ?)', (limit,)).rowcount
+
+
+def delete_people(db, table, after=0, limit=BATCH):
+	"""Delete the next ``limit`` selected ``table`` rows (students or teachers) after id ``after``; returns (deleted, last id)."""
+	column = {'students': 'student_id', 'teachers': 'teacher_id'}[table]
+	ids = [r[0] for r in db.execute(f'SELECT {column} FROM temp.remove_{table} WHERE {column} > ? ORDER BY {column} LIMIT ?',
+									(after, limit))]
+	if not ids:
+		return 0, None
+	deleted = db.executemany(f'DELETE FROM {table} WHERE {column} = ?', [(i,) for i in ids]).rowcount
+	return deleted, ids[-1]
+
+
+def delete_assignments(db):
+	"""Delete the selection's teacher assignments and the classes' bitmap slots; returns the assignments removed."""
+	deleted = db.execute('DELETE FROM teacher_assignments WHERE class IN (SELECT name FROM temp.remove_classes)'
+						 ' OR teacher_id IN (SELECT teacher_id FROM temp.remove_teachers)').rowcount
+	db.execute('DELETE FROM roster_slots WHERE class_id IN'
+			   ' (SELECT class_id FROM classes WHERE name IN (SELECT name FROM temp.remove_classes))')
+	return deleted
+
+
+def remove(db, limit=BATCH, progress=None):
+	"""Delete the current selection in short transactions; returns rows removed per kind."""
+	progress = progress or (lambda message: None)
+	removed = {'attendance rows': 0, 'rollup counters': 0, 'students': 0, 'teachers': 0, 'teacher assignments': 0}
+	after = None
+	while True:
+		with database.transaction(db):
+			n, after = delete_marks(db, after, limit)
+		if after is None:
+			break
+		removed['attendance rows'] += n
+		progress(f'{removed["attendance rows"]} attendance rows removed')
+	while True:
+		with database.transaction(db):
+			n = delete_rollups(db, limit)
+		if not n:
+			break
+		removed['rollup counters'] += n
+		progress(f'{removed["rollup counters"]} rollup counters removed')
+	with database.transaction(db):
+		removed['teacher assignments'] = delete_assignments(db)
+	for table in ('students', 'teachers'):
+		after = 0
+		while True:
+			with database.transaction(db):
+				n, after = delete_people(db, table, after, limit)
+			if after is None:
+				break
+			removed[table] += n
+			progress(f'{removed[table]} {table} removed')
+	return removed
+
+
+def vacuum(db, pages=VACUUM_PAGES, progress=None):
+	"""Return free pages to the file system, ``pages`` per transaction; returns how many.
+
+	A database not yet in incremental auto-vacuum mode is switched to it,
+	which takes one full VACUUM.
+	"""
+	progress = progress or (lambda message: None)
+	free = db.execute('PRAGMA freelist_count').fetchone()[0]
+	if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+		progress('switching the database to incremental auto-vacuum (one full VACUUM)')
+		db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+		db.execute('VACUUM')
+		return free
+	freed = 0
+	while True:
+		with database.transaction(db):
+			db.execute(f'PRAGMA incremental_vacuum({pages})').fetchall()
+			left = db.execute('PRAGMA freelist_count').fetchone()[0]
+		if left >= free:
+			return freed
+		freed += free - left
+		free = left
+		progress(f'{freed} free pages returned, {left} left')
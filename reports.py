@@ -0,0 +1,344 @@
+"""
+Set-based attendance aggregation shared by the report and export routes.
+
+Every report is one query over the roster, so its cost does not grow with
+the number of round trips. ``source`` (default ``REPORT_SOURCE``) picks
+where the counts come from:
+
+- ``rollups``: the cumulative counters in ``attendance_rollup``, two index
+  lookups per student and subject whatever the range;
+- ``rows``: a GROUP BY over the rows of ``attendance_marks``;
+- ``bitmaps``: the per-lecture bitmaps of ``lectures``, summed in Python and
+  merged with the roster query. Single-student totals use the rollups.
+
+Date ranges that reach into a semester archive (see ``archive``) are
+counted from the rows whatever the source: the hot rows outside the
+archived ranges plus the archived ones, with archived students who have
+since left the roster listed too.
+"""
+
+import os
+
+import archive
+import compact
+import lectures
+import rollups
+import search as student_search
+
+SOURCES = ('rollups', 'rows', 'bitmaps')
+REPORT_SOURCE = os.environ.get('REPORT_SOURCE', 'rollups')
+
+
+def percent(attended, total):
+	return round((attended / total * 100), 2) if total else 0.0
+
+
+def _roster_filters(class_name, search, student_id, archived=False):
+	where = []
+	params = {}
+	if student_id is not None:
+		where.append('s.student_id = :student_id')
+		params['student_id'] = student_id
+	if class_name:
+		where.append('s.class = :class_name')
+		params['class_name'] = class_name
+	if search and search.strip():
+		if archived:
+			# archived rosters have no full-text index
+			condition, search_params = student_search.like_filter(search, param='archived_search')
+		else:
+			condition, search_params = student_search.student_filter(search)
+		where.append(condition)
+		params.update(search_params)
+	return where, params
+
+
+def _summary_select(class_name=None, subject=None, start=None, end=None, search=None,
+					attendance_class=None, by_subject=False, marked_only=False, student_id=None,
+					source=None, below=None, extra_where=None, archives=()):
+	"""(sql, params) of the grouped per-student summary, without ORDER BY (``rollups`` or ``rows``).
+
+	``archives`` (from ``archive.attach``) counts the rows over the hot and
+	archived marks and rosters.
+	"""
+	where, params = _roster_filters(class_name, search, student_id)
+	roster = 'students'
+	params.update({'start': start or '0000-00-00', 'end': end or '9999-99-99'})
+	join = []
+	if subject:
+		params['subject'] = subject
+	if attendance_class:
+		params['attendance_class'] = attendance_class
+	if not archives and (source or REPORT_SOURCE) != 'rows':
+		join.append('k.student_id = s.student_id')
+		if subject:
+			join.append('k.subject = :subject')
+		if attendance_class:
+			join.append('k.class = :attendance_class')
+		attended, total = rollups.span_sql(':start', ':end')
+		counts = f'COALESCE(SUM({total}), 0) AS total, COALESCE(SUM({attended}), 0) AS attended'
+		table = 'attendance_rollup_keys k'
+		subject_key = subject_column = 'k.subject'
+	else:
+		lecture = ['a.day BETWEEN :start_day AND :end_day']
+		params['start_day'] = compact.day_or(start, compact.FIRST_DAY)
+		params['end_day'] = compact.day_or(end, compact.LAST_DAY)
+		if subject:
+			lecture.append(f"a.subject_id = {compact.subject_id_sql(':subject')}")
+		if attendance_class:
+			lecture.append(f"a.class_id = {compact.class_id_sql(':attendance_class')}")
+		subject_key = 'a.subject_id'
+		subject_column = '(SELECT name FROM subjects WHERE subject_id = a.subject_id)'
+		join.append('a.student_id = s.student_id')
+		if archives:
+			archived_where, archived_params = _roster_filters(class_name, search, student_id, archived=True)
+			params.update(archived_params)
+			roster = archive.students_sql(archives, where, archived_where)
+			where = []
+			group = ('student_id', 'subject_id') if by_subject else ('student_id',)
+			table = archive.marks_sql(archives, ' AND '.join(lecture), group=group) + ' a'
+			counts = 'COALESCE(SUM(a.lectures), 0) AS total, COALESCE(SUM(a.present), 0) AS attended'
+		else:
+			join += lecture
+			table = 'attendance_marks a'
+			counts = 'COUNT(a.student_id) AS total, COALESCE(SUM(a.present), 0) AS attended'
+	if extra_where:
+		where.append(extra_where)
+	having = []
+	if marked_only or by_subject:
+		having.append('total > 0')
+	if below is not None:
+		# same rounding as percent(); students never marked count as 0%
+		having.append('(total = 0 OR ROUND(attended * 100.0 / total, 2) < :below)')
+		params['below'] = below
+	# roll_no is unique, so grouping by it walks the roll_no index in output order;
+	# an archived student's roll number may since have been reused
+	student_key = 's.roll_no, s.student_id' if archives else 's.roll_no'
+	group = f'{student_key}, {subject_key}' if by_subject else student_key
+	sql = (
+		'SELECT s.student_id, s.roll_no, s.name, s.class'
+		+ (f', {subject_column} AS subject' if by_subject else '')
+		+ ', ' + counts
+		+ f' FROM {roster} s ' + ('JOIN' if marked_only else 'LEFT JOIN') + f' {table} ON ' + ' AND '.join(join)
+		+ (' WHERE ' + ' AND '.join(where) if where else '')
+		+ ' GROUP BY ' + group
+		+ (' HAVING ' + ' AND '.join(having) if having else '')
+	)
+	return sql, params
+
+
+def _summary_row(r, by_subject=False):
+	row = {
+		'student_id': r['student_id'],
+		'roll_no': r['roll_no'],
+		'name': r['name'],
+		'class': r['class'],
+		'total': r['total'],
+		'attended': r['attended'],
+		'percent': percent(r['attended'], r['total']),
+	}
+	if by_subject:
+		row['subject'] = r['subject']
+	return row
+
+
+def _bitmap_summary(db, class_name=None, subject=None, start=None, end=None, search=None,
+					attendance_class=None, by_subject=False, marked_only=False, student_id=None,
+					source=None, below=None):
+	"""``iter_summary`` rows from the lecture bitmaps, in roll (and subject) order."""
+	where, params = _roster_filters(class_name, search, student_id)
+	totals = lectures.student_totals(db, attendance_class, subject, start, end, by_subject)
+	by_student = {}
+	if by_subject:
+		for (sid, name), counts in sorted(totals.items(), key=lambda item: item[0][1]):
+			by_student.setdefault(sid, []).append((name,) + counts)
+	sql = 'SELECT s.student_id, s.roll_no, s.name, s.class FROM students s'
+	sql += (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY s.roll_no'
+	for r in db.execute(sql, params):
+		sid = r['student_id']
+		counts = by_student.get(sid, []) if by_subject else [(None,) + totals.get(sid, (0, 0))]
+		for name, attended, total in counts:
+			if marked_only and not total:
+				continue
+			# same rounding as the SQL HAVING clause
+			if below is not None and total and round(attended * 100.0 / total, 2) >= below:
+				continue
+			yield _summary_row({**r, 'subject': name, 'total': total, 'attended': attended}, by_subject)
+
+
+def iter_summary(db, class_name=None, subject=None, start=None, end=None, search=None,
+				 attendance_class=None, by_subject=False, marked_only=False, student_id=None,
+				 source=None, below=None):
+	"""Per-student attended/total counts for the given filters, streamed from the cursor.
+
+	``class_name`` and ``search`` filter the roster; ``attendance_class``,
+	``subject`` and the ``start``/``end`` dates filter the attendance that is
+	counted. With ``by_subject`` there is one row per (student, subject).
+	``marked_only`` drops students with no attendance in range; ``below``
+	keeps only students under that percentage (defaulters).
+	"""
+	args = (class_name, subject, start, end, search, attendance_class, by_subject, marked_only, student_id, source, below)
+	archives = archive.attach(db, start, end)
+	if not archives and (source or REPORT_SOURCE) == 'bitmaps':
+		yield from _bitmap_summary(db, *args)
+		return
+	sql, params = _summary_select(*args, archives=archives)
+	sql += ' ORDER BY s.roll_no' + (', subject' if by_subject else '')
+	for r in db.execute(sql, params):
+		yield _summary_row(r, by_subject)
+
+
+def attendance_summary(db, *args, **kwargs):
+	"""``iter_summary`` as a list."""
+	return list(iter_summary(db, *args, **kwargs))
+
+
+# Keyset pagination: a page starts after the last row of the previous one, so
+# deep pages cost the same as the first. Percent order is ``attended/total``
+# (never-marked students at 0) with roll_no breaking ties.
+SORTS = ('roll', '-roll', 'percent', '-percent')
+RATIO = 'CASE WHEN total > 0 THEN attended * 1.0 / total ELSE 0.0 END'
+
+
+def encode_cursor(sort, row):
+	if sort.lstrip('-') == 'roll':
+		return row['roll_no']
+	ratio = row['attended'] / row['total'] if row['total'] else 0.0
+	return f'{ratio!r}~{row["roll_no"]}'
+
+
+def decode_cursor(sort, token):
+	"""Cursor values for ``sort``, or None (first page) for a missing or bad token."""
+	if not token:
+		return None
+	if sort.lstrip('-') == 'roll':
+		return (token,)
+	ratio, sep, roll = token.partition('~')
+	try:
+		return (float(ratio), roll) if sep else None
+	except ValueError:
+		return None
+
+
+def summary_page(db, sort='roll', after=None, limit=100, **filters):
+	"""(rows, next_cursor) for one page of ``iter_summary(**filters)`` in ``sort`` order.
+
+	``after`` is the cursor returned with the previous page; ``next_cursor`` is
+	None on the last page.
+	"""
+	if sort not in SORTS:
+		sort = 'roll'
+	descending = sort.startswith('-')
+	op, direction = ('<', ' DESC') if descending else ('>', '')
+	cursor = decode_cursor(sort, after)
+	archives = archive.attach(db, filters.get('start'), filters.get('end'))
+	if not archives and (filters.get('source') or REPORT_SOURCE) == 'bitmaps':
+		return _bitmap_page(db, sort, cursor, limit, filters)
+	if sort.lstrip('-') == 'roll':
+		sql, params = _summary_select(extra_where=f's.roll_no {op} :after_roll' if cursor else None, archives=archives, **filters)
+		sql += f' ORDER BY s.roll_no{direction} LIMIT :limit'
+		if cursor:
+			params['after_roll'] = cursor[0]
+	else:
+		inner, params = _summary_select(archives=archives, **filters)
+		sql = f'SELECT * FROM ({inner})'
+		if cursor:
+			sql += f' WHERE ({RATIO}, roll_no) {op} (:after_ratio, :after_roll)'
+			params['after_ratio'], params['after_roll'] = cursor
+		sql += f' ORDER BY {RATIO}{direction}, roll_no{direction} LIMIT :limit'
+	params['limit'] = limit + 1
+	rows = [_summary_row(r) for r in db.execute(sql, params)]
+	next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+	return rows[:limit], next_cursor
+
+
+def _bitmap_page(db, sort, cursor, limit, filters):
+	# the whole summary is computed anyway; sort and cut it here
+	descending = sort.startswith('-')
+	if sort.lstrip('-') == 'roll':
+		def key(row):
+			return (row['roll_no'],)
+	else:
+		def key(row):
+			return (row['attended'] / row['total'] if row['total'] else 0.0, row['roll_no'])
+	rows = sorted(_bitmap_summary(db, **filters), key=key, reverse=descending)
+	if cursor:
+		rows = [row for row in rows if (key(row) < cursor if descending else key(row) > cursor)]
+	next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+	return rows[:limit], next_cursor
+
+
+def subject_totals(db, student_id, start, end, source=None):
+	"""{subject: (attended, total)} for one student over a date range."""
+	archives = archive.attach(db, start, end)
+	if not archives and (source or REPORT_SOURCE) != 'rows':
+		return rollups.subject_totals(db, student_id, start, end)
+	where = 'a.student_id = :student_id AND a.day BETWEEN :start_day AND :end_day'
+	marks = archive.marks_sql(archives, where) if archives else 'attendance_marks'
+	rows = db.execute(
+		'SELECT sub.name AS subject, COUNT(*) AS total, SUM(a.present) AS attended'
+		f' FROM {marks} a JOIN subjects sub ON sub.subject_id = a.subject_id WHERE {where} GROUP BY sub.name',
+		{'student_id': student_id, 'start_day': compact.day_or(start, compact.FIRST_DAY),
+		 'end_day': compact.day_or(end, compact.LAST_DAY)}).fetchall()
+	return {r['subject']: (r['attended'], r['total']) for r in rows}
+
+
+def student_marks(db, student_id, start, end):
+	"""One student's marks over a date range, latest first: rows of date, subject and status."""
+	archives = archive.attach(db, start, end)
+	where = 'a.student_id = :student_id AND a.day BETWEEN :start_day AND :end_day'
+	marks = archive.marks_sql(archives, where) if archives else 'attendance_marks'
+	return db.execute(
+		f"SELECT {compact.date_sql('a.day')} AS date, sub.name AS subject,"
+		" CASE a.present WHEN 1 THEN 'Present' ELSE 'Absent' END AS status"
+		f' FROM {marks} a JOIN subjects sub ON sub.subject_id = a.subject_id WHERE {where} ORDER BY a.day DESC, a.subject_id DESC',
+		{'student_id': student_id, 'start_day': compact.day_or(start, compact.FIRST_DAY),
+		 'end_day': compact.day_or(end, compact.LAST_DAY)}).fetchall()
+
+
+def _register_row(row):
+	row['percent'] = percent(row['attended'], row['total'])
+	return row
+
+
+def register(db, class_name, subject, start=None, end=None):
+	"""(dates, rows) of the paper register: the class roster x every lecture date of ``subject``.
+
+	``rows`` is a generator over one ordered query (roster joined with its
+	marks), one dict per student in roll order with ``marks`` holding 'P',
+	'A' or '' (not marked) per date.
+	"""
+	params = {'class_name': class_name, 'subject': subject,
+			  'start_day': compact.day_or(start, compact.FIRST_DAY), 'end_day': compact.day_or(end, compact.LAST_DAY)}
+	lecture = (f"m.class_id = {compact.class_id_sql(':class_name')} AND m.subject_id = {compact.subject_id_sql(':subject')}"
+			   ' AND m.day BETWEEN :start_day AND :end_day')
+	archives = archive.attach(db, start, end)
+	if archives:
+		marks = archive.marks_sql(archives, lecture, 'm')
+		roster = archive.students_sql(archives, ['s.class = :class_name'], ['s.class = :class_name'])
+		order = 's.roll_no, s.student_id, m.day'
+	else:
+		marks, roster, order = 'attendance_marks', 'students', 's.roll_no, m.day'
+	days = [r[0] for r in db.execute(f'SELECT DISTINCT m.day FROM {marks} m WHERE {lecture} ORDER BY m.day', params)]
+	columns = {day: n for n, day in enumerate(days)}
+
+	def rows():
+		cursor = db.execute(
+			f'SELECT s.student_id, s.roll_no, s.prn, s.name, m.day, m.present FROM {roster} s'
+			f' LEFT JOIN {marks} m ON m.student_id = s.student_id AND {lecture}'
+			f' WHERE s.class = :class_name ORDER BY {order}', params)
+		row = None
+		for sid, roll_no, prn, name, day, present in cursor:
+			if row is None or row['student_id'] != sid:
+				if row is not None:
+					yield _register_row(row)
+				row = {'student_id': sid, 'roll_no': roll_no, 'prn': prn, 'name': name,
+					   'marks': [''] * len(days), 'attended': 0, 'total': 0}
+			if day is not None:
+				row['marks'][columns[day]] = 'P' if present else 'A'
+				row['attended'] += present
+				row['total'] += 1
+		if row is not None:
+			yield _register_row(row)
+
+	return [compact.day_date(day) for day in days], rows()
@@ -0,0 +1,161 @@
+"""
+Cumulative attendance counters (prefix sums).
+
+``attendance_rollup`` holds, for each (student, class, subject, day) that has
+ever been marked, the number of Present and total lectures up to and
+including that day. Triggers on ``attendance_marks`` (on the old
+``attendance`` table before migration 11) keep it in step with every insert,
+status change and delete (including cascades), inside the same transaction
+as the write. The percentage over any ``[start, end]`` is then the
+counter at ``end`` minus the counter before ``start``: two index lookups per
+(student, class, subject) instead of a scan of the raw rows.
+
+``attendance_rollup_keys`` lists which (student, class, subject) series exist,
+so reports can enumerate them without walking every day.
+"""
+
+import compact
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS attendance_rollup (
+	student_id INTEGER NOT NULL,
+	class TEXT NOT NULL,
+	subject TEXT NOT NULL,
+	day TEXT NOT NULL,
+	present_cum INTEGER NOT NULL,
+	total_cum INTEGER NOT NULL,
+	PRIMARY KEY (student_id, class, subject, day),
+	FOREIGN KEY(student_id) REFERENCES students(student_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS attendance_rollup_keys (
+	student_id INTEGER NOT NULL,
+	class TEXT NOT NULL,
+	subject TEXT NOT NULL,
+	PRIMARY KEY (student_id, class, subject),
+	FOREIGN KEY(student_id) REFERENCES students(student_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+'''
+
+
+def _row_columns(ref):
+	"""Rollup key and Present flag of an old-style ``attendance`` row."""
+	return {'student_id': f'{ref}.student_id', 'class': f'{ref}.class', 'subject': f'{ref}.subject',
+			'date': f'{ref}.date', 'present': f"({ref}.status = 'Present')"}
+
+
+def _mark_columns(ref):
+	"""The same for an ``attendance_marks`` row, names and date decoded."""
+	return {'student_id': f'{ref}.student_id',
+			'class': f'(SELECT name FROM classes WHERE class_id = {ref}.class_id)',
+			'subject': f'(SELECT name FROM subjects WHERE subject_id = {ref}.subject_id)',
+			'date': compact.date_sql(f'{ref}.day'), 'present': f'{ref}.present'}
+
+
+def _bump(c, sign):
+	# shift the counters of the row's date and every later day by its contribution
+	return f'''
+	UPDATE attendance_rollup
+		SET present_cum = present_cum {sign} {c['present']}, total_cum = total_cum {sign} 1
+		WHERE student_id = {c['student_id']} AND class = {c['class']} AND subject = {c['subject']} AND day >= {c['date']};'''
+
+
+def _open(c):
+	# make sure the row's date has a counter row, carrying the previous
+	# cumulative values; removals never need this since the row was opened on
+	# insert. NOT EXISTS rather than OR IGNORE: an outer statement's conflict
+	# clause (e.g. an upsert) overrides the one written inside a trigger.
+	series = f"student_id = {c['student_id']} AND class = {c['class']} AND subject = {c['subject']}"
+	return f'''
+	INSERT INTO attendance_rollup_keys (student_id, class, subject)
+		SELECT {c['student_id']}, {c['class']}, {c['subject']}
+		WHERE NOT EXISTS (SELECT 1 FROM attendance_rollup_keys WHERE {series});
+	INSERT INTO attendance_rollup (student_id, class, subject, day, present_cum, total_cum)
+		SELECT {c['student_id']}, {c['class']}, {c['subject']}, {c['date']},
+			COALESCE((SELECT present_cum FROM attendance_rollup WHERE {series} AND day < {c['date']} ORDER BY day DESC LIMIT 1), 0),
+			COALESCE((SELECT total_cum FROM attendance_rollup WHERE {series} AND day < {c['date']} ORDER BY day DESC LIMIT 1), 0)
+		WHERE NOT EXISTS (SELECT 1 FROM attendance_rollup WHERE {series} AND day = {c['date']});'''
+
+
+def _triggers(table, columns, update_of):
+	new, old = columns('NEW'), columns('OLD')
+	return f'''
+CREATE TRIGGER IF NOT EXISTS {table}_rollup_ai AFTER INSERT ON {table} BEGIN{_open(new)}{_bump(new, '+')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table}_rollup_ad AFTER DELETE ON {table} BEGIN{_bump(old, '-')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table}_rollup_au AFTER UPDATE OF {update_of} ON {table} BEGIN{_bump(old, '-')}{_open(new)}{_bump(new, '+')}
+END;
+'''
+
+
+# on the old attendance table (migrations 3 and 4)
+TRIGGERS = _triggers('attendance', _row_columns, 'student_id, class, subject, date, status')
+# on attendance_marks, from migration 11
+MARK_TRIGGERS = _triggers('attendance_marks', _mark_columns, 'student_id, class_id, subject_id, day, present')
+
+# cumulative counters recomputed from the raw rows
+EXPECTED = '''
+SELECT student_id, class, subject, date AS day,
+	SUM(SUM(status = 'Present')) OVER w AS present_cum,
+	SUM(COUNT(*)) OVER w AS total_cum
+FROM attendance
+GROUP BY student_id, class, subject, date
+WINDOW w AS (PARTITION BY student_id, class, subject ORDER BY date)
+'''
+
+
+def _lookup(column, op, bound):
+	return (f'(SELECT r.{column} FROM attendance_rollup r WHERE r.student_id = k.student_id AND r.class = k.class'
+			f' AND r.subject = k.subject AND r.day {op} {bound} ORDER BY r.day DESC LIMIT 1)')
+
+
+def span_sql(start, end):
+	"""Columns (attended, total) for series ``k`` between two bound parameters."""
+	attended = f"COALESCE({_lookup('present_cum', '<=', end)}, 0) - COALESCE({_lookup('present_cum', '<', start)}, 0)"
+	total = f"COALESCE({_lookup('total_cum', '<=', end)}, 0) - COALESCE({_lookup('total_cum', '<', start)}, 0)"
+	return attended, total
+
+
+def subject_totals(db, student_id, start, end):
+	"""{subject: (attended, total)} for one student, summed over classes."""
+	attended, total = span_sql(':start', ':end')
+	rows = db.execute(
+		f'SELECT k.subject, SUM({attended}) AS attended, SUM({total}) AS total'
+		' FROM attendance_rollup_keys k WHERE k.student_id = :student GROUP BY k.subject',
+		{'student': student_id, 'start': start, 'end': end}).fetchall()
+	return {r['subject']: (r['attended'], r['total']) for r in rows if r['total']}
+
+
+def rebuild(db):
+	"""Regenerate both rollup tables from raw attendance. Caller commits."""
+	db.execute('DELETE FROM attendance_rollup')
+	db.execute('DELETE FROM attendance_rollup_keys')
+	db.execute('INSERT INTO attendance_rollup (student_id, class, subject, day, present_cum, total_cum) ' + EXPECTED)
+	db.execute('INSERT INTO attendance_rollup_keys (student_id, class, subject) SELECT DISTINCT student_id, class, subject FROM attendance')
+
+
+def verify(db):
+	"""Number of counter points and series that disagree with raw attendance."""
+	bad_points = db.execute(
+		'SELECT COUNT(*) FROM (' + EXPECTED + ') e WHERE NOT EXISTS ('
+		' SELECT 1 FROM (SELECT present_cum, total_cum FROM attendance_rollup r'
+		'  WHERE r.student_id = e.student_id AND r.class = e.class AND r.subject = e.subject AND r.day <= e.day'
+		'  ORDER BY r.day DESC LIMIT 1) x'
+		' WHERE x.present_cum = e.present_cum AND x.total_cum = e.total_cum)'
+	).fetchone()[0]
+	missing_keys = db.execute(
+		'SELECT COUNT(*) FROM (SELECT DISTINCT student_id, class, subject FROM attendance) a'
+		' WHERE NOT EXISTS (SELECT 1 FROM attendance_rollup_keys k'
+		'  WHERE k.student_id = a.student_id AND k.class = a.class AND k.subject = a.subject)'
+	).fetchone()[0]
+	# the latest counters of every series must equal its raw totals
+	raw = 'SELECT COUNT(*) FROM attendance a WHERE a.student_id = k.student_id AND a.subject = k.subject AND a.class = k.class'
+	bad_series = db.execute(
+		'SELECT COUNT(*) FROM attendance_rollup_keys k'
+		f" WHERE COALESCE({_lookup('total_cum', '<=', ':latest')}, 0) IS NOT ({raw})"
+		f" OR COALESCE({_lookup('present_cum', '<=', ':latest')}, 0) IS NOT ({raw} AND a.status = 'Present')",
+		{'latest': '9999-12-31'}).fetchone()[0]
+	return bad_points + missing_keys + bad_series
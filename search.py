@@ -0,0 +1,80 @@
+"""
+Substring search over students.
+
+``students_fts`` is an external-content FTS5 table with the trigram
+tokenizer over roll number, PRN and name, kept in step with ``students`` by
+triggers. A trigram phrase query finds any case-insensitive substring of at
+least three characters through the index; shorter terms cannot be answered
+from trigrams and fall back to ``LIKE``.
+"""
+
+MIN_LENGTH = 3
+TYPEAHEAD_LIMIT = 10
+
+TABLES = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+	roll_no, prn, name,
+	content='students', content_rowid='student_id', tokenize='trigram'
+);
+'''
+
+TRIGGERS = '''
+CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN
+	INSERT INTO students_fts (rowid, roll_no, prn, name) VALUES (NEW.student_id, NEW.roll_no, NEW.prn, NEW.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN
+	INSERT INTO students_fts (students_fts, rowid, roll_no, prn, name) VALUES ('delete', OLD.student_id, OLD.roll_no, OLD.prn, OLD.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF student_id, roll_no, prn, name ON students BEGIN
+	INSERT INTO students_fts (students_fts, rowid, roll_no, prn, name) VALUES ('delete', OLD.student_id, OLD.roll_no, OLD.prn, OLD.name);
+	INSERT INTO students_fts (rowid, roll_no, prn, name) VALUES (NEW.student_id, NEW.roll_no, NEW.prn, NEW.name);
+END;
+'''
+
+
+def rebuild(db):
+	db.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+def phrase(term):
+	"""``term`` as a quoted FTS5 phrase, matched literally."""
+	return '"' + term.replace('"', '""') + '"'
+
+
+def student_filter(term, alias='s'):
+	"""(sql condition, params) matching ``term`` anywhere in roll number, PRN or name."""
+	term = term.strip()
+	if len(term) >= MIN_LENGTH:
+		return (f'{alias}.student_id IN (SELECT rowid FROM students_fts WHERE students_fts MATCH :search)',
+				{'search': phrase(term)})
+	return like_filter(term, alias)
+
+
+def like_filter(term, alias='s', param='search'):
+	"""``student_filter`` without the full-text index, for archived rosters."""
+	term = term.strip()
+	return (f'({alias}.roll_no LIKE :{param} OR {alias}.prn LIKE :{param} OR {alias}.name LIKE :{param})',
+			{param: f'%{term}%'})
+
+
+def typeahead(db, term, limit=TYPEAHEAD_LIMIT):
+	"""Up to ``limit`` students for a search box: roll-number prefix matches, then
+	other substring matches in roster order. Neither step sorts the full match set.
+	"""
+	term = (term or '').strip()
+	if not term:
+		return []
+	rows = db.execute(
+		'SELECT roll_no, prn, name, class FROM students'
+		' WHERE roll_no >= :term AND roll_no < :term || char(1114111) ORDER BY roll_no LIMIT :limit',
+		{'term': term, 'limit': limit}).fetchall()
+	if len(rows) < limit and len(term) >= MIN_LENGTH:
+		seen = {r['roll_no'] for r in rows}
+		rows += [r for r in db.execute(
+			'SELECT roll_no, prn, name, class FROM students WHERE student_id IN'
+			' (SELECT rowid FROM students_fts WHERE students_fts MATCH :search LIMIT :limit)'
+			' ORDER BY student_id',
+			{'search': phrase(term), 'limit': limit + len(rows)}) if r['roll_no'] not in seen][:limit - len(rows)]
+	return [dict(r) for r in rows]
@@ -0,0 +1,168 @@
+/*
+ * Offline queue for the attendance form.
+ *
+ * Saving a lecture adds only the students whose status changed to a queue in
+ * localStorage and returns at once. The queue is sent to the batch endpoint
+ * in the background, at most data-max-lectures lectures per batch (the
+ * server's MAX_BATCH_LECTURES), and retried while offline. A batch keeps its
+ * id until the server answers, so a retry after a lost response is
+ * recognised and not applied twice. A batch the server rejects as a whole
+ * goes back to the queue. Only the lectures it reports as failed are dropped.
+ */
+(function () {
+	const form = document.getElementById('markForm');
+	if (!form || !window.fetch || !window.localStorage || !window.JSON) {
+		return;
+	}
+	const endpoint = form.dataset.batchUrl;
+	const maxLectures = parseInt(form.dataset.maxLectures, 10) || 100;
+	const prefix = 'attendanceQueue:' + form.dataset.teacher + ':';
+	const statusEl = document.getElementById('syncStatus');
+	let syncing = false;
+
+	function load(name) {
+		try {
+			return JSON.parse(localStorage.getItem(prefix + name));
+		} catch (e) {
+			return null;
+		}
+	}
+
+	function store(name, value) {
+		if (value === null) {
+			localStorage.removeItem(prefix + name);
+		} else {
+			localStorage.setItem(prefix + name, JSON.stringify(value));
+		}
+	}
+
+	function newBatchId() {
+		if (window.crypto && crypto.randomUUID) {
+			return crypto.randomUUID();
+		}
+		return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+	}
+
+	function waiting() {
+		const pending = load('pending');
+		return (load('queue') || []).length + (pending ? pending.lectures.length : 0);
+	}
+
+	function show(message, isError) {
+		if (!statusEl) {
+			return;
+		}
+		const count = waiting();
+		statusEl.textContent = message || (count ? count + ' lecture(s) waiting to sync' : 'All attendance synced');
+		statusEl.className = 'sync-status ' + (isError ? 'text-danger' : count ? 'text-warning' : 'text-success');
+	}
+
+	function rows() {
+		return Array.prototype.slice.call(form.querySelectorAll('tr[data-student]'));
+	}
+
+	function current(row) {
+		const checked = row.querySelector('input[type=radio]:checked');
+		return checked ? checked.value : 'Absent';
+	}
+
+	function lectureFromForm() {
+		const lecture = {class: form.dataset.cls, subject: form.dataset.subject, date: form.elements.date.value};
+		if (form.elements.mark_all && form.elements.mark_all.checked) {
+			lecture.mark_all = true;
+			return lecture;
+		}
+		lecture.statuses = {};
+		rows().forEach(function (row) {
+			const initial = row.dataset.initial;
+			const status = current(row);
+			if (!initial) {
+				// never saved: the server fills these in as Absent
+				lecture.fill_absent = true;
+			}
+			if (status !== (initial || 'Absent')) {
+				lecture.statuses[row.dataset.student] = status;
+			}
+		});
+		return lecture;
+	}
+
+	function markSaved(lecture) {
+		rows().forEach(function (row) {
+			if (lecture.mark_all) {
+				row.querySelector('input[value=Present]').checked = true;
+			}
+			row.dataset.initial = current(row);
+		});
+		if (form.elements.mark_all) {
+			form.elements.mark_all.checked = false;
+		}
+	}
+
+	function sync() {
+		if (syncing) {
+			return;
+		}
+		let pending = load('pending');
+		if (!pending) {
+			const queue = load('queue') || [];
+			if (!queue.length) {
+				show();
+				return;
+			}
+			pending = {batch_id: newBatchId(), lectures: queue.slice(0, maxLectures)};
+			store('pending', pending);
+			store('queue', queue.length > maxLectures ? queue.slice(maxLectures) : null);
+		}
+		syncing = true;
+		show('Syncing ' + pending.lectures.length + ' lecture(s)...');
+		fetch(endpoint, {
+			method: 'POST',
+			credentials: 'same-origin',
+			headers: {'Content-Type': 'application/json', 'Accept': 'application/json'},
+			body: JSON.stringify(pending)
+		}).then(function (response) {
+			if (!response.ok && response.status !== 400) {
+				throw new Error('HTTP ' + response.status);
+			}
+			return response.json();
+		}).then(function (data) {
+			syncing = false;
+			if (data.error) {
+				// rejected before anything was applied: keep every lecture for the next try
+				store('queue', pending.lectures.concat(load('queue') || []));
+				store('pending', null);
+				show('Not synced: ' + data.error + ' - ' + waiting() + ' lecture(s) kept', true);
+				return;
+			}
+			// applied: the lectures that failed are reported and dropped, the rest are saved
+			store('pending', null);
+			const failed = (data.results || []).filter(function (r) { return !r.ok; });
+			if (failed.length) {
+				show('Not saved: ' + failed.map(function (r) {
+					return r.class + ' ' + r.subject + ' ' + r.date + ' (' + r.error + ')';
+				}).join('; '), true);
+				return;
+			}
+			show();
+			sync();
+		}).catch(function () {
+			syncing = false;
+			show('Offline - ' + waiting() + ' lecture(s) will sync when the connection returns', true);
+		});
+	}
+
+	form.addEventListener('submit', function (event) {
+		event.preventDefault();
+		const lecture = lectureFromForm();
+		const queue = load('queue') || [];
+		queue.push(lecture);
+		store('queue', queue);
+		markSaved(lecture);
+		sync();
+	});
+
+	window.addEventListener('online', sync);
+	setInterval(sync, 15000);
+	sync();
+})();
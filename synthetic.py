@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Synthetic attendance databases for benchmarking.
+
+Builds a fully migrated database of a chosen size: ``classes`` classes of
+``students`` students, ``subjects`` subjects per class (one teacher each) and
+``days`` teaching days (weekdays) of lectures. Every student gets their own
+attendance rate, drawn so that most sit around ``present`` and a tail falls
+below the 75% defaulter line; each lecture is then Present or Absent at that
+rate. The same seed always gives the same database.
+
+All synthetic accounts share known passwords: ``TEACHER_PASSWORD`` for
+teachers, ``ADMIN_PASSWORD`` for ``ADMIN_EMAIL`` and the default student
+password for students.
+
+Usage:
+	python synthetic.py out.db [--classes 4] [--students 60] [--subjects 5] [--days 90]
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+import compact
+import database
+import imports
+import lectures as lecture_store
+import migrations
+import passwords
+import timing
+
+FIRST = ('Aarav', 'Vivaan', 'Aditya', 'Sai', 'Arjun', 'Ishaan', 'Ananya', 'Diya', 'Priya', 'Kavya', 'Rohan', 'Sneha')
+LAST = ('Patil', 'Sharma', 'Deshmukh', 'Kulkarni', 'Joshi', 'Pawar', 'Shinde', 'Jadhav', 'Chavan', 'Gaikwad', 'More', 'Kale')
+SUBJECTS = ('DSA', 'DBMS', 'OS', 'CN', 'SE', 'AI', 'ML', 'WT', 'JAVA', 'PYTHON', 'CLOUD', 'IOT')
+
+TEACHER_PASSWORD = 'Teacher@123'
+ADMIN_EMAIL = 'admin@example.com'
+ADMIN_PASSWORD = 'Admin@123'
+
+
+def class_names(classes):
+	return [f'MCA-{c // 2 + 1}{"AB"[c % 2]}' if classes <= 8 else f'CLS-{c + 1:03d}' for c in range(classes)]
+
+
+def teaching_days(start, days):
+	"""The first ``days`` weekdays from ``start`` (ISO strings)."""
+	out = []
+	day = date.fromisoformat(start)
+	while len(out) < days:
+		if day.weekday() < 5:
+			out.append(day.isoformat())
+		day += timedelta(days=1)
+	return out
+
+
+def generate(path, classes=4, students=60, subjects=5, days=90, lectures=None, present=0.82,
+			 start='2025-01-06', seed=1, schema=None):
+	"""Create ``path`` (which must not exist) and fill it; returns row counts per table.
+
+	``lectures`` is the number of lectures per class per day (default: every
+	subject once a day, at most four). Subjects rotate through the days.
+	``schema`` stops the migrations at that version (default: the latest).
+	"""
+	if os.path.exists(path):
+		raise FileExistsError(path)
+	rng = random.Random(seed)
+	names = class_names(classes)
+	subject_names = [SUBJECTS[s] if s < len(SUBJECTS) else f'SUB{s + 1}' for s in range(subjects)]
+	lectures = min(subjects, lectures or 4)
+	db = database.connect(path)
+	migrations.migrate(db, schema)
+	with database.transaction(db):
+		db.execute('INSERT INTO admins (name, email, password_hash) VALUES (?,?,?)',
+				   ('Admin', ADMIN_EMAIL, passwords.hash_password(ADMIN_PASSWORD)))
+		teacher_hash = passwords.hash_password(TEACHER_PASSWORD)
+		db.executemany('INSERT INTO teachers (name, phone, password_hash) VALUES (?,?,?)',
+					   [(f'Prof. {LAST[t % 12]} {subject}', f'9{t:09d}', teacher_hash) for t, subject in enumerate(subject_names)])
+		teachers = {r['name'].rsplit(' ', 1)[1]: r['teacher_id'] for r in db.execute('SELECT teacher_id, name FROM teachers')}
+		db.executemany('INSERT INTO teacher_assignments (teacher_id, subject, class) VALUES (?,?,?)',
+					   [(teachers[subject], subject, cls) for cls in names for subject in subject_names])
+		student_hash = passwords.hash_password(imports.DEFAULT_STUDENT_PASSWORD)
+		db.executemany('INSERT INTO students (roll_no, prn, name, class, semester, password_hash) VALUES (?,?,?,?,?,?)',
+					   [(f'{c + 1:02d}{i + 1:04d}', f'72{c:03d}{i:05d}', f'{FIRST[rng.randrange(12)]} {LAST[rng.randrange(12)]}',
+						 cls, 2, student_hash)
+						for c, cls in enumerate(names) for i in range(students)])
+		roster = {}
+		rates = {}
+		for r in db.execute('SELECT student_id, class FROM students ORDER BY student_id'):
+			roster.setdefault(r['class'], []).append(r['student_id'])
+			# mostly near ``present``, with a long tail of defaulters
+			rates[r['student_id']] = min(1.0, max(0.0, rng.betavariate(present * 8, (1 - present) * 8)))
+		insert = 'INSERT INTO attendance (student_id, teacher_id, subject, class, date, status) VALUES (?,?,?,?,?,?)'
+		for d, day in enumerate(teaching_days(start, days)):
+			for cls in names:
+				for n in range(lectures):
+					subject = subject_names[(d * lectures + n) % subjects]
+					db.executemany(insert, [(sid, teachers[subject], subject, cls, day,
+											 'Present' if rng.random() < rates[sid] else 'Absent')
+											for sid in roster[cls]])
+		if compact.is_table(db, 'lecture_bitmaps'):
+			# slots in roll order, as migration 12 assigns them
+			lecture_store.rebuild(db)
+	counts = {table: db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+			  for table in ('students', 'teachers', 'teacher_assignments', 'attendance')}
+	db.execute('PRAGMA optimize')
+	db.close()
+	return counts
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('path')
+	parser.add_argument('--classes', type=int, default=4)
+	parser.add_argument('--students', type=int, default=60, help='per class')
+	parser.add_argument('--subjects', type=int, default=5)
+	parser.add_argument('--days', type=int, default=90, help='teaching days (weekdays)')
+	parser.add_argument('--lectures', type=int, default=None, help='lectures per class per day (default 4)')
+	parser.add_argument('--present', type=float, default=0.82, help='mean attendance rate')
+	parser.add_argument('--start', default='2025-01-06')
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args()
+	timing.SLOW_QUERY = float('inf')
+	try:
+		counts = generate(args.path, args.classes, args.students, args.subjects, args.days, args.lectures,
+						  args.present, args.start, args.seed)
+	except FileExistsError:
+		print(f'{args.path} already exists', file=sys.stderr)
+		return 1
+	print(', '.join(f'{n} {table}' for table, n in counts.items()))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Per-request timing and the slow-query log.
+
+With ``REQUEST_TIMING`` on (the default), connections are opened as
+``TimedConnection``. Its cursors charge the time spent executing and fetching
+each statement to the current thread's ``Timings``. Streamed results are
+fetched in batches, so the per-row cost stays negligible.
+
+Every response gets a ``Server-Timing`` header that splits the request into
+db, render (Jinja) and app time. A PDF download also reports the pdf and db
+time of the export job that rendered it. A streamed response's header is sent
+before its body, so it covers only the time up to the first byte.
+
+A statement that takes longer than ``SLOW_QUERY_MS`` (250; 0 turns the log
+off) is logged with its EXPLAIN QUERY PLAN.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from time import perf_counter
+
+ENABLED = os.environ.get('REQUEST_TIMING', '1').lower() not in ('0', 'off', 'false', 'no')
+SLOW_QUERY = float(os.environ.get('SLOW_QUERY_MS', '250')) / 1000 or float('inf')
+# rows fetched per timed step while a cursor is iterated
+ITER_BATCH = 256
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Timings:
+	"""Time spent so far by one request (or background job) on this thread."""
+
+	def __init__(self, label=None):
+		self.label = label
+		self.started = perf_counter()
+		self.db = 0.0
+		self.queries = 0
+		self.render = 0.0
+		self.render_started = None
+		self.extra = {}
+		self.pending = []
+
+	def header(self):
+		"""The ``Server-Timing`` value for what has been measured so far."""
+		total = perf_counter() - self.started
+		parts = [f'db;dur={self.db * 1e3:.1f};desc="{self.queries} stmt"', f'render;dur={self.render * 1e3:.1f}']
+		parts += [f'{name};dur={seconds * 1e3:.1f}' for name, seconds in self.extra.items()]
+		parts.append(f'app;dur={max(total - self.db - self.render, 0) * 1e3:.1f}')
+		parts.append(f'total;dur={total * 1e3:.1f}')
+		return ', '.join(parts)
+
+
+def start(label=None):
+	_local.timings = Timings(label)
+	return _local.timings
+
+
+def current():
+	return getattr(_local, 'timings', None)
+
+
+def stop():
+	"""End the current measurement; slow statements still open are logged now."""
+	timings = getattr(_local, 'timings', None)
+	if timings is not None:
+		for cursor in timings.pending:
+			cursor._finish()
+	_local.timings = None
+	return timings
+
+
+def note(name, seconds):
+	"""Add a named entry (e.g. ``pdf``) to the current request's Server-Timing."""
+	timings = current()
+	if timings is not None:
+		timings.extra[name] = timings.extra.get(name, 0.0) + seconds
+
+
+def log_slow(db, sql, params, seconds, label=None):
+	try:
+		plan = sqlite3.Connection.execute(db, 'EXPLAIN QUERY PLAN ' + sql, params or ()).fetchall()
+		plan = '\n'.join('    ' + row[3] for row in plan)
+	except (sqlite3.Error, ValueError):
+		plan = '    (no plan)'
+	log.warning('slow query: %.0f ms%s\n  %s\n%s', seconds * 1e3, f' in {label}' if label else '', ' '.join(sql.split()), plan)
+
+
+class TimedCursor(sqlite3.Cursor):
+	# iteration reads ITER_BATCH rows ahead: finish a loop before calling fetch*()
+	_sql = None
+	_params = None
+	_spent = 0.0
+
+	def _charge(self, elapsed, done):
+		self._spent += elapsed
+		timings = getattr(_local, 'timings', None)
+		if timings is not None:
+			timings.db += elapsed
+		if done:
+			self._finish()
+		elif self._spent >= SLOW_QUERY and timings is not None and self not in timings.pending:
+			# still being fetched: log it once the request is over at the latest
+			timings.pending.append(self)
+
+	def _finish(self):
+		if self._sql is not None and self._spent >= SLOW_QUERY:
+			timings = current()
+			log_slow(self.connection, self._sql, self._params, self._spent, timings.label if timings else None)
+		self._sql = self._params = None
+
+	def _begin(self, sql, params):
+		self._finish()
+		self._sql, self._params, self._spent = sql, params, 0.0
+		timings = getattr(_local, 'timings', None)
+		if timings is not None:
+			timings.queries += 1
+
+	def execute(self, sql, parameters=()):
+		self._begin(sql, parameters)
+		started = perf_counter()
+		try:
+			return super().execute(sql, parameters)
+		finally:
+			self._charge(perf_counter() - started, self.description is None)
+
+	def executemany(self, sql, seq_of_parameters):
+		# the plan is the same for every row; EXPLAIN it with unbound parameters
+		self._begin(sql, None)
+		started = perf_counter()
+		try:
+			return super().executemany(sql, seq_of_parameters)
+		finally:
+			self._charge(perf_counter() - started, True)
+
+	def executescript(self, sql_script):
+		self._begin(sql_script, None)
+		started = perf_counter()
+		try:
+			return super().executescript(sql_script)
+		finally:
+			self._sql = None
+			self._charge(perf_counter() - started, True)
+
+	def fetchone(self):
+		started = perf_counter()
+		row = super().fetchone()
+		self._charge(perf_counter() - started, row is None)
+		return row
+
+	def fetchmany(self, size=None):
+		size = self.arraysize if size is None else size
+		started = perf_counter()
+		rows = super().fetchmany(size)
+		self._charge(perf_counter() - started, len(rows) < size)
+		return rows
+
+	def fetchall(self):
+		started = perf_counter()
+		rows = super().fetchall()
+		self._charge(perf_counter() - started, True)
+		return rows
+
+	def __iter__(self):
+		return self._iter_rows()
+
+	def _iter_rows(self):
+		fetch = super().fetchmany
+		while True:
+			started = perf_counter()
+			rows = fetch(ITER_BATCH)
+			self._charge(perf_counter() - started, len(rows) < ITER_BATCH)
+			if not rows:
+				return
+			yield from rows
+
+	def close(self):
+		self._finish()
+		super().close()
+
+
+class TimedConnection(sqlite3.Connection):
+	"""A connection whose statements are charged to the current ``Timings``."""
+
+	def cursor(self, factory=TimedCursor):
+		return super().cursor(factory)
+
+	def execute(self, sql, parameters=()):
+		return self.cursor().execute(sql, parameters)
+
+	def executemany(self, sql, seq_of_parameters):
+		return self.cursor().executemany(sql, seq_of_parameters)
+
+	def executescript(self, sql_script):
+		return self.cursor().executescript(sql_script)
+
+	def commit(self):
+		started = perf_counter()
+		try:
+			super().commit()
+		finally:
+			timings = getattr(_local, 'timings', None)
+			if timings is not None:
+				timings.db += perf_counter() - started
+
+
+def init_app(app):
+	"""Time every request of ``app`` and send the result as ``Server-Timing``."""
+	if not ENABLED:
+		return
+	from flask import before_render_template, request, template_rendered
+
+	@app.before_request
+	def start_timing():
+		start(f'{request.method} {request.path}')
+
+	@app.after_request
+	def server_timing(response):
+		timings = current()
+		if timings is not None:
+			response.headers['Server-Timing'] = timings.header()
+		return response
+
+	@app.teardown_request
+	def stop_timing(exception):
+		stop()
+
+	def render_started(sender, template, context, **extra):
+		timings = current()
+		if timings is not None:
+			timings.render_started = perf_counter()
+
+	def render_done(sender, template, context, **extra):
+		timings = current()
+		if timings is not None and timings.render_started is not None:
+			timings.render += perf_counter() - timings.render_started
+			timings.render_started = None
+
+	before_render_template.connect(render_started, app, weak=False)
+	template_rendered.connect(render_done, app, weak=False)
@@ -0,0 +1,65 @@
+"""
+Data version counter.
+
+``data_version`` holds a single number that triggers bump on every insert,
+update and delete of the rows reports are built from (attendance, the
+roster, teachers and their assignments), whichever code path made the write:
+marking, imports, HOD removals and cascades alike. Caches key their entries on it,
+so a cached result is never served for data that has since changed.
+``modified`` is the time (Unix seconds) of that last write, used for
+``Last-Modified``. Since migration 11 the attendance triggers sit on
+``attendance_marks``. Since migration 14 updates of students and teachers
+count only when they touch a column other than ``password_hash``, so
+password rehashes at login keep caches and ETags valid.
+"""
+
+TABLES = '''
+CREATE TABLE IF NOT EXISTS data_version (
+	id INTEGER PRIMARY KEY CHECK (id = 0),
+	version INTEGER NOT NULL,
+	modified INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO data_version (id, version) VALUES (0, 0);
+'''
+
+EVENTS = (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE'))
+
+TRACKED = ('attendance', 'students', 'teachers', 'teacher_assignments')
+
+# UPDATE OF these columns only: everything but password_hash
+UPDATE_COLUMNS = {
+	'students': 'roll_no, prn, name, class, semester',
+	'teachers': 'name, phone',
+}
+
+BUMP = "UPDATE data_version SET version = version + 1, modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 0;"
+
+
+def _of(table, event):
+	return f' OF {UPDATE_COLUMNS[table]}' if event == 'UPDATE' and table in UPDATE_COLUMNS else ''
+
+
+def triggers(tables):
+	return ''.join(
+		f'''
+CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event}{_of(table, event)} ON {table} BEGIN
+	{BUMP}
+END;
+'''
+		for table in tables
+		for suffix, event in EVENTS
+	)
+
+
+# the tables as of migrations 5-7; migration 11 moves the attendance ones to attendance_marks
+TRIGGERS = triggers(TRACKED)
+
+
+def current(db):
+	return db.execute('SELECT version FROM data_version WHERE id = 0').fetchone()[0]
+
+
+def state(db):
+	"""(version, modified) of the last write."""
+	row = db.execute('SELECT version, modified FROM data_version WHERE id = 0').fetchone()
+	return row[0], row[1]
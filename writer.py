@@ -0,0 +1,133 @@
+"""
+One writer thread per process for attendance and import writes.
+
+At the start of a period dozens of teachers save at once. ``Writer.run``
+hands each write to a single thread instead of letting every request
+thread queue up for the SQLite write lock. That thread applies whatever
+has queued up meanwhile in one ``BEGIN IMMEDIATE`` transaction (a group
+commit): one lock acquisition and one commit for the group. ``run`` blocks
+until the group is committed and returns the write's result, or raises
+its exception.
+
+Each write runs under its own savepoint, so one that raises is rolled
+back alone and the rest of its group still commits. Writes run exactly
+once: when another process (a second worker, a CLI command) holds the
+lock past ``busy_timeout``, the BEGIN or COMMIT statement is retried with
+exponential backoff, not the writes. An error that aborts the whole
+transaction (disk full, I/O error) fails every write of the group.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, SimpleQueue
+
+import metrics
+import timing
+
+GROUP_SIZE = int(os.environ.get('WRITER_GROUP', '64'))
+RETRIES = int(os.environ.get('WRITER_RETRIES', '5'))
+BACKOFF = float(os.environ.get('WRITER_BACKOFF', '0.05'))
+
+
+class Writer:
+	"""Runs ``fn(db, *args)`` calls on one thread, committing them in groups.
+
+	``connect``/``release`` hand the thread its writable connection, as for
+	``jobs.ExportJobs``. The thread starts on the first write in each process.
+	"""
+
+	def __init__(self, connect, release, group=GROUP_SIZE, retries=RETRIES, backoff=BACKOFF):
+		self.connect = connect
+		self.release = release
+		self.group = group
+		self.retries = retries
+		self.backoff = backoff
+		self._queue = None
+		self._pid = None
+		self._lock = threading.Lock()
+
+	def _start(self):
+		if self._pid != os.getpid():
+			with self._lock:
+				if self._pid != os.getpid():
+					# a forked worker starts its own thread; the parent's did not survive the fork
+					self._queue = SimpleQueue()
+					threading.Thread(target=self._loop, args=(self._queue,), name='writer', daemon=True).start()
+					self._pid = os.getpid()
+		return self._queue
+
+	def run(self, fn, *args):
+		"""Apply ``fn(db, *args)`` in the next group transaction; returns its result.
+
+		The caller's own connection must not be in a write transaction.
+		"""
+		started = time.perf_counter()
+		future = Future()
+		self._start().put((fn, args, future))
+		try:
+			return future.result()
+		finally:
+			elapsed = time.perf_counter() - started
+			metrics.WRITE_SECONDS.observe(elapsed)
+			timing.note('write', elapsed)
+
+	def _loop(self, queue):
+		db = self.connect()
+		while True:
+			jobs = [queue.get()]
+			while len(jobs) < self.group:
+				try:
+					jobs.append(queue.get_nowait())
+				except Empty:
+					break
+			timing.start('write group')
+			try:
+				self._commit(db, jobs)
+			finally:
+				timing.stop()
+				self.release(db)
+			metrics.flush()
+
+	def _retry(self, step):
+		for attempt in range(self.retries + 1):
+			try:
+				return step()
+			except sqlite3.OperationalError as exc:
+				if not metrics.is_locked(exc) or attempt == self.retries:
+					raise
+			metrics.WRITE_RETRIES.inc()
+			time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+	def _commit(self, db, jobs):
+		results = []
+		try:
+			started = time.perf_counter()
+			try:
+				self._retry(lambda: db.execute('BEGIN IMMEDIATE'))
+			finally:
+				metrics.DB_LOCK_WAIT.observe(time.perf_counter() - started)
+			for fn, args, _ in jobs:
+				db.execute('SAVEPOINT write')
+				try:
+					results.append((True, fn(db, *args)))
+				except Exception as exc:
+					db.execute('ROLLBACK TO write')
+					results.append((False, exc))
+				db.execute('RELEASE write')
+			self._retry(db.commit)
+		except Exception as exc:
+			if db.in_transaction:
+				db.rollback()
+			if metrics.is_locked(exc):
+				metrics.DB_LOCKED.inc('writer')
+			results = [(False, exc)] * len(jobs)
+		metrics.WRITE_GROUP.observe(len(jobs))
+		for (_, _, future), (ok, value) in zip(jobs, results):
+			if ok:
+				future.set_result(value)
+			else:
+				future.set_exception(value)